@@ -0,0 +1,95 @@
+import os
+import re
+import time
+
+from modules.async_db_session_manage import AsyncDBSessionManage
+from modules.comment_writer import stop_all
+from modules.db_session_manage import DBSessionManage
+from modules.replica import REPLICA_SETTINGS, set_read_only
+from views.async_base import AsyncRequest
+from views.async_projects import AsyncProjectsHandler, AsyncProjectHandler
+from views.async_users import AsyncUsersHandler, AsyncUserHandler
+from views.middleware import ReplicaRoutingMiddleware
+
+ROUTES = [
+    (re.compile(r'^/projects$'), AsyncProjectsHandler),
+    (re.compile(r'^/project/(?P<project_id>[^/]+)$'), AsyncProjectHandler),
+    (re.compile(r'^/users$'), AsyncUsersHandler),
+    (re.compile(r'^/user/(?P<user_id>[^/]+)$'), AsyncUserHandler),
+]
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application serving the routes of main.py with async handlers
+    :param dict scope: Connection scope
+    :param function receive: Receive an event
+    :param function send: Send an event
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    request = AsyncRequest(scope, body)
+    read_only = request.method in ReplicaRoutingMiddleware.READ_METHODS
+    set_read_only(read_only and not ReplicaRoutingMiddleware.is_primary_required({
+        'HTTP_X_READ_CONSISTENCY': request.headers.get('X-Read-Consistency', ''),
+        'HTTP_COOKIE': request.headers.get('Cookie', '')
+    }))
+    status_code, headers, content = 404, [(b'content-type', b'application/json')], b'{"error":"Not found"}'
+
+    for pattern, handler_class in ROUTES:
+        match = pattern.match(request.path)
+        if not match:
+            continue
+
+        handler = handler_class(request)
+        method = getattr(handler, request.method.lower(), None)
+        if method is None:
+            status_code, content = 405, b'{"error":"Method not allowed"}'
+            break
+
+        try:
+            await method(**match.groupdict())
+        finally:
+            set_read_only(False)
+
+        status_code = handler.response.status_code
+        headers = [(name.encode('latin-1'), value.encode('latin-1'))
+                   for name, value in handler.response.headers.items()]
+        if not read_only and status_code < 400:
+            headers.append((b'set-cookie', '{0}={1}; Max-Age={2}; Path=/; HttpOnly'.format(
+                REPLICA_SETTINGS['cookie'], int(time.time()), REPLICA_SETTINGS['read_your_writes']).encode('latin-1')))
+        content = handler.response.body
+        break
+
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def lifespan(receive, send):
+    """
+    Handle ASGI lifespan events: optional schema bootstrap on startup,
+    flush queues and close pools on shutdown
+    :param function receive: Receive an event
+    :param function send: Send an event
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if os.environ.get('TASKHUB_BOOTSTRAP_ON_STARTUP') == '1':
+                DBSessionManage.bootstrap_schema(os.environ.get('TASKHUB_DATABASE'))
+            await send({'type': 'lifespan.startup.complete'})
+
+        elif message['type'] == 'lifespan.shutdown':
+            stop_all()
+            await AsyncDBSessionManage.dispose_engines()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
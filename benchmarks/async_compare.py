@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from webob import Request
+
+from asgi import app as asgi_app
+from benchmarks.run import get_peak_rss_kb, get_percentile
+from benchmarks.seed import Seeder
+from main import app as wsgi_app
+from modules.async_db_session_manage import AsyncDBSessionManage
+from modules.db_session_manage import DBSessionManage
+
+ROUTES = (
+    'GET /projects',
+    'GET /project/<id>',
+    'GET /users',
+    'GET /user/<id>'
+)
+
+
+class LoadComparison(object):
+    """Send the same concurrent GET load to the WSGI and the ASGI app"""
+
+    def __init__(self, users, projects, seed):
+        """
+        Load comparison
+        :param int users: Number of seeded users
+        :param int projects: Number of seeded projects
+        :param int seed: Random seed
+        """
+        self.users = users
+        self.projects = projects
+        self.seed = seed
+
+    def get_paths(self, route, requests):
+        """
+        Get the paths of a route with random seeded ids, the same for both apps
+        :param str route: Route
+        :param int requests: Number of requests
+        :return list(str): Paths
+        """
+        generator = random.Random(self.seed)
+        path = route.split(' ', 1)[1]
+        count = self.projects if path.startswith('/project') else self.users
+
+        return [path.replace('<id>', str(generator.randint(1, count))) for _ in range(requests)]
+
+    def run_wsgi(self, paths, concurrency):
+        """
+        Call the WSGI app from concurrency threads
+        :param list(str) paths: Paths
+        :param int concurrency: Concurrent clients
+        :return dict: Metrics
+        """
+        def call(path):
+            started = time.perf_counter()
+            response = Request.blank(path).get_response(wsgi_app)
+            return time.perf_counter() - started, response.status_int
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(call, paths))
+
+        return get_metrics(results, time.perf_counter() - started)
+
+    def run_asgi(self, paths, concurrency):
+        """
+        Call the ASGI app from concurrency tasks of one event loop
+        :param list(str) paths: Paths
+        :param int concurrency: Concurrent clients
+        :return dict: Metrics
+        """
+        async def call(path, semaphore):
+            async with semaphore:
+                return await call_asgi(path)
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            started = time.perf_counter()
+            results = await asyncio.gather(*[call(path, semaphore) for path in paths])
+            elapsed = time.perf_counter() - started
+            await AsyncDBSessionManage.dispose_engines()
+            return get_metrics(results, elapsed)
+
+        return asyncio.run(run())
+
+    def run(self, routes, requests, concurrency_levels):
+        """
+        Run each route on both apps at each concurrency level
+        :param list(str) routes: Routes, as listed in ROUTES
+        :param int requests: Requests per route and level
+        :param list(int) concurrency_levels: Concurrent clients
+        :return dict: Metrics by route, concurrency and app
+        """
+        results = {}
+        for route in routes:
+            paths = self.get_paths(route, requests)
+            results[route] = {
+                str(concurrency): {
+                    'wsgi': self.run_wsgi(paths, concurrency),
+                    'asgi': self.run_asgi(paths, concurrency)
+                }
+                for concurrency in concurrency_levels
+            }
+
+        return results
+
+
+async def call_asgi(path):
+    """
+    Call the ASGI app in process
+    :param str path: Path
+    :return tuple: Duration in seconds and status code
+    """
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'query_string': query.encode('utf-8'),
+        'headers': [],
+        'client': ('127.0.0.1', 0)
+    }
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    started = time.perf_counter()
+    await asgi_app(scope, receive, send)
+    return time.perf_counter() - started, sent[0]['status']
+
+
+def get_metrics(results, elapsed):
+    """
+    Compute the metrics of a run
+    :param list(tuple) results: Duration and status code of each request
+    :param float elapsed: Wall time of the run
+    :return dict: Latency percentiles, throughput and errors
+    """
+    durations = sorted(duration for duration, _ in results)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, status in results if status >= 400),
+        'p50_ms': get_percentile(durations, 50) * 1000,
+        'p95_ms': get_percentile(durations, 95) * 1000,
+        'p99_ms': get_percentile(durations, 99) * 1000,
+        'throughput_rps': len(results) / elapsed if elapsed else 0.0
+    }
+
+
+def main():
+    """Seed a database and compare the WSGI and ASGI apps under the same load"""
+    parser = argparse.ArgumentParser(
+        description='Compare the TaskHub WSGI and ASGI apps under concurrent load and print JSON metrics')
+    parser.add_argument(
+        '--url', help='Database url (default: a new SQLite file in a temporary directory)')
+    parser.add_argument('--users', type=int, default=1000, help='Users to seed')
+    parser.add_argument('--projects', type=int, default=10000, help='Projects to seed')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per route and concurrency')
+    parser.add_argument('--concurrency', type=int, action='append', help='Concurrent clients (default: 1, 10, 50)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--route', action='append', choices=ROUTES, help='Routes to run (default: all)')
+    parser.add_argument('--no-seed', action='store_true', help='Use the data already in --url')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.environ['TASKHUB_DATABASE_URL'] = args.url or 'sqlite:///{0}'.format(
+        os.path.join(tempfile.mkdtemp(prefix='taskhub-benchmark-'), 'taskhub.db'))
+
+    DBSessionManage.bootstrap_schema(None)
+
+    if not args.no_seed:
+        db_session = DBSessionManage(None).get_db_session()
+        try:
+            Seeder(db_session, args.users, args.projects, 0, args.seed).run()
+        finally:
+            db_session.close()
+
+    comparison = LoadComparison(args.users, args.projects, args.seed)
+    results = comparison.run(args.route or ROUTES, args.requests, args.concurrency or [1, 10, 50])
+
+    report = {
+        'config': {
+            'database': DBSessionManage.get_engine(None).dialect.name,
+            'async_url': AsyncDBSessionManage.get_server_url().split('://', 1)[0],
+            'users': args.users,
+            'projects': args.projects,
+            'requests': args.requests,
+            'seed': args.seed,
+            'python': platform.python_version()
+        },
+        'routes': results,
+        'peak_rss_kb': get_peak_rss_kb()
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+    failed = sorted(route for route, levels in results.items()
+                    if any(metrics['errors'] for apps in levels.values() for metrics in apps.values()))
+    if failed:
+        sys.exit('Comparison failed, error responses on: {0}'.format(', '.join(failed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from webob import Request
+
+from benchmarks.run import QueryCounter, get_peak_rss_kb
+from benchmarks.seed import Seeder
+from main import app
+from modules.db_session_manage import DBSessionManage
+
+
+class BulkInsertBenchmark(object):
+    """Insert the same projects one request per row and through the bulk
+    endpoint, at several transaction sizes"""
+
+    def __init__(self, counter, users, seed):
+        """
+        Bulk insert benchmark
+        :param QueryCounter counter: Query counter of the app engine
+        :param int users: Number of seeded users
+        :param int seed: Random seed
+        """
+        self.counter = counter
+        self.users = users
+        self.seeder = Seeder(None, users, 0, 0, seed)
+
+    def get_items(self, rows):
+        """
+        Get params of new projects
+        :param int rows: Number of projects
+        :return list(dict): Project params
+        """
+        self.seeder.projects = rows
+        items = []
+        for project in self.seeder.get_projects():
+            items.append({
+                'deadline': project['deadline'].strftime('%Y-%m-%d'),
+                'description': project['description'][:100],
+                'designated': self.seeder.random.randint(1, self.users),
+                'leader': self.seeder.random.randint(1, self.users),
+                'status': project['status'],
+                'title': project['title']
+            })
+
+        return items
+
+    def run_per_row(self, items):
+        """
+        Create projects with one POST /projects per row
+        :param list(dict) items: Project params
+        :return dict: Metrics
+        """
+        errors = 0
+        before = self.counter.count
+        started = time.perf_counter()
+        for item in items:
+            response = Request.blank('/projects?' + urllib.parse.urlencode(item), method='POST').get_response(app)
+            if response.status_int >= 400:
+                errors += 1
+
+        return get_metrics(len(items), errors, time.perf_counter() - started, self.counter.count - before)
+
+    def run_bulk(self, items, transaction_size):
+        """
+        Create projects with a single POST /projects/bulk
+        :param list(dict) items: Project params
+        :param int transaction_size: Rows per transaction
+        :return dict: Metrics
+        """
+        request = Request.blank('/projects/bulk?transaction_size={0}'.format(transaction_size), method='POST')
+        request.content_type = 'application/json'
+        request.body = json.dumps(items).encode('utf-8')
+
+        before = self.counter.count
+        started = time.perf_counter()
+        response = request.get_response(app)
+        elapsed = time.perf_counter() - started
+
+        if response.status_int >= 400:
+            errors = len(items)
+        else:
+            errors = sum(1 for item in response.json['items'] if 'error' in item)
+
+        return get_metrics(len(items), errors, elapsed, self.counter.count - before)
+
+    def run(self, rows, transaction_sizes):
+        """
+        Run the per-row inserts and the bulk inserts at each transaction size
+        :param int rows: Projects inserted by each run
+        :param list(int) transaction_sizes: Rows per transaction of the bulk runs
+        :return dict: Metrics by run
+        """
+        results = {'per_row': self.run_per_row(self.get_items(rows))}
+        for transaction_size in transaction_sizes:
+            results['bulk_{0}'.format(transaction_size)] = self.run_bulk(self.get_items(rows), transaction_size)
+
+        return results
+
+
+def get_metrics(rows, errors, elapsed, queries):
+    """
+    Compute the metrics of a run
+    :param int rows: Rows sent
+    :param int errors: Rows not inserted
+    :param float elapsed: Wall time of the run
+    :param int queries: Statements executed
+    :return dict: Throughput, duration, statements and errors
+    """
+    return {
+        'rows': rows,
+        'errors': errors,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0,
+        'queries_per_row': float(queries) / rows if rows else 0.0
+    }
+
+
+def main():
+    """Seed users and compare per-row and bulk project inserts"""
+    parser = argparse.ArgumentParser(
+        description='Compare per-row and bulk project inserts and print JSON metrics')
+    parser.add_argument(
+        '--url', help='Database url (default: a new SQLite file in a temporary directory)')
+    parser.add_argument('--users', type=int, default=1000, help='Users to seed')
+    parser.add_argument('--rows', type=int, default=5000, help='Projects inserted by each run')
+    parser.add_argument(
+        '--transaction-size', type=int, action='append',
+        help='Rows per transaction of the bulk runs (default: 500, 5000)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.environ['TASKHUB_DATABASE_URL'] = args.url or 'sqlite:///{0}'.format(
+        os.path.join(tempfile.mkdtemp(prefix='taskhub-benchmark-'), 'taskhub.db'))
+
+    DBSessionManage.bootstrap_schema(None)
+
+    db_session = DBSessionManage(None).get_db_session()
+    try:
+        Seeder(db_session, args.users, 0, 0, args.seed).run()
+    finally:
+        db_session.close()
+
+    counter = QueryCounter(DBSessionManage.get_engine(None))
+    benchmark = BulkInsertBenchmark(counter, args.users, args.seed)
+    results = benchmark.run(args.rows, args.transaction_size or [500, 5000])
+
+    report = {
+        'config': {
+            'database': DBSessionManage.get_engine(None).dialect.name,
+            'users': args.users,
+            'rows': args.rows,
+            'seed': args.seed,
+            'python': platform.python_version()
+        },
+        'runs': results,
+        'peak_rss_kb': get_peak_rss_kb()
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+    failed = sorted(name for name, metrics in results.items() if metrics['errors'])
+    if failed:
+        sys.exit('Benchmark failed, rows not inserted by: {0}'.format(', '.join(failed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from sqlalchemy import event
+from webob import Request
+
+from benchmarks.seed import Seeder
+from main import app
+from modules.db_session_manage import DBSessionManage
+
+ROUTES = (
+    'GET /projects',
+    'GET /projects?fields=id,title,status',
+    'GET /projects?status=overdue',
+    'GET /projects?stream=1',
+    'GET /projects/export',
+    'GET /projects/export?format=csv',
+    'POST /projects',
+    'POST /projects/bulk',
+    'PUT /projects/status',
+    'GET /project/<id>',
+    'PUT /project/<id>',
+    'GET /project/<id>/comments',
+    'DELETE /project/<id>',
+    'GET /users',
+    'GET /users?stream=1',
+    'GET /users/export',
+    'POST /users',
+    'POST /users/bulk',
+    'GET /user/<id>',
+    'PUT /user/<id>',
+    'DELETE /user/<id>'
+)
+CREATE_ROUTES = {'POST /projects': 'project', 'POST /users': 'user'}
+
+
+class QueryCounter(object):
+    """Count the statements executed on an engine"""
+
+    def __init__(self, engine):
+        """
+        Query counter
+        :param Engine engine: Database engine
+        """
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+class Benchmark(object):
+    """Drive every route of the WSGI app and collect per-route metrics"""
+
+    BULK_SIZE = 100
+
+    def __init__(self, app, counter, users, projects, seed):
+        """
+        Benchmark
+        :param WSGIApplication app: WSGI application
+        :param QueryCounter counter: Query counter of the app engine
+        :param int users: Number of seeded users
+        :param int projects: Number of seeded projects
+        :param int seed: Random seed
+        """
+        self.app = app
+        self.counter = counter
+        self.users = users
+        self.projects = projects
+        self.seeder = Seeder(None, users, projects, 0, seed)
+        self.created = {'project': [], 'user': []}
+
+    def run(self, routes, requests):
+        """
+        Run each route requests times
+        :param list(str) routes: Routes, as listed in ROUTES
+        :param int requests: Requests per route
+        :return dict: Metrics by route
+        """
+        return {route: self.run_route(route, requests) for route in routes}
+
+    def run_route(self, route, requests):
+        """
+        Run a route and compute its metrics
+        :param str route: Route
+        :param int requests: Number of requests
+        :return dict: Latency percentiles, throughput, queries, response size, errors
+            and the status and body of the first error
+        """
+        durations = []
+        queries = 0
+        size = 0
+        errors = 0
+        first_error = None
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            request = self.get_request(route)
+            if request is None:
+                break
+
+            before = self.counter.count
+            request_started = time.perf_counter()
+            response = request.get_response(self.app)
+            size += len(response.body)
+            durations.append(time.perf_counter() - request_started)
+            queries += self.counter.count - before
+
+            error = self.get_error(route, response)
+            if error is not None:
+                errors += 1
+                if first_error is None:
+                    first_error = error
+            else:
+                self.on_response(route, response)
+        elapsed = time.perf_counter() - started
+
+        durations.sort()
+        return {
+            'requests': len(durations),
+            'errors': errors,
+            'first_error': first_error,
+            'p50_ms': get_percentile(durations, 50) * 1000,
+            'p95_ms': get_percentile(durations, 95) * 1000,
+            'p99_ms': get_percentile(durations, 99) * 1000,
+            'throughput_rps': len(durations) / elapsed if elapsed else 0.0,
+            'queries_per_request': float(queries) / len(durations) if durations else 0.0,
+            'bytes_per_request': float(size) / len(durations) if durations else 0.0
+        }
+
+    def get_request(self, route):
+        """
+        Build a request of a route with random ids and bodies
+        :param str route: Route
+        :return Request: Request or None when the route has nothing left to act on
+        """
+        method, path = route.split(' ', 1)
+        entity = 'project' if path.startswith('/project') else 'user'
+
+        if method == 'DELETE':
+            if not self.created[entity]:
+                return None
+            path = path.replace('<id>', str(self.created[entity].pop()))
+        elif '<id>' in path:
+            path = path.replace('<id>', str(self.get_id(entity)))
+
+        body = None
+        if path.endswith('/bulk'):
+            body = [self.get_params(entity) for _ in range(self.BULK_SIZE)]
+        elif method == 'PUT' and path == '/projects/status':
+            path += '?status=overdue'
+            body = {'status': 'analysis'}
+        elif method == 'PUT':
+            body = self.get_params(entity)
+        elif method == 'POST':
+            path += '?' + urllib.parse.urlencode(self.get_params(entity))
+
+        request = Request.blank(path, method=method)
+        if body is not None:
+            request.content_type = 'application/json'
+            request.body = json.dumps(body).encode('utf-8')
+
+        return request
+
+    @staticmethod
+    def get_error(route, response):
+        """
+        Get the error of a response: an error status, or a bulk create
+        response with failed items, which answers 200
+        :param str route: Route
+        :param Response response: Response
+        :return str: Status and body of the error, or None on success
+        """
+        if response.status_int >= 400:
+            return '{0} {1}'.format(response.status, response.body[:200].decode('utf-8', 'replace'))
+
+        if route.endswith('/bulk'):
+            failed = [item for item in response.json['items'] if 'error' in item]
+            if failed:
+                return '{0} of {1} items failed, first: {2}'.format(
+                    len(failed), len(response.json['items']), failed[0]['error'])
+
+        return None
+
+    def on_response(self, route, response):
+        """
+        Keep the ids created by POST routes so DELETE routes can remove them
+        :param str route: Route
+        :param Response response: Response
+        """
+        if route in CREATE_ROUTES:
+            self.created[CREATE_ROUTES[route]].append(response.json['id'])
+
+    def get_id(self, entity):
+        """
+        Get a random seeded id
+        :param str entity: project or user
+        :return int: Id
+        """
+        return self.seeder.random.randint(1, self.projects if entity == 'project' else self.users)
+
+    def get_params(self, entity):
+        """
+        Get params to create or update an entity
+        :param str entity: project or user
+        :return dict: Params
+        """
+        if entity == 'user':
+            return {'fullname': 'Benchmark User {0}'.format(self.seeder.random.randint(1, 10 ** 6))}
+
+        project = next(self.seeder.get_projects())
+        return {
+            'deadline': project['deadline'].strftime('%Y-%m-%d'),
+            'description': project['description'][:100],
+            'designated': self.get_id('user'),
+            'leader': self.get_id('user'),
+            'status': project['status'],
+            'title': project['title']
+        }
+
+
+def get_percentile(values, percentile):
+    """
+    Get the nearest-rank percentile of sorted values
+    :param list(float) values: Sorted values
+    :param int percentile: Percentile
+    :return float: Value or 0.0 when empty
+    """
+    if not values:
+        return 0.0
+
+    index = max(int(round(percentile / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def get_peak_rss_kb():
+    """
+    Get the peak resident set size of the process
+    :return int: Peak RSS in KiB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def main():
+    """Seed a database and benchmark every route of main.py"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the TaskHub WSGI routes and print JSON metrics')
+    parser.add_argument(
+        '--url', help='Database url (default: a new SQLite file in a temporary directory)')
+    parser.add_argument('--users', type=int, default=1000, help='Users to seed')
+    parser.add_argument('--projects', type=int, default=10000, help='Projects to seed')
+    parser.add_argument('--comments', type=int, default=5, help='Average comments per project')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--route', action='append', choices=ROUTES, help='Routes to run (default: all)')
+    parser.add_argument('--no-seed', action='store_true', help='Use the data already in --url')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.environ['TASKHUB_DATABASE_URL'] = args.url or 'sqlite:///{0}'.format(
+        os.path.join(tempfile.mkdtemp(prefix='taskhub-benchmark-'), 'taskhub.db'))
+
+    DBSessionManage.bootstrap_schema(None)
+
+    seeded = None
+    if not args.no_seed:
+        db_session = DBSessionManage(None).get_db_session()
+        try:
+            seeded = Seeder(db_session, args.users, args.projects, args.comments, args.seed).run()
+        finally:
+            db_session.close()
+
+    counter = QueryCounter(DBSessionManage.get_engine(None))
+    benchmark = Benchmark(app, counter, args.users, args.projects, args.seed)
+    results = benchmark.run(args.route or ROUTES, args.requests)
+
+    report = {
+        'config': {
+            'database': DBSessionManage.get_engine(None).dialect.name,
+            'users': args.users,
+            'projects': args.projects,
+            'comments': args.comments,
+            'requests': args.requests,
+            'seed': args.seed,
+            'python': platform.python_version()
+        },
+        'seeded': seeded,
+        'routes': results,
+        'peak_rss_kb': get_peak_rss_kb()
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+    # Error responses are fast and would pass for throughput
+    failed = sorted(route for route, metrics in results.items() if metrics['errors'])
+    if failed:
+        sys.exit('Benchmark failed, error responses on: {0}'.format(', '.join(failed)))
+
+    # e.g. DELETE routes run without the POST routes creating their rows
+    empty = sorted(route for route, metrics in results.items() if not metrics['requests'])
+    if empty:
+        sys.exit('Benchmark failed, no request run on: {0}'.format(', '.join(empty)))
+
+
+if __name__ == '__main__':
+    main()
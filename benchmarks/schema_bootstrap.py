@@ -0,0 +1,175 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+
+from webob import Request
+
+from benchmarks.run import QueryCounter, get_peak_rss_kb
+from benchmarks.seed import Seeder
+from main import app
+from models.base import MYSQL
+from models.project import Project
+from models.user import User
+from modules.cache import project_cache, user_cache
+from modules.db_session_manage import DBSessionManage
+
+ROUTES = (
+    'GET /projects',
+    'GET /project/<id>',
+    'GET /users',
+    'GET /user/<id>'
+)
+
+
+@contextlib.contextmanager
+def create_all_per_session():
+    """
+    Run create_all on the project and user tables each time a DBSessionManage
+    is built, as the application did before the schema bootstrap
+    """
+    init = DBSessionManage.__init__
+
+    def init_with_create_all(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        MYSQL.metadata.create_all(self.engine, [Project.__table__, User.__table__])
+
+    DBSessionManage.__init__ = init_with_create_all
+    try:
+        yield
+    finally:
+        DBSessionManage.__init__ = init
+
+
+class SchemaBootstrapBenchmark(object):
+    """Count the statements of each request with table creation on the
+    request path, as before the schema bootstrap, and without it"""
+
+    def __init__(self, counter, users, projects, seed):
+        """
+        Schema bootstrap benchmark
+        :param QueryCounter counter: Query counter of the app engine
+        :param int users: Number of seeded users
+        :param int projects: Number of seeded projects
+        :param int seed: Random seed
+        """
+        self.counter = counter
+        self.users = users
+        self.projects = projects
+        self.seed = seed
+
+    def get_paths(self, route, requests):
+        """
+        Get the paths of a route with random seeded ids, the same for both runs
+        :param str route: Route
+        :param int requests: Number of requests
+        :return list(str): Paths
+        """
+        generator = random.Random(self.seed)
+        path = route.split(' ', 1)[1]
+        count = self.projects if path.startswith('/project') else self.users
+
+        return [path.replace('<id>', str(generator.randint(1, count))) for _ in range(requests)]
+
+    def run_paths(self, paths):
+        """
+        Call the WSGI app with each path, on empty entity caches so both
+        runs read the same rows
+        :param list(str) paths: Paths
+        :return dict: Requests, errors and statements per request
+        """
+        project_cache.backend.clear()
+        user_cache.backend.clear()
+
+        errors = 0
+        before = self.counter.count
+        for path in paths:
+            if Request.blank(path).get_response(app).status_int >= 400:
+                errors += 1
+
+        return {
+            'requests': len(paths),
+            'errors': errors,
+            'queries_per_request': float(self.counter.count - before) / len(paths) if paths else 0.0
+        }
+
+    def run(self, routes, requests):
+        """
+        Run each route with and without table creation per session
+        :param list(str) routes: Routes, as listed in ROUTES
+        :param int requests: Requests per route and run
+        :return dict: Metrics by route and run
+        """
+        results = {}
+        for route in routes:
+            paths = self.get_paths(route, requests)
+            with create_all_per_session():
+                before = self.run_paths(paths)
+
+            results[route] = {'create_all_per_session': before, 'bootstrapped': self.run_paths(paths)}
+
+        return results
+
+
+def main():
+    """Seed a database and count the statements per request before and after the schema bootstrap"""
+    parser = argparse.ArgumentParser(
+        description='Count the statements per request with and without table creation on the request '
+                    'path and print JSON metrics')
+    parser.add_argument(
+        '--url', help='Database url (default: a new SQLite file in a temporary directory)')
+    parser.add_argument('--users', type=int, default=100, help='Users to seed')
+    parser.add_argument('--projects', type=int, default=1000, help='Projects to seed')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per route and run')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--route', action='append', choices=ROUTES, help='Routes to run (default: all)')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.environ['TASKHUB_DATABASE_URL'] = args.url or 'sqlite:///{0}'.format(
+        os.path.join(tempfile.mkdtemp(prefix='taskhub-benchmark-'), 'taskhub.db'))
+
+    DBSessionManage.bootstrap_schema(None)
+
+    db_session = DBSessionManage(None).get_db_session()
+    try:
+        Seeder(db_session, args.users, args.projects, 0, args.seed).run()
+    finally:
+        db_session.close()
+
+    counter = QueryCounter(DBSessionManage.get_engine(None))
+    benchmark = SchemaBootstrapBenchmark(counter, args.users, args.projects, args.seed)
+    results = benchmark.run(args.route or ROUTES, args.requests)
+
+    report = {
+        'config': {
+            'database': DBSessionManage.get_engine(None).dialect.name,
+            'users': args.users,
+            'projects': args.projects,
+            'requests': args.requests,
+            'seed': args.seed,
+            'python': platform.python_version()
+        },
+        'routes': results,
+        'peak_rss_kb': get_peak_rss_kb()
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+    failed = sorted(route for route, runs in results.items()
+                    if any(metrics['errors'] or not metrics['requests'] for metrics in runs.values()))
+    if failed:
+        sys.exit('Benchmark failed, error responses or no request on: {0}'.format(', '.join(failed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import datetime
+import random
+
+from models.project import Project, ProjectComments, ProjectDesignated, ProjectLeader
+from models.user import User
+
+STATUSES = (('analysis', 30), ('development', 35), ('review', 10), ('done', 20), ('canceled', 5))
+FIRST_NAMES = ('Ana', 'Bruno', 'Carla', 'Diego', 'Elisa', 'Fabio', 'Gabriela', 'Hugo', 'Iara', 'Joao')
+LAST_NAMES = ('Almeida', 'Barbosa', 'Costa', 'Dias', 'Ferreira', 'Lima', 'Moura', 'Silva', 'Souza')
+WORDS = (
+    'api', 'billing', 'cache', 'dashboard', 'export', 'import', 'invoice', 'login', 'mobile',
+    'migration', 'onboarding', 'report', 'search', 'settings', 'signup', 'sync', 'webhook'
+)
+
+INSERT_CHUNK_SIZE = 1000
+
+
+class Seeder(object):
+    """
+    Generate a reproducible data set: users, projects with a skewed status
+    mix and deadlines around today, designated and leader users drawn with
+    a popularity bias, and a long-tailed number of comments per project.
+    """
+
+    def __init__(self, db_session, users, projects, comments, seed=1):
+        """
+        Seeder
+        :param session db_session: Database session
+        :param int users: Number of users
+        :param int projects: Number of projects
+        :param int comments: Average number of comments per project
+        :param int seed: Random seed
+        """
+        self.db_session = db_session
+        self.users = users
+        self.projects = projects
+        self.comments = comments
+        self.random = random.Random(seed)
+        self.now = datetime.datetime.combine(datetime.date.today(), datetime.time())
+
+    def run(self):
+        """
+        Insert the data set, one table after the other
+        :return dict: Number of rows inserted by table
+        """
+        counts = {
+            User.__tablename__: self.insert(User.__table__, self.get_users()),
+            Project.__tablename__: self.insert(Project.__table__, self.get_projects())
+        }
+        counts[ProjectDesignated.__tablename__] = self.insert(
+            ProjectDesignated.__table__, self.get_assignments(1, 4))
+        counts[ProjectLeader.__tablename__] = self.insert(
+            ProjectLeader.__table__, self.get_assignments(1, 1))
+        counts[ProjectComments.__tablename__] = self.insert(
+            ProjectComments.__table__, self.get_comments())
+
+        Project.reset_comments_count(self.db_session)
+        self.db_session.commit()
+
+        return counts
+
+    def insert(self, table, rows):
+        """
+        Insert rows with chunked executemany
+        :param Table table: Table
+        :param iterable rows: Column values of each row
+        :return int: Number of rows inserted
+        """
+        count = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == INSERT_CHUNK_SIZE:
+                self.db_session.execute(table.insert(), chunk)
+                count += len(chunk)
+                chunk = []
+
+        if chunk:
+            self.db_session.execute(table.insert(), chunk)
+            count += len(chunk)
+
+        self.db_session.commit()
+        return count
+
+    def get_users(self):
+        """
+        Generate users
+        :return generator(dict): User rows
+        """
+        for id in range(1, self.users + 1):
+            created_at = self.get_past_datetime(730)
+            yield {
+                'id': id,
+                'created_at': created_at,
+                'fullname': '{0} {1} {2}'.format(
+                    self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES), id),
+                'updated_at': created_at
+            }
+
+    def get_projects(self):
+        """
+        Generate projects
+        :return generator(dict): Project rows
+        """
+        statuses = [status for status, _ in STATUSES]
+        weights = [weight for _, weight in STATUSES]
+
+        for id in range(1, self.projects + 1):
+            created_at = self.get_past_datetime(365)
+            yield {
+                'id': id,
+                'comments_count': 0,
+                'created_at': created_at,
+                'deadline': created_at + datetime.timedelta(days=self.random.randint(7, 540)),
+                'description': ' '.join(self.random.choice(WORDS) for _ in range(20)),
+                'status': self.random.choices(statuses, weights)[0],
+                'title': '{0} {1} {2}'.format(
+                    self.random.choice(WORDS), self.random.choice(WORDS), id),
+                'updated_at': created_at + datetime.timedelta(hours=self.random.randint(0, 2000))
+            }
+
+    def get_assignments(self, minimum, maximum):
+        """
+        Generate assignment rows, a few users being assigned to most projects
+        :param int minimum: Minimum users per project
+        :param int maximum: Maximum users per project
+        :return generator(dict): Assignment rows
+        """
+        for project_id in range(1, self.projects + 1):
+            user_ids = set(self.get_popular_user_id()
+                           for _ in range(self.random.randint(minimum, maximum)))
+            for user_id in sorted(user_ids):
+                yield {'project_id': project_id, 'user_id': user_id}
+
+    def get_comments(self):
+        """
+        Generate comments with a long tail: most projects have few comments
+        and some have many times the average
+        :return generator(dict): Comment rows
+        """
+        for project_id in range(1, self.projects + 1):
+            count = int(self.random.paretovariate(1.5) * self.comments / 3)
+            for _ in range(count):
+                yield {
+                    'created_at': self.get_past_datetime(365),
+                    'description': ' '.join(self.random.choice(WORDS) for _ in range(12)),
+                    'project_id': project_id,
+                    'reporter': self.get_popular_user_id()
+                }
+
+    def get_popular_user_id(self):
+        """
+        Get a user id, lower ids being much more likely
+        :return int: User id
+        """
+        return min(int(self.random.expovariate(10.0 / self.users)) + 1, self.users)
+
+    def get_past_datetime(self, days):
+        """
+        Get a datetime up to days before the start of today
+        :param int days: Days
+        :return datetime: Datetime
+        """
+        return self.now - datetime.timedelta(seconds=self.random.randint(0, days * 86400))
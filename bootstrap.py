@@ -0,0 +1,29 @@
+import argparse
+
+from modules.db_session_manage import DBSessionManage
+from modules.project_stats import ProjectStatsModule
+
+
+def main():
+    """Create or verify the TaskHub schema of each given database"""
+    parser = argparse.ArgumentParser(
+        description='Create or verify the TaskHub tables and record the schema version')
+    parser.add_argument(
+        'databases', nargs='*', default=[None],
+        help='Databases to bootstrap (default: the server default database)')
+    parser.add_argument(
+        '--reconcile-stats', type=int, metavar='MAX_AGE', nargs='?', const=0,
+        help='Also recompute the project stats counters, unless reconciled less than MAX_AGE seconds ago')
+    args = parser.parse_args()
+
+    for database in args.databases:
+        version = DBSessionManage.bootstrap_schema(database)
+        print('{0}: schema version {1}'.format(database or 'default', version))
+
+        if args.reconcile_stats is not None:
+            ProjectStatsModule.reconcile(database, args.reconcile_stats)
+            print('{0}: project stats reconciled'.format(database or 'default'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import sys
+
+from modules.importer import IMPORT_SETTINGS, Importer
+
+
+def main():
+    """Import users, projects and comments files into a TaskHub database"""
+    parser = argparse.ArgumentParser(
+        description='Import NDJSON or CSV files (optionally .gz) into a TaskHub database, '
+                    'users first, then projects, then comments, keeping their ids')
+    parser.add_argument('--database', help='Database (default: the server default database)')
+    parser.add_argument('--users', help='Users file: id, fullname, created_at, updated_at')
+    parser.add_argument(
+        '--projects', help='Projects file: id, title, description, status, deadline, '
+                           'designated, leader, created_at, updated_at')
+    parser.add_argument('--comments', help='Comments file: id, project_id, reporter, description, created_at')
+    parser.add_argument('--checkpoint', help='Checkpoint file to resume from and save progress to')
+    parser.add_argument('--errors', help='File for rejected records, as JSON lines (default: stderr)')
+    parser.add_argument('--workers', type=int, default=IMPORT_SETTINGS['workers'],
+                        help='Validation processes, 0 to validate in this process')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_SETTINGS['chunk_size'],
+                        help='Records per INSERT statement')
+    parser.add_argument('--transaction-size', type=int, default=IMPORT_SETTINGS['transaction_size'],
+                        help='Records per transaction')
+    args = parser.parse_args()
+
+    if not (args.users or args.projects or args.comments):
+        parser.error('at least one of --users, --projects and --comments is required')
+
+    errors = open(args.errors, 'a') if args.errors else sys.stderr
+    try:
+        importer = Importer(
+            args.database, {'users': args.users, 'projects': args.projects, 'comments': args.comments},
+            args.checkpoint, args.workers, args.chunk_size, args.transaction_size, errors)
+        importer.run()
+
+    except Exception as error:
+        sys.exit('Import failed: {0}'.format(error))
+
+    finally:
+        if errors is not sys.stderr:
+            errors.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,82 @@
+import os
+
 import webapp2
 
-from views.users import UsersHandler, UserHandler
-from views.projects import ProjectsHandler, ProjectHandler
+from modules.db_session_manage import DBSessionManage
+from modules.search_index import rebuild_index
+from views.middleware import ReplicaRoutingMiddleware, SQLInstrumentationMiddleware, UnitOfWorkMiddleware
+from views.users import UsersHandler, UsersBulkHandler, UsersExportHandler, UserHandler
+from views.projects import (
+    ProjectsHandler, ProjectsBulkHandler, ProjectsStatusHandler, ProjectsStatsHandler,
+    ProjectsExportHandler, ProjectHandler, ProjectCommentsHandler
+)
 
 
-app = webapp2.WSGIApplication([
+app = SQLInstrumentationMiddleware(ReplicaRoutingMiddleware(UnitOfWorkMiddleware(webapp2.WSGIApplication([
     webapp2.Route(
         '/projects',
         handler=ProjectsHandler,
         name='projects'
     ),
+    webapp2.Route(
+        '/projects/bulk',
+        handler=ProjectsBulkHandler,
+        name='projects_bulk'
+    ),
+    webapp2.Route(
+        '/projects/status',
+        handler=ProjectsStatusHandler,
+        name='projects_status'
+    ),
+    webapp2.Route(
+        '/projects/stats',
+        handler=ProjectsStatsHandler,
+        name='projects_stats'
+    ),
+    webapp2.Route(
+        '/projects/export',
+        handler=ProjectsExportHandler,
+        name='projects_export'
+    ),
     webapp2.Route(
         '/project/<project_id>',
         handler=ProjectHandler,
         name='project'
     ),
+    webapp2.Route(
+        '/project/<project_id>/comments',
+        handler=ProjectCommentsHandler,
+        name='project_comments'
+    ),
     webapp2.Route(
         '/users',
         handler=UsersHandler,
         name='users'
     ),
+    webapp2.Route(
+        '/users/bulk',
+        handler=UsersBulkHandler,
+        name='users_bulk'
+    ),
+    webapp2.Route(
+        '/users/export',
+        handler=UsersExportHandler,
+        name='users_export'
+    ),
     webapp2.Route(
         '/user/<user_id>',
         handler=UserHandler,
         name='user'
     ),
-])
+]))))
+
+
+if os.environ.get('TASKHUB_BOOTSTRAP_ON_STARTUP') == '1':
+    DBSessionManage.bootstrap_schema(os.environ.get('TASKHUB_DATABASE'))
+
+if os.environ.get('TASKHUB_SEARCH_INDEX_ON_STARTUP') == '1':
+    startup_session = DBSessionManage(os.environ.get('TASKHUB_DATABASE')).get_db_session()
+    try:
+        rebuild_index(os.environ.get('TASKHUB_DATABASE'), startup_session)
+    finally:
+        startup_session.close()
@@ -0,0 +1,3 @@
+from sqlalchemy.ext.declarative import declarative_base
+
+MYSQL = declarative_base()
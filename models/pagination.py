@@ -0,0 +1,127 @@
+import base64
+import datetime
+import json
+
+from sqlalchemy import and_, asc, false, or_
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def get_limit(params):
+    """
+    Get page size from request params
+    :param dict params: Request params
+    :return int: Page size
+    """
+    try:
+        limit = int(params.get('limit') or DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        raise Exception('Invalid limit', 400)
+
+    if limit < 1:
+        raise Exception('Invalid limit', 400)
+
+    return min(limit, MAX_LIMIT)
+
+
+def encode_cursor(values):
+    """
+    Encode the last seen keyset values as an opaque cursor token
+    :param list values: Keyset values of the last row
+    :return str: Cursor token
+    """
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            value = {'dt': value.isoformat()}
+        encoded.append(value)
+
+    return base64.urlsafe_b64encode(
+        json.dumps(encoded, separators=(',', ':')).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    """
+    Decode a cursor token into keyset values
+    :param str cursor: Cursor token
+    :param int size: Expected number of keyset values
+    :return list: Keyset values
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError(cursor)
+
+        return [
+            datetime.datetime.fromisoformat(value['dt']) if isinstance(value, dict) else value
+            for value in values
+        ]
+
+    except (TypeError, ValueError, KeyError):
+        raise Exception('Invalid cursor', 400)
+
+
+def keyset_filter(keyset, values):
+    """
+    Build the condition selecting rows after the given keyset values.
+    NULLs follow MySQL ordering: first on ascending, last on descending.
+    :param list keyset: List of (column, asc|desc) pairs
+    :param list values: Keyset values of the last seen row
+    :return BooleanClauseList: Filter condition
+    """
+    conditions = []
+    equals = []
+    for (column, direction), value in zip(keyset, values):
+        conditions.append(and_(*(equals + [_after(column, direction, value)])))
+        equals.append(column.is_(None) if value is None else column == value)
+
+    return or_(*conditions)
+
+
+def paginate(query, keyset, params):
+    """
+    Get one page of query ordered by keyset
+    :param Query query: Query
+    :param list keyset: List of (column, asc|desc) pairs, unique as a whole
+    :param dict params: Request params with optional limit and cursor
+    :return tuple: List of rows and next page cursor or None
+    """
+    limit = get_limit(params)
+
+    if params.get('cursor'):
+        values = decode_cursor(params['cursor'], len(keyset))
+        query = query.filter(keyset_filter(keyset, values))
+
+    rows = query.order_by(
+        *[direction(column) for column, direction in keyset]
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column, _ in keyset])
+
+    return rows, next_cursor
+
+
+def _after(column, direction, value):
+    """
+    Condition for column values sorted after value
+    :param Column column: Column
+    :param function direction: asc or desc
+    :param value: Last seen value
+    :return ClauseElement: Condition
+    """
+    if direction is asc:
+        return column.isnot(None) if value is None else column > value
+
+    if value is None:
+        return false()
+
+    if column.expression.nullable:
+        return or_(column < value, column.is_(None))
+
+    return column < value
+
@@ -1,43 +1,84 @@
+import collections
 import datetime
+import os
+import random
 
-from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, String, asc, desc, text
-from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import (
+    BigInteger, Column, DateTime, ForeignKey, Index, Integer, SmallInteger, String, asc, desc, func, select, text)
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import object_session
 
-MYSQL = declarative_base()
+from models.base import MYSQL
+from models.pagination import decode_cursor, encode_cursor, get_limit, paginate
 
 
 class Project(MYSQL):
     """Project Model"""
     __tablename__ = "project"
+    # Searches read pages in keyset order (order_by column, title, id) from
+    # the index of their order_by column; InnoDB appends id to every index.
+    # A status filter reads ix_project_status_title, or ix_project_status
+    # (status, id) when ordering by id, and sorts the matches otherwise.
+    __table_args__ = (
+        Index('ix_project_created_at_title', 'created_at', 'title'),
+        Index('ix_project_deadline_title', 'deadline', 'title'),
+        Index('ix_project_status_title', 'status', 'title'),
+        Index('ix_project_title', 'title'),
+        Index('ix_project_updated_at_title', 'updated_at', 'title'),
+        Index('ix_project_status', 'status'),
+    )
+    DROPPED_INDEXES = (
+        'ix_project_status_created_at', 'ix_project_status_deadline', 'ix_project_status_created_at_title',
+        'ix_project_status_deadline_title', 'ix_project_status_updated_at_title'
+    )
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
-    created_at = Column(DateTime, server_default=text('now()'))
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    comments_count = Column(BigInteger, nullable=False, default=0, server_default=text('0'))
+    created_at = Column(DateTime, server_default=func.now())
     deadline = Column(DateTime)
     description = Column(String(500), nullable=False)
-    designateds = Column(BigInteger, ForeignKey('user.id'), nullable=True)
-    leaders = Column(BigInteger, ForeignKey('user.id'), nullable=True)
     status = Column(String(30), nullable=False, default='analysis')
     title = Column(String(100), nullable=False)
-    updated_at = Column(DateTime, server_default=text('now()'))
+    updated_at = Column(DateTime, server_default=func.now())
+    version = Column(BigInteger, nullable=False, default=1, server_default=text('1'))
+
+    COUNT_MODES = ('estimate', 'exact', 'none')
+    ESTIMATE_COUNT_CAP = 10000
+    FIELDS = (
+        'id', 'comments_count', 'created_at', 'deadline', 'description',
+        'designated', 'leader', 'status', 'title', 'updated_at'
+    )
+    FILTER_FIELDS = ('designated', 'end_at', 'leader', 'start_at', 'status')
+    ORDER_BY_FIELDS = ('created_at', 'deadline', 'id', 'status', 'title', 'updated_at')
+    RELATION_FIELDS = ('designated', 'leader')
 
     def to_dict(self):
         """
         Return project details in dict format
         :return Project
         """
+        db_session = object_session(self)
+
         return {
             'id': self.id,
+            'comments_count': self.comments_count,
             'created_at': self.created_at,
             'deadline': self.deadline,
             'description': self.description,
-            'designated': self.designated,
-            'leader': self.leader,
+            'designated': ProjectDesignated.get_user_ids_by_project_ids(
+                [self.id], db_session).get(self.id, []),
+            'leader': ProjectLeader.get_user_ids_by_project_ids(
+                [self.id], db_session).get(self.id, []),
             'status': self.status,
             'title': self.title,
             'updated_at': self.updated_at
         }
 
+    def mark_changed(self):
+        """Bump updated_at, with the database clock like touch, and version"""
+        self.updated_at = func.now()
+        self.version = Project.version + 1
+
     @classmethod
     def get_by_id(cls, id, db_session):
         """
@@ -51,27 +92,94 @@ class Project(MYSQL):
         ).first()
 
     @classmethod
-    def get_by_designated(cls, user_key, db_session):
+    def get_version(cls, id, db_session):
+        """
+        Get the version of a project without loading the project
+        :param int id: Project id
+        :param session db_session: Database session
+        :return int: Version or None when not found
+        """
+        return db_session.query(cls.version).filter(
+            cls.id == id
+        ).scalar()
+
+    @classmethod
+    def touch(cls, ids, db_session):
+        """
+        Bump updated_at and version of projects whose dict changed indirectly
+        :param iterable ids: Project ids
+        :param session db_session: Database session
+        """
+        ids = sorted(ids)
+        if ids:
+            db_session.query(cls).filter(cls.id.in_(ids)).update(
+                {cls.updated_at: func.now(), cls.version: cls.version + 1}, synchronize_session=False)
+
+    @classmethod
+    def get_comments_count(cls, id, db_session):
+        """
+        Get the maintained comments counter of a project
+        :param int id: Project id
+        :param session db_session: Database session
+        :return int: Comments count or None when not found
+        """
+        row = db_session.query(cls.comments_count).filter(
+            cls.id == id
+        ).first()
+
+        return row.comments_count if row else None
+
+    @classmethod
+    def increment_comments_count(cls, id, amount, db_session):
+        """
+        Add to the comments counter of a project, bumping its version
+        :param int id: Project id
+        :param int amount: Number of new comments
+        :param session db_session: Database session
+        """
+        db_session.query(cls).filter(cls.id == id).update(
+            {cls.comments_count: cls.comments_count + amount, cls.version: cls.version + 1},
+            synchronize_session=False)
+
+    @classmethod
+    def reset_comments_count(cls, db_session):
+        """
+        Recompute the comments counter of every project from project_comments
+        :param session db_session: Database session
+        """
+        count = db_session.query(func.count(ProjectComments.id)).filter(
+            ProjectComments.project_id == cls.id
+        ).label('count')
+
+        db_session.query(cls).update(
+            {cls.comments_count: count}, synchronize_session=False)
+
+    @classmethod
+    def get_by_designated(cls, user_id, db_session):
         """
         Get projects by designated
-        :param str user_key: Contact db key
+        :param int user_id: User id
         :param session db_session: Database session
         :return list of project
         """
-        return db_session.query(cls).filter(
-            cls.designated == user_key
+        return db_session.query(cls).join(
+            ProjectDesignated, ProjectDesignated.project_id == cls.id
+        ).filter(
+            ProjectDesignated.user_id == user_id
         )
 
     @classmethod
-    def get_by_leader(cls, user_key, db_session):
+    def get_by_leader(cls, user_id, db_session):
         """
         Get projects by leader
-        :param str user_key: User db key
+        :param int user_id: User id
         :param session db_session: Database session
         :return list of project
         """
-        return db_session.query(cls).filter(
-            cls.leader == user_key
+        return db_session.query(cls).join(
+            ProjectLeader, ProjectLeader.project_id == cls.id
+        ).filter(
+            ProjectLeader.user_id == user_id
         )
 
     @classmethod
@@ -89,31 +197,248 @@ class Project(MYSQL):
     @classmethod
     def get_by_filter_params(cls, params, db_session):
         """
-        Get projects by filter params
-        :param dict params: Params to filter
+        Get one page of projects by filter params
+        :param dict params: Params to filter, limit, cursor and count mode
+        :param session db_session: Database session
+        :return: Page of projects by filter params, total count and next cursor
+        """
+        count_mode = params.get('count') or 'exact'
+        if count_mode not in cls.COUNT_MODES:
+            raise Exception('Invalid count', 400)
+
+        query = cls.set_default_fields(db_session, cls.get_select_fields(params))
+        query = cls._query_add_filter(query, params)
+        if count_mode != 'none':
+            query = query.add_columns(cls._count_column(params, count_mode, db_session))
+
+        projects, next_cursor = paginate(query, cls.get_keyset(params), params)
+
+        if count_mode == 'none':
+            count = None
+        elif projects:
+            count = projects[0].total_count
+        elif not params.get('cursor'):
+            count = 0
+        else:
+            count = db_session.query(cls._count_column(params, count_mode, db_session)).scalar()
+
+        return projects, count, next_cursor
+
+    @classmethod
+    def get_by_ranked_ids(cls, ids, params, db_session):
+        """
+        Get one page of the projects among ranked ids that match filter
+        params, in rank order. The cursor is the offset in the ranking.
+        :param list(int) ids: Project ids, best ranked first
+        :param dict params: Params to filter, limit and cursor
+        :param session db_session: Database session
+        :return: Page of projects, total count and next cursor
+        """
+        limit = get_limit(params)
+        offset = decode_cursor(params['cursor'], 1)[0] if params.get('cursor') else 0
+        if not isinstance(offset, int) or offset < 0:
+            raise Exception('Invalid cursor', 400)
+
+        matches = set()
+        if ids:
+            query = cls._query_add_filter(db_session.query(cls.id).filter(cls.id.in_(ids)), params)
+            matches = set(row.id for row in query)
+
+        ranked = [id for id in ids if id in matches]
+        page_ids = ranked[offset:offset + limit]
+
+        projects = []
+        if page_ids:
+            projects = cls.set_default_fields(db_session, cls.get_select_fields(params)).filter(
+                cls.id.in_(page_ids)
+            ).all()
+            positions = dict((id, position) for position, id in enumerate(page_ids))
+            projects.sort(key=lambda project: positions[project.id])
+
+        next_cursor = encode_cursor([offset + limit]) if offset + limit < len(ranked) else None
+        return projects, len(ranked), next_cursor
+
+    @classmethod
+    def get_search_rows(cls, db_session, updated_since=None):
+        """
+        Get id, title and description of projects for the search index
+        :param session db_session: Database session
+        :param datetime updated_since: Only projects updated since, all when None
+        :return Query: Query yielding rows in chunks
+        """
+        query = db_session.query(cls.id, cls.title, cls.description)
+        if updated_since is not None:
+            query = query.filter(cls.updated_at >= updated_since)
+
+        return query.yield_per(1000)
+
+    @classmethod
+    def _count_column(cls, params, count_mode, db_session):
+        """
+        Column carrying the search total on every row of the page, so the
+        page and the count come back in a single statement.
+        First pages use COUNT(*) OVER(); cursor pages exclude earlier rows
+        from the window, so they use an uncorrelated scalar subquery instead.
+        Estimates count at most ESTIMATE_COUNT_CAP rows.
+        :param dict params: Filter params
+        :param str count_mode: exact or estimate
         :param session db_session: Database session
-        :return: All project by filter params
+        :return Label: total_count column
+        """
+        if count_mode == 'exact' and not params.get('cursor'):
+            return func.count().over().label('total_count')
+
+        matches = cls._query_add_filter(db_session.query(cls.id), params)
+        if count_mode == 'estimate':
+            matches = matches.limit(cls.ESTIMATE_COUNT_CAP)
+
+        return db_session.query(func.count()).select_from(
+            matches.subquery()
+        ).correlate(None).label('total_count')
+
+    @classmethod
+    def get_stream_by_filter_params(cls, params, db_session, chunk_size):
+        """
+        Get all projects by filter params read through a server-side cursor
+        :param dict params: Params to filter and order
+        :param session db_session: Database session used only by this stream
+        :param int chunk_size: Rows fetched per round trip
+        :return Query: Query yielding projects in chunks
+        """
+        query = cls.set_default_fields(db_session, cls.get_select_fields(params))
+        query = cls._query_add_filter(query, params)
+        query = query.order_by(
+            *[direction(column) for column, direction in cls.get_keyset(params)]
+        )
+
+        return query.execution_options(stream_results=True).yield_per(chunk_size)
+
+    @classmethod
+    def check_filter_params(cls, params):
+        """
+        Check that params hold a filter, so a bulk change can't hit every project
+        :param dict params: Filter params
+        """
+        if not any(params.get(field) for field in cls.FILTER_FIELDS):
+            raise Exception('At least one filter is required', 400)
+
+    @classmethod
+    def update_status_by_filter_params(cls, params, status, db_session):
+        """
+        Set the status of all projects matching filter params in a single
+        UPDATE ... WHERE
+        :param dict params: Filter params
+        :param str status: New status
+        :param session db_session: Database session
+        :return int: Number of updated projects
+        """
+        cls.check_filter_params(params)
+
+        query = cls._query_add_filter(db_session.query(cls), params)
+        return query.update({
+            cls.status: status,
+            cls.updated_at: func.now(),
+            cls.version: cls.version + 1
+        }, synchronize_session=False)
+
+    @classmethod
+    def get_keyset(cls, params):
+        """
+        Get the keyset ordering of a search: order_by column, then title and
+        id unless ordering by them, all in the sort_by direction so an index
+        serves it in either direction
+        :param dict params: Params with optional order_by and sort_by
+        :return list: List of (column, asc|desc) pairs
         """
         sort_by = desc if params.get('sort_by') == 'desc' else asc
-        order_by = getattr(cls, params['order_by']) if params.get('order_by') else cls.created_at
+        order_by = params.get('order_by') or 'created_at'
+        if order_by not in cls.ORDER_BY_FIELDS:
+            raise Exception('Invalid order_by', 400)
+
+        columns = [getattr(cls, order_by)] + [
+            column for column in (cls.title, cls.id) if column.key != order_by]
+
+        return [(column, sort_by) for column in columns]
+
+    @classmethod
+    def get_export_by_filter_params(cls, params, db_session, chunk_size):
+        """
+        Get all projects by filter params in id order, so the server-side
+        cursor walks the primary key instead of sorting the whole table
+        :param dict params: Params to filter
+        :param session db_session: Database session used only by this export
+        :param int chunk_size: Rows fetched per round trip
+        :return Query: Query yielding projects in chunks
+        """
+        query = cls.set_default_fields(db_session, cls.get_export_fields(params))
+        query = cls._query_add_filter(query, params)
+        query = query.order_by(cls.id)
 
-        query = cls.set_default_fields(db_session)
-        query = cls._query_add_filter(query, params).order_by(
-            sort_by(order_by), cls.title)
-        return query.all(), query.count()
+        return query.execution_options(stream_results=True).yield_per(chunk_size)
 
     @classmethod
-    def set_default_fields(cls, db_session):
+    def get_export_fields(cls, params):
+        """
+        Get the columns an export selects: requested fields plus id
+        :param dict params: Request params
+        :return list(str): Column names
+        """
+        fields = set(cls.get_fields(params))
+        fields.add('id')
+
+        return [field for field in cls.FIELDS if field in fields and field not in cls.RELATION_FIELDS]
+
+    @classmethod
+    def set_default_fields(cls, db_session, fields=None):
         """
         Query to get list of projects with default fields
         :param session db_session: Database session
+        :param list(str) fields: Column names to select, all columns when None
         :return Query: Query to get project list
         """
-        return db_session.query(
-            cls.id, cls.created_at, cls.deadline,
-            cls.description, cls.designated, cls.leader,
-            cls.status, cls.title, cls.updated_at
-        )
+        fields = fields or [field for field in cls.FIELDS if field not in cls.RELATION_FIELDS]
+
+        return db_session.query(*[getattr(cls, field) for field in fields])
+
+    @classmethod
+    def get_fields(cls, params):
+        """
+        Get the fields requested with the comma separated fields param
+        :param dict params: Request params
+        :return tuple(str): Fields in FIELDS order, all when not requested
+        """
+        if not params.get('fields'):
+            return cls.FIELDS
+
+        fields = set(field.strip() for field in params['fields'].split(',') if field.strip())
+        if not fields or not fields.issubset(cls.FIELDS):
+            raise Exception('Invalid fields', 400)
+
+        return tuple(field for field in cls.FIELDS if field in fields)
+
+    @classmethod
+    def get_select_fields(cls, params):
+        """
+        Get the columns a search selects: requested fields plus its keyset
+        :param dict params: Request params
+        :return list(str): Column names
+        """
+        fields = set(cls.get_fields(params))
+        fields.update(column.key for column, _ in cls.get_keyset(params))
+
+        return [field for field in cls.FIELDS if field in fields and field not in cls.RELATION_FIELDS]
+
+    @classmethod
+    def get_row_by_id(cls, id, db_session):
+        """
+        Get the columns of a project without hydrating a Project instance
+        :param int id: Project id
+        :param session db_session: Database session
+        :return: Row with default fields or None
+        """
+        return cls.set_default_fields(db_session).filter(
+            cls.id == id
+        ).first()
 
     @classmethod
     def _query_add_filter(cls, query, params):
@@ -132,19 +457,124 @@ class Project(MYSQL):
                 query = query.filter(cls.status.in_(params['status']))
             elif params['status'] == 'overdue':
                 query = query.filter(cls.status != 'finished')
-                query = query.filter(cls.deadline < datetime.now().date())
+                query = query.filter(cls.deadline < datetime.date.today())
             else:
                 query = query.filter(cls.status == params['status'])
+        if params.get('designated'):
+            query = query.filter(cls.id.in_(
+                select([ProjectDesignated.project_id]).where(
+                    ProjectDesignated.user_id == params['designated'])))
+        if params.get('leader'):
+            query = query.filter(cls.id.in_(
+                select([ProjectLeader.project_id]).where(
+                    ProjectLeader.user_id == params['leader'])))
 
         return query
 
 
+class ProjectAssignment(object):
+    """Queries shared by the project/user association tables"""
+
+    @classmethod
+    def get_user_ids_by_project_ids(cls, project_ids, db_session):
+        """
+        Get assigned user ids of many projects in one query
+        :param list(int) project_ids: Project ids
+        :param session db_session: Database session
+        :return dict: User ids list by project id
+        """
+        user_ids = {}
+        if not project_ids:
+            return user_ids
+
+        rows = db_session.query(cls.project_id, cls.user_id).filter(
+            cls.project_id.in_(project_ids)
+        ).order_by(cls.project_id, cls.user_id)
+        for project_id, user_id in rows:
+            user_ids.setdefault(project_id, []).append(user_id)
+
+        return user_ids
+
+    @classmethod
+    def get_project_ids_by_user_ids(cls, user_ids, db_session):
+        """
+        Get assigned project ids of many users in one query
+        :param list(int) user_ids: User ids
+        :param session db_session: Database session
+        :return dict: Project ids list by user id
+        """
+        project_ids = {}
+        if not user_ids:
+            return project_ids
+
+        rows = db_session.query(cls.user_id, cls.project_id).filter(
+            cls.user_id.in_(user_ids)
+        ).order_by(cls.user_id, cls.project_id)
+        for user_id, project_id in rows:
+            project_ids.setdefault(user_id, []).append(project_id)
+
+        return project_ids
+
+    @classmethod
+    def set_user_ids(cls, project_id, user_ids, db_session):
+        """
+        Replace the users assigned to a project
+        :param int project_id: Project id
+        :param list(int) user_ids: User ids
+        :param session db_session: Database session
+        :return set(int): Ids of users added or removed
+        """
+        current = set(cls.get_user_ids_by_project_ids([project_id], db_session).get(project_id, []))
+        wanted = set(user_ids)
+
+        removed = current - wanted
+        if removed:
+            db_session.query(cls).filter(
+                cls.project_id == project_id,
+                cls.user_id.in_(sorted(removed))
+            ).delete(synchronize_session=False)
+
+        added = wanted - current
+        if added:
+            db_session.execute(cls.__table__.insert(), [
+                {'project_id': project_id, 'user_id': user_id} for user_id in sorted(added)
+            ])
+
+        return removed | added
+
+
+class ProjectDesignated(ProjectAssignment, MYSQL):
+    """Project Designated Model"""
+    __tablename__ = "project_designated"
+    __table_args__ = (
+        Index('ix_project_designated_user_id_project_id', 'user_id', 'project_id'),
+    )
+
+    project_id = Column(BigInteger, ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    user_id = Column(BigInteger, ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+
+
+class ProjectLeader(ProjectAssignment, MYSQL):
+    """Project Leader Model"""
+    __tablename__ = "project_leader"
+    __table_args__ = (
+        Index('ix_project_leader_user_id_project_id', 'user_id', 'project_id'),
+    )
+
+    project_id = Column(BigInteger, ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    user_id = Column(BigInteger, ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+
+
 class ProjectComments(MYSQL):
     """Project Comments Model"""
     __tablename__ = "project_comments"
+    __table_args__ = (
+        Index('ix_project_comments_project_id_id', 'project_id', 'id'),
+        Index('ix_project_comments_created_at', 'created_at'),
+    )
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
-    created_at = Column(DateTime, server_default=text('now()'))
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, server_default=func.now())
     description = Column(String(500), nullable=False)
     project_id = Column(BigInteger, ForeignKey('project.id'), nullable=False)
     reporter = Column(BigInteger, ForeignKey('user.id'), nullable=False)
@@ -155,11 +585,40 @@ class ProjectComments(MYSQL):
         :return dict: Project comment in dict format
         """
         return {
+            'id': self.id,
             'created_at': self.created_at,
             'description': self.description,
             'reporter': self.reporter
         }
 
+    @classmethod
+    def get_page_by_project_id(cls, project_id, params, db_session):
+        """
+        Get one page of project comments, newest first
+        :param int project_id: Project id
+        :param dict params: Params with optional limit and cursor
+        :param Session db_session: Database session
+        :return tuple: List with project comments items and next cursor
+        """
+        query = db_session.query(cls).filter(cls.project_id == project_id)
+
+        return paginate(query, [(cls.id, desc)], params)
+
+    @classmethod
+    def get_search_rows(cls, db_session, created_since=None):
+        """
+        Get id, project id, description and creation date of comments for
+        the search index
+        :param session db_session: Database session
+        :param datetime created_since: Only comments created since, all when None
+        :return Query: Query yielding rows in chunks
+        """
+        query = db_session.query(cls.id, cls.project_id, cls.description, cls.created_at)
+        if created_since is not None:
+            query = query.filter(cls.created_at >= created_since)
+
+        return query.yield_per(1000)
+
     @classmethod
     def get_all_by_project_id(cls, project_id, db_session):
         """
@@ -170,3 +629,222 @@ class ProjectComments(MYSQL):
         """
         return db_session.query(cls).filter(
             cls.project_id == project_id).order_by(-cls.id).all()
+
+
+class ProjectStats(MYSQL):
+    """
+    Project Stats Model: project counters maintained with each write. Each
+    counter is split over SLOTS rows, a write adds to a random one and reads
+    sum them, so concurrent writers seldom wait on the same row lock.
+    Kinds and names:
+    - status: status
+    - deadline: deadline date|status, for deadlines from today on
+    - overdue: status, for deadlines before today
+    - leader, designated: user id|status
+    - meta: reconciled_at, with the epoch seconds of the last reconciliation
+    """
+    __tablename__ = "project_stats"
+    SLOTS = int(os.environ.get('PROJECT_STATS_SLOTS', 16))
+
+    kind = Column(String(20), primary_key=True)
+    name = Column(String(64), primary_key=True)
+    slot = Column(SmallInteger, primary_key=True, default=0, server_default=text('0'))
+    count = Column(BigInteger, nullable=False, default=0, server_default=text('0'))
+
+    @staticmethod
+    def get_keys(status, deadline, designated_ids, leader_ids):
+        """
+        Get the counters a project adds one to
+        :param str status: Status
+        :param deadline: Deadline as datetime, date, ISO string or None
+        :param list(int) designated_ids: Designated user ids
+        :param list(int) leader_ids: Leader user ids
+        :return list(tuple): (kind, name) pairs
+        """
+        keys = [('status', status)]
+        if deadline:
+            keys.append(ProjectStats.get_deadline_key(str(deadline)[:10], status, datetime.date.today().isoformat()))
+        keys.extend(('designated', '{0}|{1}'.format(user_id, status)) for user_id in sorted(set(designated_ids)))
+        keys.extend(('leader', '{0}|{1}'.format(user_id, status)) for user_id in sorted(set(leader_ids)))
+
+        return keys
+
+    @staticmethod
+    def get_deadline_key(day, status, today):
+        """
+        Get the deadline counter of a project. A deadline counter whose day
+        has passed counts as overdue, so a project may leave the overdue
+        counter its deadline day was moved to by a reconciliation.
+        :param str day: Deadline date, ISO format
+        :param str status: Status
+        :param str today: Current date, ISO format
+        :return tuple: (kind, name) pair
+        """
+        if day < today:
+            return 'overdue', status
+
+        return 'deadline', '{0}|{1}'.format(day, status)
+
+    @staticmethod
+    def get_user_keys(user_id, db_session):
+        """
+        Get the designated and leader counters a user adds one to, once per project
+        :param int user_id: User id
+        :param session db_session: Database session
+        :return list(tuple): (kind, name) pairs
+        """
+        keys = []
+        for kind, model in (('designated', ProjectDesignated), ('leader', ProjectLeader)):
+            keys.extend((kind, '{0}|{1}'.format(user_id, status)) for status, in db_session.query(
+                Project.status).join(model, model.project_id == Project.id).filter(model.user_id == user_id))
+
+        return keys
+
+    @classmethod
+    def apply(cls, deltas, db_session):
+        """
+        Add deltas to a random slot of each counter, creating the missing
+        rows. Rows are updated in key order so concurrent writers lock them
+        in the same order.
+        :param dict deltas: Delta by (kind, name)
+        :param session db_session: Database session
+        """
+        slots = [(kind, name, random.randrange(max(cls.SLOTS, 1)), delta)
+                 for (kind, name), delta in deltas.items() if delta]
+
+        for kind, name, slot, delta in sorted(slots):
+            if db_session.get_bind().dialect.name == 'mysql':
+                statement = mysql_insert(cls.__table__).values(kind=kind, name=name, slot=slot, count=delta)
+                db_session.execute(statement.on_duplicate_key_update(count=cls.__table__.c.count + delta))
+                continue
+
+            updated = db_session.query(cls).filter(cls.kind == kind, cls.name == name, cls.slot == slot).update(
+                {cls.count: cls.count + delta}, synchronize_session=False)
+            if not updated:
+                db_session.execute(cls.__table__.insert().values(kind=kind, name=name, slot=slot, count=delta))
+
+    @classmethod
+    def move(cls, old_keys, new_keys, db_session):
+        """
+        Move a project from the counters of its old state to the new one
+        :param old_keys: Counters of the old state, as a list or a Counter of
+            keys, empty for a new project
+        :param new_keys: Counters of the new state, as a list or a Counter of
+            keys, empty for a deleted project
+        :param session db_session: Database session
+        """
+        deltas = collections.Counter(new_keys)
+        deltas.subtract(old_keys)
+        cls.apply(deltas, db_session)
+
+    @classmethod
+    def count_keys_by_filter_params(cls, params, db_session):
+        """
+        Count the counters the projects matching filter params add one to,
+        with GROUP BY queries. The matching projects stay locked until the
+        transaction ends, so an UPDATE that follows moves the same projects.
+        :param dict params: Filter params
+        :param session db_session: Database session
+        :return Counter: Number of projects by (kind, name)
+        """
+        today = datetime.date.today().isoformat()
+        keys = collections.Counter()
+
+        deadline = func.date(Project.deadline)
+        query = Project._query_add_filter(db_session.query(Project.status, deadline, func.count()), params)
+        for status, day, count in query.group_by(Project.status, deadline).with_for_update():
+            keys[('status', status)] += count
+            if day is not None:
+                keys[cls.get_deadline_key(str(day)[:10], status, today)] += count
+
+        for kind, model in (('designated', ProjectDesignated), ('leader', ProjectLeader)):
+            query = Project._query_add_filter(db_session.query(model.user_id, Project.status, func.count()).join(
+                Project, Project.id == model.project_id), params)
+            for user_id, status, count in query.group_by(model.user_id, Project.status):
+                keys[(kind, '{0}|{1}'.format(user_id, status))] += count
+
+        return keys
+
+    @staticmethod
+    def set_status(keys, status):
+        """
+        Get the counters of projects moved to another status
+        :param Counter keys: Number of projects by (kind, name), from count_keys_by_filter_params
+        :param str status: New status
+        :return Counter: Number of projects by (kind, name) with the new status
+        """
+        moved = collections.Counter()
+        for (kind, name), count in keys.items():
+            if kind in ('status', 'overdue'):
+                moved[(kind, status)] += count
+            else:
+                moved[(kind, '{0}|{1}'.format(name.rsplit('|', 1)[0], status))] += count
+
+        return moved
+
+    @classmethod
+    def get_all(cls, db_session):
+        """
+        Get all counters, summed over their slots
+        :param session db_session: Database session
+        :return list: Rows with kind, name and count
+        """
+        return cls.sum_slots(db_session.query(cls.kind, cls.name, cls.count))
+
+    @classmethod
+    def lock_all(cls, db_session):
+        """
+        Get all counters, summed over their slots, locking them until the
+        transaction ends
+        :param session db_session: Database session
+        :return list: Rows with kind, name and count
+        """
+        return cls.sum_slots(db_session.query(cls.kind, cls.name, cls.count).with_for_update())
+
+    @staticmethod
+    def sum_slots(rows):
+        """
+        Sum the slot rows of each counter
+        :param rows: Rows with kind, name and count
+        :return list: Rows with kind, name and count, one per counter
+        """
+        counts = collections.OrderedDict()
+        for kind, name, count in rows:
+            counts[(kind, name)] = counts.get((kind, name), 0) + count
+
+        return [(kind, name, count) for (kind, name), count in counts.items()]
+
+    @classmethod
+    def reconcile(cls, db_session, now):
+        """
+        Recompute every counter with GROUP BY queries. Call lock_all first
+        in the same transaction, so writers wait and none of their updates
+        is lost. The caller commits.
+        :param session db_session: Database session
+        :param int now: Epoch seconds recorded as reconciled_at
+        """
+        rows = [('status', status, count) for status, count in db_session.query(
+            Project.status, func.count()).group_by(Project.status)]
+
+        # Past deadline days are folded into the overdue counters
+        today = datetime.date.today().isoformat()
+        deadlines = collections.Counter()
+        deadline = func.date(Project.deadline)
+        for day, status, count in db_session.query(deadline, Project.status, func.count()).filter(
+                Project.deadline.isnot(None)).group_by(deadline, Project.status):
+            deadlines[cls.get_deadline_key(str(day)[:10], status, today)] += count
+
+        rows.extend((kind, name, count) for (kind, name), count in sorted(deadlines.items()))
+
+        for kind, model in (('designated', ProjectDesignated), ('leader', ProjectLeader)):
+            rows.extend((kind, '{0}|{1}'.format(user_id, status), count)
+                        for user_id, status, count in db_session.query(
+                            model.user_id, Project.status, func.count()).join(
+                            Project, Project.id == model.project_id).group_by(model.user_id, Project.status))
+
+        rows.append(('meta', 'reconciled_at', now))
+
+        db_session.query(cls).delete(synchronize_session=False)
+        db_session.execute(cls.__table__.insert(), [
+            {'kind': kind, 'name': name, 'count': count} for kind, name, count in rows
+        ])
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, DateTime, Integer, func
+
+from models.base import MYSQL
+
+SCHEMA_VERSION = 10
+
+
+class SchemaVersion(MYSQL):
+    """Schema Version Model"""
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    applied_at = Column(DateTime, server_default=func.now())
+
+    @classmethod
+    def get_current(cls, db_session):
+        """
+        Get the newest applied schema version
+        :param session db_session: Database session
+        :return int: Schema version or 0 when nothing was applied
+        """
+        row = db_session.query(cls.version).order_by(
+            cls.version.desc()
+        ).first()
+
+        return row.version if row else 0
@@ -1,34 +1,48 @@
-from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, String, text
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String, asc, desc, func, text
+from sqlalchemy.orm import object_session
 
-MYSQL = declarative_base()
+from models.base import MYSQL
+from models.pagination import paginate
+from models.project import ProjectDesignated, ProjectLeader
 
 
 class User(MYSQL):
     """User Model"""
     __tablename__ = "user"
 
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
-    created_at = Column(DateTime, server_default=text('now()'))
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, server_default=func.now())
     fullname = Column(String(100), nullable=False)
-    projects_designated = Column(BigInteger, ForeignKey('project.id'), nullable=True)
-    projects_leader = Column(BigInteger, ForeignKey('project.id'), nullable=True)
-    updated_at = Column(DateTime, server_default=text('now()'))
+    updated_at = Column(DateTime, server_default=func.now())
+    version = Column(BigInteger, nullable=False, default=1, server_default=text('1'))
+
+    FIELDS = ('id', 'created_at', 'fullname', 'projects_designated', 'projects_leader', 'updated_at')
+    ORDER_BY_FIELDS = ('created_at', 'fullname', 'id', 'updated_at')
+    RELATION_FIELDS = ('projects_designated', 'projects_leader')
 
     def to_dict(self):
         """
         Return user details in dict format
         :return User
         """
+        db_session = object_session(self)
+
         return {
             'id': self.id,
             'created_at': self.created_at,
             'fullname': self.fullname,
-            'projects_designated': self.projects_designated,
-            'projects_leader': self.projects_leader,
+            'projects_designated': ProjectDesignated.get_project_ids_by_user_ids(
+                [self.id], db_session).get(self.id, []),
+            'projects_leader': ProjectLeader.get_project_ids_by_user_ids(
+                [self.id], db_session).get(self.id, []),
             'updated_at': self.updated_at
         }
 
+    def mark_changed(self):
+        """Bump updated_at, with the database clock like touch, and version"""
+        self.updated_at = func.now()
+        self.version = User.version + 1
+
     @classmethod
     def get_by_id(cls, id, db_session):
         """
@@ -41,6 +55,30 @@ class User(MYSQL):
             cls.id == id
         ).first()
 
+    @classmethod
+    def get_version(cls, id, db_session):
+        """
+        Get the version of a user without loading the user
+        :param int id: User id
+        :param session db_session: Database session
+        :return int: Version or None when not found
+        """
+        return db_session.query(cls.version).filter(
+            cls.id == id
+        ).scalar()
+
+    @classmethod
+    def touch(cls, ids, db_session):
+        """
+        Bump updated_at and version of users whose dict changed indirectly
+        :param iterable ids: User ids
+        :param session db_session: Database session
+        """
+        ids = sorted(ids)
+        if ids:
+            db_session.query(cls).filter(cls.id.in_(ids)).update(
+                {cls.updated_at: func.now(), cls.version: cls.version + 1}, synchronize_session=False)
+
     @classmethod
     def get_by_fullname(cls, name, db_session):
         """
@@ -53,26 +91,158 @@ class User(MYSQL):
             cls.fullname == name
         ).first()
 
+    @classmethod
+    def get_by_filter_params(cls, params, db_session):
+        """
+        Get one page of users by filter params
+        :param dict params: Params to order, limit and cursor
+        :param session db_session: Database session
+        :return: Page of users, total count and next cursor
+        """
+        query = cls.set_default_fields(db_session, cls.get_select_fields(params))
+        count = query.count()
+
+        users, next_cursor = paginate(query, cls.get_keyset(params), params)
+        return users, count, next_cursor
+
+    @classmethod
+    def get_stream_by_filter_params(cls, params, db_session, chunk_size):
+        """
+        Get all users by filter params read through a server-side cursor
+        :param dict params: Params to filter and order
+        :param session db_session: Database session used only by this stream
+        :param int chunk_size: Rows fetched per round trip
+        :return Query: Query yielding users in chunks
+        """
+        query = cls.set_default_fields(db_session, cls.get_select_fields(params))
+        query = query.order_by(
+            *[direction(column) for column, direction in cls.get_keyset(params)]
+        )
+
+        return query.execution_options(stream_results=True).yield_per(chunk_size)
+
+    @classmethod
+    def get_export_by_filter_params(cls, params, db_session, chunk_size):
+        """
+        Get all users by filter params in id order, so the server-side
+        cursor walks the primary key instead of sorting the whole table
+        :param dict params: Params to filter
+        :param session db_session: Database session used only by this export
+        :param int chunk_size: Rows fetched per round trip
+        :return Query: Query yielding users in chunks
+        """
+        query = cls.set_default_fields(db_session, cls.get_export_fields(params))
+        query = query.order_by(cls.id)
+
+        return query.execution_options(stream_results=True).yield_per(chunk_size)
+
+    @classmethod
+    def get_export_fields(cls, params):
+        """
+        Get the columns an export selects: requested fields plus id
+        :param dict params: Request params
+        :return list(str): Column names
+        """
+        fields = set(cls.get_fields(params))
+        fields.add('id')
+
+        return [field for field in cls.FIELDS if field in fields and field not in cls.RELATION_FIELDS]
+
+    @classmethod
+    def set_default_fields(cls, db_session, fields=None):
+        """
+        Query to get list of users with default fields
+        :param session db_session: Database session
+        :param list(str) fields: Column names to select, all columns when None
+        :return Query: Query to get user list
+        """
+        fields = fields or [field for field in cls.FIELDS if field not in cls.RELATION_FIELDS]
+
+        return db_session.query(*[getattr(cls, field) for field in fields])
+
+    @classmethod
+    def get_fields(cls, params):
+        """
+        Get the fields requested with the comma separated fields param
+        :param dict params: Request params
+        :return tuple(str): Fields in FIELDS order, all when not requested
+        """
+        if not params.get('fields'):
+            return cls.FIELDS
+
+        fields = set(field.strip() for field in params['fields'].split(',') if field.strip())
+        if not fields or not fields.issubset(cls.FIELDS):
+            raise Exception('Invalid fields', 400)
+
+        return tuple(field for field in cls.FIELDS if field in fields)
+
+    @classmethod
+    def get_select_fields(cls, params):
+        """
+        Get the columns a search selects: requested fields plus its keyset
+        :param dict params: Request params
+        :return list(str): Column names
+        """
+        fields = set(cls.get_fields(params))
+        fields.update(column.key for column, _ in cls.get_keyset(params))
+
+        return [field for field in cls.FIELDS if field in fields and field not in cls.RELATION_FIELDS]
+
+    @classmethod
+    def get_row_by_id(cls, id, db_session):
+        """
+        Get the columns of a user without hydrating a User instance
+        :param int id: User id
+        :param session db_session: Database session
+        :return: Row with default fields or None
+        """
+        return cls.set_default_fields(db_session).filter(
+            cls.id == id
+        ).first()
+
+    @classmethod
+    def get_keyset(cls, params):
+        """
+        Get the keyset ordering of a search: order_by column, then fullname
+        and id unless ordering by them, all in the sort_by direction, the
+        same rule as Project.get_keyset
+        :param dict params: Params with optional order_by and sort_by
+        :return list: List of (column, asc|desc) pairs
+        """
+        sort_by = desc if params.get('sort_by') == 'desc' else asc
+        order_by = params.get('order_by') or 'created_at'
+        if order_by not in cls.ORDER_BY_FIELDS:
+            raise Exception('Invalid order_by', 400)
+
+        columns = [getattr(cls, order_by)] + [
+            column for column in (cls.fullname, cls.id) if column.key != order_by]
+
+        return [(column, sort_by) for column in columns]
+
     @classmethod
     def get_leader_by_project_id(cls, project_id, db_session):
         """
-        Get User leader by project id
+        Get User leaders by project id
         :param int project_id: Project id
         :param session db_session: Database session
-        :return User
+        :return list(User)
         """
-        return db_session.query(cls).filter(
-            cls.projects_leader == project_id
+        return db_session.query(cls).join(
+            ProjectLeader, ProjectLeader.user_id == cls.id
+        ).filter(
+            ProjectLeader.project_id == project_id
         ).all()
 
     @classmethod
     def get_designated_by_project_id(cls, project_id, db_session):
         """
-        Get User designated by project id
+        Get User designateds by project id
         :param int project_id: Project id
         :param session db_session: Database session
-        :return User
+        :return list(User)
         """
-        return db_session.query(cls).filter(
-            cls.projects_designated == project_id
+        return db_session.query(cls).join(
+            ProjectDesignated, ProjectDesignated.user_id == cls.id
+        ).filter(
+            ProjectDesignated.project_id == project_id
         ).all()
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import threading
+
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from modules.db_session_manage import POOL_SETTINGS, CappedPool, DBSessionManage, connection_limiter
+from modules.instrumentation import instrument_engine
+
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+mysqldb': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite'
+}
+
+
+class CappedAsyncQueuePool(CappedPool, AsyncAdaptedQueuePool):
+    """
+    Async QueuePool capped by connection_limiter. Connections are opened on
+    the event loop, so a full limiter rejects at once instead of blocking it.
+    """
+
+    def get_limiter_timeout(self):
+        return 0
+
+
+class AsyncDBSessionManage(DBSessionManage):
+    """
+    Class to manage async database session. Engines share the cache policy
+    of DBSessionManage (max_engines, idle_timeout, replicas) in a registry of
+    their own, and their connections count in the same connection_limiter.
+    """
+
+    _engines = {}
+    _session_makers = {}
+    _last_used = {}
+    _last_shrink = 0.0
+    _lock = threading.Lock()
+    _stats = {'engines_created': 0, 'engines_evicted': 0, 'engines_shrunk': 0}
+    _dispose_tasks = set()
+
+    def get_db_session(self):
+        """
+        Generate async db session, which the caller closes
+        :return AsyncSession: Session
+        """
+        return self.session_maker()
+
+    @classmethod
+    def get_lag_engine(cls, database, replica):
+        """
+        Get the engine checking the replication lag of a replica: the
+        synchronous one, as the check runs outside the event loop
+        :param str database: Database
+        :param int replica: Index in TASKHUB_REPLICA_URLS
+        :return Engine: Replica engine
+        """
+        return DBSessionManage.get_engine_entry(database, replica)[0]
+
+    @classmethod
+    def create_engine_entry(cls, database, url=None):
+        """
+        Create the async engine of database and its session maker
+        :param str database: Database
+        :param str url: Server url, TASKHUB_DATABASE_URL when None
+        :return tuple: Async engine and session maker
+        """
+        engine = cls.get_server_connection(url, **POOL_SETTINGS)
+        cls.set_database_on_connect(engine.sync_engine, database)
+        instrument_engine(engine.sync_engine)
+
+        return engine, sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+    @classmethod
+    def dispose_engine(cls, engine):
+        """
+        Close the pooled connections of an async engine dropped from the
+        cache, in a task of the running event loop
+        :param AsyncEngine engine: Async engine
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(engine.dispose())
+            return
+
+        task = loop.create_task(engine.dispose())
+        cls._dispose_tasks.add(task)
+        task.add_done_callback(cls._dispose_tasks.discard)
+
+    @classmethod
+    async def dispose_engines(cls):
+        """Close all pooled connections and clear the engine registry"""
+        with cls._lock:
+            engines = list(cls._engines.values())
+            cls._engines.clear()
+            cls._session_makers.clear()
+            cls._last_used.clear()
+
+        for engine in engines:
+            await engine.dispose()
+
+    @staticmethod
+    def get_server_url(url=None):
+        """
+        Get the async server url: TASKHUB_ASYNC_DATABASE_URL when set for the
+        primary, else the synchronous url with its async driver, e.g.
+        mysql+pymysql to mysql+aiomysql
+        :param str url: Synchronous server url, TASKHUB_DATABASE_URL when None
+        :return str: Async server url
+        """
+        if url is None and os.environ.get('TASKHUB_ASYNC_DATABASE_URL'):
+            return os.environ['TASKHUB_ASYNC_DATABASE_URL']
+
+        url = make_url(DBSessionManage.get_server_url(url))
+        if url.drivername not in ASYNC_DRIVERS:
+            if url.drivername in ASYNC_DRIVERS.values():
+                return str(url)
+            raise Exception('No async driver for {0}'.format(url.drivername))
+
+        return str(url.set(drivername=ASYNC_DRIVERS[url.drivername]))
+
+    @staticmethod
+    def get_server_connection(url=None, **pool_settings):
+        """
+        Get async server connection, to the TASKHUB_DATABASE_URL url by
+        default. SQLite keeps its default pool.
+        :param str url: Synchronous server url
+        :param dict pool_settings: Connection pool settings
+        :return AsyncEngine: Server connection
+        """
+        url = AsyncDBSessionManage.get_server_url(url)
+        if url.startswith('sqlite'):
+            return create_async_engine(url)
+
+        return create_async_engine(url, poolclass=CappedAsyncQueuePool, **pool_settings)
+
+
+def release_idle_connections():
+    """Dispose idle synchronous then async engines until the connection
+    limiter has a free slot"""
+    DBSessionManage.release_idle_connections()
+    AsyncDBSessionManage.release_idle_connections()
+
+
+connection_limiter.on_full = release_idle_connections
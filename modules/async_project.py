@@ -0,0 +1,94 @@
+from models.project import Project
+from modules.project import ProjectModule
+
+
+class AsyncProjectModule(object):
+    """
+    Async version of ProjectModule. Queries run on an AsyncSession through
+    run_sync, so the event loop is free while MySQL works and the query
+    and cache logic stays the one of ProjectModule.
+    """
+
+    @classmethod
+    async def create(cls, params, database, db_session):
+        """
+        Create project
+        :param dict params: params to create project
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        :return dict: Id and title of the new project
+        """
+        def create(session):
+            project = ProjectModule.create(params, database, session)
+            return {'id': project.id, 'title': project.title}
+
+        return await db_session.run_sync(create)
+
+    @classmethod
+    async def update(cls, project_id, params, database, db_session):
+        """
+        Update project
+        :param int project_id: Project id
+        :param dict params: params to update project
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        """
+        def update(session):
+            project = Project.get_by_id(project_id, session)
+            ProjectModule.update(project, params, session, database)
+
+        await db_session.run_sync(update)
+
+    @classmethod
+    async def delete(cls, project_id, database, db_session):
+        """
+        Delete project
+        :param int project_id: Project id
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        """
+        def delete(session):
+            project = Project.get_by_id(project_id, session)
+            if not project:
+                raise Exception('Project not found', 404)
+
+            ProjectModule.delete(project, session, database)
+
+        await db_session.run_sync(delete)
+
+    @classmethod
+    async def get_etag(cls, project_id, db_session):
+        """
+        Get the ETag of a project
+        :param int project_id: Project id
+        :param AsyncSession db_session: Async database session
+        :return str: ETag or None when not found
+        """
+        return await db_session.run_sync(
+            lambda session: ProjectModule.get_etag(project_id, session))
+
+    @classmethod
+    async def get_detail(cls, project_id, comments_limit, database, db_session, etag=None):
+        """
+        Get project in dict format with its latest comments
+        :param int project_id: Project id
+        :param str comments_limit: Number of comments to embed
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        :param str etag: Current ETag, from get_etag
+        :return dict: Project detail
+        """
+        return await db_session.run_sync(
+            lambda session: ProjectModule.get_detail(project_id, comments_limit, database, session, etag))
+
+    @classmethod
+    async def search_by_filter_params(cls, params, database, db_session):
+        """
+        Search projects by filter params
+        :param dict params: Request params
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        :return dict: Search projects response
+        """
+        return await db_session.run_sync(
+            lambda session: ProjectModule.search_by_filter_params(params, database, session))
@@ -0,0 +1,93 @@
+from models.user import User
+from modules.user import UserModule
+
+
+class AsyncUserModule(object):
+    """
+    Async version of UserModule. Queries run on an AsyncSession through
+    run_sync, so the event loop is free while MySQL works and the query
+    and cache logic stays the one of UserModule.
+    """
+
+    @classmethod
+    async def create(cls, params, database, db_session):
+        """
+        Create user
+        :param dict params: params to create user
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        :return dict: Id and name of the new user
+        """
+        def create(session):
+            user = UserModule.create(params, database, session)
+            return {'id': user.id, 'name': user.fullname}
+
+        return await db_session.run_sync(create)
+
+    @classmethod
+    async def update(cls, user_id, params, database, db_session):
+        """
+        Update user
+        :param int user_id: User id
+        :param dict params: params to update user
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        """
+        def update(session):
+            user = User.get_by_id(user_id, session)
+            UserModule.update(user, params, session, database)
+
+        await db_session.run_sync(update)
+
+    @classmethod
+    async def delete(cls, user_id, database, db_session):
+        """
+        Delete user
+        :param int user_id: User id
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        """
+        def delete(session):
+            user = User.get_by_id(user_id, session)
+            if not user:
+                raise Exception('User not found', 404)
+
+            UserModule.delete(user, session, database)
+
+        await db_session.run_sync(delete)
+
+    @classmethod
+    async def get_etag(cls, user_id, db_session):
+        """
+        Get the ETag of a user
+        :param int user_id: User id
+        :param AsyncSession db_session: Async database session
+        :return str: ETag or None when not found
+        """
+        return await db_session.run_sync(
+            lambda session: UserModule.get_etag(user_id, session))
+
+    @classmethod
+    async def get_dict_by_id(cls, user_id, database, db_session, etag=None):
+        """
+        Get user in dict format, from cache when possible
+        :param int user_id: User id
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        :param str etag: Current ETag, from get_etag
+        :return dict: User in dict format or None when not found
+        """
+        return await db_session.run_sync(
+            lambda session: UserModule.get_dict_by_id(user_id, database, session, etag))
+
+    @classmethod
+    async def search_by_filter_params(cls, params, database, db_session):
+        """
+        Search users by filter params
+        :param dict params: Request params
+        :param str database: Database
+        :param AsyncSession db_session: Async database session
+        :return dict: Search users response
+        """
+        return await db_session.run_sync(
+            lambda session: UserModule.search_by_filter_params(params, database, session))
@@ -0,0 +1,140 @@
+from sqlalchemy import String
+
+from modules.serializer import iter_chunks
+
+
+def get_insert_values(instance):
+    """
+    Get the column values of a model instance filled by its module field
+    mapping, validated against the table definition
+    :param MYSQL instance: Model instance
+    :return dict: Values by column name
+    """
+    values = {}
+    for column in instance.__table__.columns:
+        value = getattr(instance, column.key)
+
+        if value is None:
+            if column.primary_key or column.server_default is not None:
+                continue
+            if column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+            elif not column.nullable:
+                raise Exception('{0} is required'.format(column.key), 400)
+
+        if isinstance(value, str) and isinstance(column.type, String) \
+                and column.type.length and len(value) > column.type.length:
+            raise Exception('{0} is longer than {1} characters'.format(
+                column.key, column.type.length), 400)
+
+        values[column.key] = value
+
+    return values
+
+
+def get_transaction_size(params):
+    """
+    Get the rows per transaction of a bulk request from its params
+    :param dict params: Request params
+    :return int: Rows per transaction or None for the default
+    """
+    if not params.get('transaction_size'):
+        return None
+
+    try:
+        transaction_size = int(params['transaction_size'])
+    except (TypeError, ValueError):
+        raise Exception('Invalid transaction_size', 400)
+
+    if transaction_size < 1:
+        raise Exception('Invalid transaction_size', 400)
+
+    return transaction_size
+
+
+def bulk_insert(db_session, table, rows, chunk_size, transaction_size, after_chunk=None):
+    """
+    Insert rows with one multi-row INSERT per chunk, committing every
+    transaction_size rows. A failing transaction is rolled back: the rows of
+    the failing chunk are reported with its error and the other rows of the
+    transaction as rolled back; committed rows keep their ids.
+    :param Session db_session: Database session
+    :param Table table: Table
+    :param iterable rows: (index, values, extra) tuples, values with the same keys
+    :param int chunk_size: Rows per INSERT statement
+    :param int transaction_size: Rows per transaction
+    :param function after_chunk: Called with the session and (id, extra) pairs of each chunk
+    :return list(dict): {'index', 'id'}, {'index', 'error'} or {'index', 'error',
+        'rolled_back'} per row
+    """
+    results = []
+    pending = []
+
+    def finish_transaction(error=None):
+        if error is None:
+            try:
+                db_session.commit()
+            except Exception as commit_error:
+                return finish_transaction(get_error_message(commit_error))
+
+            results.extend(pending)
+        else:
+            db_session.rollback()
+            results.extend({'index': item['index'], 'error': error} for item in pending)
+
+        del pending[:]
+
+    for chunk in iter_chunks(rows, chunk_size):
+        try:
+            ids = insert_chunk(db_session, table, [values for _, values, _ in chunk])
+            if after_chunk:
+                after_chunk(db_session, [(id, extra) for (_, _, extra), id in zip(chunk, ids)])
+
+        except Exception as error:
+            rolled_back = pending[:]
+            del pending[:]
+            pending.extend({'index': index} for index, _, _ in chunk)
+            finish_transaction(get_error_message(error))
+            results.extend({
+                'index': item['index'],
+                'error': 'Rolled back with a failing row of the same transaction',
+                'rolled_back': True
+            } for item in rolled_back)
+            continue
+
+        pending.extend({'index': index, 'id': id} for (index, _, _), id in zip(chunk, ids))
+        if len(pending) >= transaction_size:
+            finish_transaction()
+
+    if pending:
+        finish_transaction()
+
+    return results
+
+
+def get_error_message(error):
+    """
+    Get the message of an exception raised as Exception(message, status)
+    :param Exception error: Error
+    :return str: Message
+    """
+    return str(error.args[0]) if error.args else str(error)
+
+
+def insert_chunk(db_session, table, values):
+    """
+    Insert rows in a single multi-row INSERT ... VALUES statement
+    :param Session db_session: Database session
+    :param Table table: Table
+    :param list(dict) values: Rows values
+    :return range: Generated ids, relying on the auto-increment values of
+        one multi-row INSERT being consecutive (InnoDB simple inserts)
+    """
+    result = db_session.execute(table.insert().values(values))
+    last_id = result.lastrowid
+
+    if db_session.get_bind().dialect.name == 'sqlite':
+        # SQLite reports the id of the last row instead of the first
+        last_id = last_id - len(values) + 1
+
+    return range(last_id, last_id + len(values))
@@ -0,0 +1,224 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from modules.serializer import dumps
+from modules.unit_of_work import after_commit
+
+
+class CacheBackend(object):
+    """Interface of cache backends. Values are serialized strings, so a
+    shared backend such as Redis can implement it with GET/SETEX/DEL."""
+
+    def get(self, key):
+        """
+        Get a value
+        :param str key: Key
+        :return str: Value or None when missing or expired
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """
+        Set a value
+        :param str key: Key
+        :param str value: Value
+        """
+        raise NotImplementedError
+
+    def delete(self, keys):
+        """
+        Delete values
+        :param list(str) keys: Keys
+        """
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        """
+        Delete the values whose key starts with prefix
+        :param str prefix: Key prefix
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """Delete all values"""
+        raise NotImplementedError
+
+    def get_stats(self):
+        """
+        Get cache counters
+        :return dict: Hits, misses, evictions and size
+        """
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache with a time to live"""
+
+    def __init__(self, max_size, ttl):
+        """
+        LRU cache
+        :param int max_size: Maximum number of values
+        :param int ttl: Seconds a value is kept
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._items if key.startswith(prefix)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._items)
+            }
+
+
+class EntityCache(object):
+    """Read-through cache of entity dicts by database and id"""
+
+    def __init__(self, name, backend):
+        """
+        Entity cache
+        :param str name: Entity name, used as key prefix
+        :param CacheBackend backend: Cache backend
+        """
+        self.name = name
+        self.backend = backend
+        self.stale = 0
+
+    def get_key(self, database, id):
+        """
+        Get cache key of an entity
+        :param str database: Database
+        :param int id: Entity id
+        :return str: Cache key
+        """
+        return '{0}:{1}:{2}'.format(self.name, database or '', id)
+
+    def get_or_load(self, database, id, loader, etag=None):
+        """
+        Get an entity dict, loading and storing it on a miss. The dict is
+        stored with the ETag it was loaded for: when the caller read another
+        ETag from the database, the cached dict is stale (e.g. its
+        invalidation reached only another worker) and is loaded again.
+        :param str database: Database
+        :param int id: Entity id
+        :param function loader: Return the entity dict or None when not found
+        :param str etag: Current ETag of the entity, None to accept any cached dict
+        :return dict: Entity dict or None
+        """
+        key = self.get_key(database, id)
+
+        value = self.backend.get(key)
+        if value is not None:
+            cached_etag, entity_dict = json.loads(value)
+            if etag is None or cached_etag == etag:
+                return entity_dict
+            self.stale += 1
+
+        entity_dict = loader()
+        if entity_dict is not None:
+            self.backend.set(key, dumps([etag, entity_dict]))
+
+        return entity_dict
+
+    def invalidate(self, database, ids):
+        """
+        Drop cached entities
+        :param str database: Database
+        :param iterable ids: Entity ids
+        """
+        keys = [self.get_key(database, id) for id in ids]
+        if keys:
+            self.backend.delete(keys)
+            # Until the request transaction commits, another request may
+            # cache the old row again
+            after_commit(lambda: self.backend.delete(keys))
+
+    def invalidate_database(self, database):
+        """
+        Drop the cached entities of a database, leaving other databases cached
+        :param str database: Database
+        """
+        prefix = '{0}:{1}:'.format(self.name, database or '')
+        self.backend.delete_prefix(prefix)
+        after_commit(lambda: self.backend.delete_prefix(prefix))
+
+
+project_cache = EntityCache('project', LRUCache(
+    int(os.environ.get('CACHE_MAX_SIZE', 10000)), int(os.environ.get('CACHE_TTL', 60))))
+user_cache = EntityCache('user', LRUCache(
+    int(os.environ.get('CACHE_MAX_SIZE', 10000)), int(os.environ.get('CACHE_TTL', 60))))
+
+
+def configure_backends(project_backend, user_backend):
+    """
+    Replace the cache backends, e.g. with a shared Redis backend
+    :param CacheBackend project_backend: Backend of project dicts
+    :param CacheBackend user_backend: Backend of user dicts
+    """
+    project_cache.backend = project_backend
+    user_cache.backend = user_backend
+
+
+def get_stats():
+    """
+    Get counters of all caches
+    :return dict: Counters by cache name
+    """
+    stats = {}
+    for cache in (project_cache, user_cache):
+        stats[cache.name] = cache.backend.get_stats()
+        stats[cache.name]['stale'] = cache.stale
+
+    return stats
@@ -0,0 +1,262 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from models.project import Project, ProjectComments
+from modules.cache import project_cache
+from modules.db_session_manage import DBSessionManage
+from modules.search_index import index_comment
+
+WRITE_BEHIND_SETTINGS = {
+    'enabled': os.environ.get('COMMENTS_WRITE_BEHIND') == '1',
+    'ack': os.environ.get('COMMENTS_WRITE_BEHIND_ACK', 'queued'),
+    'max_batch': int(os.environ.get('COMMENTS_WRITE_BEHIND_BATCH', 500)),
+    'max_delay': int(os.environ.get('COMMENTS_WRITE_BEHIND_DELAY_MS', 200)) / 1000.0,
+    'max_queue': int(os.environ.get('COMMENTS_WRITE_BEHIND_QUEUE', 10000)),
+    'ack_timeout': int(os.environ.get('COMMENTS_WRITE_BEHIND_ACK_TIMEOUT', 10))
+}
+
+
+class PendingComment(object):
+    """Comment waiting in the write-behind queue"""
+
+    def __init__(self, values, durable):
+        """
+        Pending comment
+        :param dict values: project_comments column values
+        :param bool durable: Whether the producer waits for the commit
+        """
+        self.values = values
+        self.done = threading.Event() if durable else None
+        self.error = None
+
+
+class CommentWriteBehind(object):
+    """
+    Queue project comments in process and insert them with multi-row
+    INSERTs when max_batch comments are queued or max_delay has passed.
+
+    Acknowledgement modes:
+    - queued: create() returns once the comment is queued. Comments still
+      queued are lost if the process dies without a graceful shutdown, and
+      a comment failing to insert is only logged.
+    - durable: create() blocks until the batch holding the comment is
+      committed, at most ack_timeout seconds, and raises if it could not
+      be inserted or the wait timed out; a timed out comment may still be
+      inserted later.
+    """
+
+    ACK_MODES = ('durable', 'queued')
+
+    def __init__(self, database, ack, max_batch, max_delay, max_queue, ack_timeout=None):
+        """
+        Comment write-behind queue
+        :param str database: Database
+        :param str ack: Acknowledgement mode, queued or durable
+        :param int max_batch: Comments per INSERT
+        :param float max_delay: Seconds a comment may wait before a flush
+        :param int max_queue: Queued comments before producers block
+        :param float ack_timeout: Seconds a durable producer waits for the commit
+        """
+        if ack not in self.ACK_MODES:
+            raise Exception('Invalid write-behind ack mode {0}'.format(ack))
+
+        self.database = database
+        self.ack = ack
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.ack_timeout = ack_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name='comment-write-behind-{0}'.format(database), daemon=True)
+        self._thread.start()
+
+        self.batches = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_last = 0.0
+        self.flush_seconds_max = 0.0
+
+    def enqueue(self, project_id, description, user_id):
+        """
+        Queue a comment, waiting for its commit in durable mode
+        :param int project_id: Project id
+        :param str description: Description
+        :param int user_id: User id
+        """
+        if self._stopping.is_set():
+            raise Exception('Comment write-behind queue is stopped')
+
+        comment = PendingComment({
+            'description': description,
+            'project_id': project_id,
+            'reporter': user_id
+        }, self.ack == 'durable')
+        self._queue.put(comment)
+
+        if comment.done is not None:
+            if not comment.done.wait(self.ack_timeout):
+                raise Exception('Comment write timed out', 503)
+            if comment.error:
+                raise Exception(comment.error)
+
+    def stop(self, timeout=None):
+        """
+        Flush queued comments and stop the flush thread
+        :param float timeout: Seconds to wait for the last flush
+        """
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        """
+        Get queue metrics
+        :return dict: Queue depth, flush counters and flush latency
+        """
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'batches': self.batches,
+                'flushed': self.flushed,
+                'failed': self.failed,
+                'flush_seconds_last': self.flush_seconds_last,
+                'flush_seconds_max': self.flush_seconds_max,
+                'flush_seconds_avg': self.flush_seconds_total / self.batches if self.batches else 0.0
+            }
+
+    def _run(self):
+        """Collect batches until stopped and the queue is drained"""
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.max_delay)]
+            except queue.Empty:
+                continue
+
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and not self._stopping.is_set():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=max(remaining, 0)))
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """
+        Insert a batch of comments. When the batch fails, comments are
+        retried one by one so a single bad row doesn't drop the others.
+        :param list(PendingComment) batch: Comments
+        """
+        started = time.monotonic()
+
+        failed = 0
+        try:
+            self._insert(batch)
+        except Exception:
+            for comment in batch:
+                try:
+                    self._insert([comment])
+                except Exception as error:
+                    comment.error = str(error)
+                    failed += 1
+                    logging.exception('Comment write-behind failed for project %s',
+                                      comment.values['project_id'])
+
+        for comment in batch:
+            if comment.done is not None:
+                comment.done.set()
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.batches += 1
+            self.flushed += len(batch) - failed
+            self.failed += failed
+            self.flush_seconds_last = elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+            self.flush_seconds_total += elapsed
+
+    def _insert(self, batch):
+        """
+        Insert comments and bump project counters in one transaction
+        :param list(PendingComment) batch: Comments
+        """
+        counts = {}
+        for comment in batch:
+            project_id = comment.values['project_id']
+            counts[project_id] = counts.get(project_id, 0) + 1
+
+        db_session = DBSessionManage(self.database).get_standalone_session()
+        try:
+            db_session.execute(ProjectComments.__table__.insert().values(
+                [comment.values for comment in batch]))
+            for project_id, count in sorted(counts.items()):
+                Project.increment_comments_count(project_id, count, db_session)
+            db_session.commit()
+
+        except:
+            db_session.rollback()
+            raise
+
+        finally:
+            db_session.close()
+
+        project_cache.invalidate(self.database, counts.keys())
+        for comment in batch:
+            index_comment(self.database, comment.values['project_id'], comment.values['description'])
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database):
+    """
+    Get the write-behind queue of a database, starting it on first use
+    :param str database: Database
+    :return CommentWriteBehind: Write-behind queue
+    """
+    writer = _writers.get(database)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(database)
+            if writer is None:
+                writer = CommentWriteBehind(
+                    database, WRITE_BEHIND_SETTINGS['ack'], WRITE_BEHIND_SETTINGS['max_batch'],
+                    WRITE_BEHIND_SETTINGS['max_delay'], WRITE_BEHIND_SETTINGS['max_queue'],
+                    WRITE_BEHIND_SETTINGS['ack_timeout'])
+                _writers[database] = writer
+
+    return writer
+
+
+@atexit.register
+def stop_all(timeout=30):
+    """
+    Flush and stop every write-behind queue. Runs at interpreter exit;
+    call it from the server's worker shutdown hook as well.
+    :param float timeout: Seconds to wait for each queue
+    """
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+
+    for writer in writers:
+        writer.stop(timeout)
+
+
+def get_stats():
+    """
+    Get metrics of all write-behind queues
+    :return dict: Metrics by database
+    """
+    return {database or '': writer.get_stats() for database, writer in list(_writers.items())}
@@ -0,0 +1,34 @@
+def get_etag(entity, id, version):
+    """
+    Get the ETag of an entity from its version counter, bumped by every change
+    :param str entity: Entity name
+    :param int id: Entity id
+    :param int version: Entity version
+    :return str: Weak ETag
+    """
+    return 'W/"{0}-{1}-{2}"'.format(entity, id, version)
+
+
+def is_not_modified(request, etag):
+    """
+    Check the request If-None-Match header against the entity ETag
+    :param Request request: Request
+    :param str etag: Entity ETag
+    :return bool: True when a 304 can be sent
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or etag[2:] in tags
+
+
+def set_validator_headers(response, etag):
+    """
+    Set the ETag response header. No Last-Modified is sent: the timestamps
+    are naive in the database session time zone, which is unknown here
+    :param Response response: Response
+    :param str etag: Entity ETag
+    """
+    response.headers['ETag'] = etag
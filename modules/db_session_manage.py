@@ -1,26 +1,181 @@
-from sqlalchemy import create_engine
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.ext.declarative import declarative_base
 
+from models.base import MYSQL
 from models.user import User
-from models.project import Project
+from models.project import Project, ProjectComments, ProjectDesignated, ProjectLeader, ProjectStats
+from models.schema_version import SCHEMA_VERSION, SchemaVersion
+from modules.instrumentation import InstrumentedQueuePool, instrument_engine
+from modules.replica import REPLICA_SETTINGS, is_read_only, replica_selector
+from modules.unit_of_work import TrackedSession, get_unit_of_work, session_counters
+
+POOL_SETTINGS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30))
+}
+
+ENGINE_CACHE_SETTINGS = {
+    'max_engines': int(os.environ.get('DB_MAX_ENGINES', 100)),
+    'idle_timeout': int(os.environ.get('DB_ENGINE_IDLE_TIMEOUT', 300)),
+    'max_connections': int(os.environ.get('DB_MAX_CONNECTIONS', 500))
+}
+
+
+class ConnectionLimiter(object):
+    """Process-wide cap of open database connections across all engines"""
+
+    def __init__(self, max_connections):
+        """
+        Connection limiter
+        :param int max_connections: Maximum open connections
+        """
+        self.max_connections = max_connections
+        self.on_full = None
+        self.open = 0
+        self.opened = 0
+        self.closed = 0
+        self.waits = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout):
+        """
+        Take a connection slot. When none is free, on_full is called to
+        release idle connections, then this waits up to timeout seconds.
+        :param float timeout: Seconds to wait for a slot
+        """
+        with self._condition:
+            if self.open < self.max_connections:
+                self.open += 1
+                self.opened += 1
+                return
+
+        if self.on_full:
+            self.on_full()
+
+        with self._condition:
+            self.waits += 1
+            if not self._condition.wait_for(lambda: self.open < self.max_connections, timeout):
+                self.rejected += 1
+                raise Exception('Database connection limit reached', 503)
+
+            self.open += 1
+            self.opened += 1
+
+    def release(self):
+        """Give back a connection slot"""
+        with self._condition:
+            self.open = max(self.open - 1, 0)
+            self.closed += 1
+            self._condition.notify()
+
+    def get_stats(self):
+        """
+        Get limiter counters
+        :return dict: Open connections, limit, churn, waits and rejections
+        """
+        with self._condition:
+            return {
+                'connections_open': self.open,
+                'connections_max': self.max_connections,
+                'connections_opened': self.opened,
+                'connections_closed': self.closed,
+                'connection_waits': self.waits,
+                'connection_rejections': self.rejected
+            }
+
+
+connection_limiter = ConnectionLimiter(ENGINE_CACHE_SETTINGS['max_connections'])
+
+# Schema version 1 assignment columns: table, column, association table,
+# and the columns of the table holding the project and user ids
+LEGACY_ASSIGNMENT_COLUMNS = (
+    ('project', 'designateds', 'project_designated', 'id', 'designateds'),
+    ('project', 'leaders', 'project_leader', 'id', 'leaders'),
+    ('user', 'projects_designated', 'project_designated', 'projects_designated', 'id'),
+    ('user', 'projects_leader', 'project_leader', 'projects_leader', 'id'),
+)
+
+
+class CappedPool(object):
+    """Pool mixin whose DBAPI connections, including reconnects after an
+    invalidation, take a slot of connection_limiter while open"""
+
+    def __init__(self, *args, **kwargs):
+        super(CappedPool, self).__init__(*args, **kwargs)
+        invoke_creator = self._invoke_creator
+
+        def capped_invoke_creator(connection_record):
+            connection_limiter.acquire(self.get_limiter_timeout())
+            try:
+                return invoke_creator(connection_record)
+            except:
+                connection_limiter.release()
+                raise
+
+        self._invoke_creator = capped_invoke_creator
+
+    def get_limiter_timeout(self):
+        """
+        Get the seconds to wait for a connection slot
+        :return float: The pool timeout
+        """
+        return self._timeout
+
+    def _close_connection(self, *args, **kwargs):
+        try:
+            return super(CappedPool, self)._close_connection(*args, **kwargs)
+
+        finally:
+            connection_limiter.release()
+
+
+class CappedQueuePool(CappedPool, InstrumentedQueuePool):
+    """Instrumented QueuePool capped by connection_limiter"""
 
 
 class DBSessionManage(object):
     "Class to manage database session"
 
-    def __init__(self, database):
+    _engines = {}
+    _session_makers = {}
+    _last_used = {}
+    _last_shrink = 0.0
+    _lock = threading.Lock()
+    _stats = {'engines_created': 0, 'engines_evicted': 0, 'engines_shrunk': 0}
+
+    def __init__(self, database, read_only=None):
         """
         Start session
         :param str database: Database
+        :param bool read_only: Whether sessions only read and may use a replica,
+            by default whether the current request is read-only
         """
         self.database = database
+        self.replica = None
         try:
-            self.engine = self.get_server_connection()
-            self.engine.connect()
-            self.engine.execute('USE `{0}`'.format(database))
-            self.create_tables(self.engine)
+            if (is_read_only() if read_only is None else read_only) and REPLICA_SETTINGS['urls']:
+                # A request keeps the replica it got first, so it reads one snapshot
+                unit = get_unit_of_work()
+                if unit is not None and database in unit.replicas:
+                    self.replica = unit.replicas[database]
+                else:
+                    self.replica = replica_selector.choose(
+                        lambda replica: self.get_engine_entry(database, replica)[0],
+                        lambda replica: self.get_lag_engine(database, replica))
+                    if unit is not None:
+                        unit.replicas[database] = self.replica
+
+            self.engine, self.session_maker = self.get_engine_entry(database, self.replica)
 
         except OperationalError as error:
             self.sql_database_connection_error(str(error))
@@ -28,10 +183,264 @@ class DBSessionManage(object):
             self.sql_database_connection_error(str(error))
 
     def get_db_session(self):
-        """Generate db session"""
-        session = sessionmaker(bind=self.engine)
+        """
+        Get a db session: within UnitOfWorkMiddleware the session shared by
+        the request, committed and closed when it ends, else a new one
+        :return Session: Session
+        """
+        unit = get_unit_of_work()
+        if unit is not None:
+            return unit.get_session((self.database, self.replica), self.engine)
+
+        return self.get_standalone_session()
+
+    def get_standalone_session(self):
+        """
+        Generate a db session outside the request transaction, which the
+        caller commits and closes: streams holding a server-side cursor,
+        bulk inserts committing in chunks and background work
+        :return Session: Session
+        """
+        db_session = self.session_maker()
+
+        unit = get_unit_of_work()
+        if unit is not None:
+            unit.standalone.append(db_session)
+
+        return db_session
+
+    @classmethod
+    def get_engine(cls, database):
+        """
+        Get the process-wide engine of database, creating it on first use
+        :param str database: Database
+        :return Engine: Database engine
+        """
+        return cls.get_engine_entry(database)[0]
+
+    @classmethod
+    def get_engine_entry(cls, database, replica=None):
+        """
+        Get the engine of database and its session maker. Engines are cached
+        per database (tenant) and replica up to max_engines, evicting the least
+        recently used idle one, and engines unused for idle_timeout are disposed.
+        :param str database: Database
+        :param int replica: Index in TASKHUB_REPLICA_URLS, None for the primary
+        :return tuple: Engine and session maker
+        """
+        key = database if replica is None else (database, replica)
+
+        now = time.monotonic()
+        if now - cls._last_shrink >= ENGINE_CACHE_SETTINGS['idle_timeout'] / 4.0:
+            cls.shrink_idle_engines()
+
+        engine = cls._engines.get(key)
+        session_maker = cls._session_makers.get(key)
+        if engine is not None and session_maker is not None:
+            cls._last_used[key] = now
+            return engine, session_maker
+
+        with cls._lock:
+            engine = cls._engines.get(key)
+            if engine is None:
+                cls._evict_engines(ENGINE_CACHE_SETTINGS['max_engines'] - 1)
+
+                engine, cls._session_makers[key] = cls.create_engine_entry(
+                    database, None if replica is None else REPLICA_SETTINGS['urls'][replica])
+                cls._engines[key] = engine
+                cls._stats['engines_created'] += 1
+
+            cls._last_used[key] = now
+            return engine, cls._session_makers[key]
+
+    @classmethod
+    def get_lag_engine(cls, database, replica):
+        """
+        Get the engine checking the replication lag of a replica
+        :param str database: Database
+        :param int replica: Index in TASKHUB_REPLICA_URLS
+        :return Engine: Replica engine
+        """
+        return cls.get_engine_entry(database, replica)[0]
+
+    @classmethod
+    def create_engine_entry(cls, database, url=None):
+        """
+        Create the engine of database and its session maker
+        :param str database: Database
+        :param str url: Server url, TASKHUB_DATABASE_URL when None
+        :return tuple: Engine and session maker
+        """
+        engine = cls.get_server_connection(url, **POOL_SETTINGS)
+        cls.set_database_on_connect(engine, database)
+        instrument_engine(engine)
+
+        return engine, sessionmaker(bind=engine, class_=TrackedSession)
 
-        return session()
+    @classmethod
+    def shrink_idle_engines(cls):
+        """Dispose the engines without checked out connections that were
+        not used for idle_timeout seconds"""
+        if not cls._lock.acquire(False):
+            return
+
+        try:
+            now = time.monotonic()
+            cls._last_shrink = now
+            for database in cls._get_idle_databases():
+                if now - cls._last_used.get(database, 0) < ENGINE_CACHE_SETTINGS['idle_timeout']:
+                    break
+                cls._remove_engine(database)
+                cls._stats['engines_shrunk'] += 1
+
+        finally:
+            cls._lock.release()
+
+    @classmethod
+    def release_idle_connections(cls):
+        """Dispose idle engines, least recently used first, until the
+        connection limiter has a free slot"""
+        with cls._lock:
+            for database in cls._get_idle_databases():
+                if connection_limiter.open < connection_limiter.max_connections:
+                    break
+                cls._remove_engine(database)
+                cls._stats['engines_evicted'] += 1
+
+    @classmethod
+    def _evict_engines(cls, size):
+        """
+        Dispose idle engines, least recently used first, until at most size
+        engines are cached. Engines with checked out connections are kept,
+        so the cache may grow past max_engines while they are all busy.
+        Call with the lock held.
+        :param int size: Number of engines to keep
+        """
+        for database in cls._get_idle_databases():
+            if len(cls._engines) <= size:
+                break
+            cls._remove_engine(database)
+            cls._stats['engines_evicted'] += 1
+
+    @classmethod
+    def _get_idle_databases(cls):
+        """
+        Get the databases whose engine has no checked out connection
+        :return list(str): Databases, least recently used first
+        """
+        return sorted(
+            [database for database, engine in cls._engines.items()
+             if not getattr(engine.pool, 'checkedout', lambda: 0)()],
+            key=lambda database: cls._last_used.get(database, 0))
+
+    @classmethod
+    def _remove_engine(cls, database):
+        """
+        Drop the engine of database from the cache and close its connections.
+        Call with the lock held.
+        :param str database: Database
+        """
+        engine = cls._engines.pop(database)
+        cls._session_makers.pop(database, None)
+        cls._last_used.pop(database, None)
+        cls.dispose_engine(engine)
+
+    @staticmethod
+    def dispose_engine(engine):
+        """
+        Close the pooled connections of an engine dropped from the cache
+        :param Engine engine: Engine
+        """
+        engine.dispose()
+
+    @classmethod
+    def get_stats(cls):
+        """
+        Get engine cache and connection metrics
+        :return dict: Cached engines, active tenants, churn and connections
+        """
+        now = time.monotonic()
+        tenants = {}
+        for key, engine in list(cls._engines.items()):
+            pool = engine.pool
+            name = '{0}@replica{1}'.format(key[0] or '', key[1]) if isinstance(key, tuple) else key or ''
+            tenants[name] = {
+                'checked_out': getattr(pool, 'checkedout', lambda: 0)(),
+                'checked_in': getattr(pool, 'checkedin', lambda: 0)(),
+                'idle_seconds': round(now - cls._last_used.get(key, now), 3)
+            }
+
+        stats = dict(cls._stats)
+        stats.update(connection_limiter.get_stats())
+        stats.update(replica_selector.get_stats())
+        stats.update(session_counters.get_stats())
+        stats['engines'] = len(tenants)
+        stats['active_tenants'] = len(set(
+            name.split('@', 1)[0] for name, tenant in tenants.items() if tenant['checked_out']))
+        stats['tenants'] = tenants
+
+        return stats
+
+    @classmethod
+    def bootstrap_schema(cls, database):
+        """
+        Create or verify the tables once and record the schema version.
+        Request paths never run DDL, so this must be called at deploy time
+        (bootstrap.py) or on application startup.
+        :param str database: Database
+        :return int: Schema version of database
+        """
+        manage = cls(database)
+        engine = manage.engine
+
+        SchemaVersion.__table__.create(engine, checkfirst=True)
+
+        db_session = manage.get_db_session()
+        try:
+            current = SchemaVersion.get_current(db_session)
+            if current > SCHEMA_VERSION:
+                raise Exception(
+                    'Database schema version {0} is newer than application version {1}'.format(
+                        current, SCHEMA_VERSION))
+
+            if current < SCHEMA_VERSION:
+                if 0 < current < 8:
+                    # Counters gained slots in their primary key; reconcile refills them
+                    ProjectStats.__table__.drop(engine, checkfirst=True)
+                cls.create_tables(engine)
+                # current is 0 for new databases and for databases created
+                # before schema versions existed, which need every backfill
+                if current < 2:
+                    cls.migrate_assignment_columns(engine, db_session)
+                if current < 4:
+                    Project.reset_comments_count(db_session)
+                if current < 8:
+                    ProjectStats.reconcile(db_session, int(time.time()))
+                if current < 10:
+                    cls.drop_indexes(engine, Project.__table__, Project.DROPPED_INDEXES)
+
+                db_session.add(SchemaVersion(version=SCHEMA_VERSION))
+                db_session.commit()
+
+            return SCHEMA_VERSION
+
+        except:
+            db_session.rollback()
+            raise
+
+        finally:
+            db_session.close()
+
+    @classmethod
+    def dispose_engines(cls):
+        """Close all pooled connections and clear the engine registry"""
+        with cls._lock:
+            for engine in cls._engines.values():
+                engine.dispose()
+
+            cls._engines.clear()
+            cls._session_makers.clear()
+            cls._last_used.clear()
 
     def sql_database_connection_error(self, error):
         """
@@ -43,27 +452,136 @@ class DBSessionManage(object):
         else:
             raise Exception(error)
 
+    @staticmethod
+    def set_database_on_connect(engine, database):
+        """
+        Select database on every new pooled connection
+        :param Engine engine: Database engine
+        :param str database: Database
+        """
+        if not database:
+            return
+
+        @event.listens_for(engine, 'connect')
+        def use_database(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('USE `{0}`'.format(database.replace('`', '``')))
+            cursor.close()
+
     @staticmethod
     def create_tables(engine):
         """
-        Create tables
+        Create tables, and the columns and indexes missing on tables that
+        already exist
         :param MysqlConnection engine: Mysql connection engine
         """
-        Base = declarative_base()
-
         tables = [
-            Project().__table__,
-            User().__table__
+            Project.__table__,
+            User.__table__,
+            ProjectComments.__table__,
+            ProjectDesignated.__table__,
+            ProjectLeader.__table__,
+            ProjectStats.__table__
         ]
 
-        Base.metadata.create_all(engine, tables)
+        MYSQL.metadata.create_all(engine, tables)
+
+        inspector = inspect(engine)
+        for table in tables:
+            existing = set(column['name'] for column in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name not in existing:
+                    engine.execute('ALTER TABLE `{0}` ADD COLUMN {1}'.format(
+                        table.name, CreateColumn(column).compile(dialect=engine.dialect)))
+
+            existing = set(index['name'] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(engine)
+
+    @staticmethod
+    def migrate_assignment_columns(engine, db_session):
+        """
+        Copy the assignments of the schema version 1 columns into the
+        project_designated and project_leader tables, then drop the columns
+        on MySQL; other databases keep them, unused. Rows already copied are
+        skipped, so an interrupted migration can run again.
+        :param Engine engine: Database engine
+        :param session db_session: Database session
+        """
+        inspector = inspect(engine)
+        migrated = []
+        for table, column, target, project_column, user_column in LEGACY_ASSIGNMENT_COLUMNS:
+            if column not in set(item['name'] for item in inspector.get_columns(table)):
+                continue
+
+            db_session.execute(text(
+                'INSERT INTO `{target}` (project_id, user_id) '
+                'SELECT DISTINCT old.`{project}`, old.`{user}` FROM `{table}` old '
+                'WHERE old.`{column}` IS NOT NULL '
+                'AND EXISTS (SELECT 1 FROM `project` WHERE `project`.id = old.`{project}`) '
+                'AND EXISTS (SELECT 1 FROM `user` WHERE `user`.id = old.`{user}`) '
+                'AND NOT EXISTS (SELECT 1 FROM `{target}` copied '
+                'WHERE copied.project_id = old.`{project}` AND copied.user_id = old.`{user}`)'.format(
+                    target=target, project=project_column, user=user_column, table=table, column=column)))
+            migrated.append((table, column))
+
+        # MySQL DDL needs the metadata locks the copy holds until commit
+        db_session.commit()
+        if engine.dialect.name != 'mysql':
+            return
+
+        for table, column in migrated:
+            for foreign_key in inspector.get_foreign_keys(table):
+                if column in foreign_key['constrained_columns'] and foreign_key.get('name'):
+                    engine.execute('ALTER TABLE `{0}` DROP FOREIGN KEY `{1}`'.format(table, foreign_key['name']))
+            engine.execute('ALTER TABLE `{0}` DROP COLUMN `{1}`'.format(table, column))
+
+    @staticmethod
+    def drop_indexes(engine, table, names):
+        """
+        Drop the indexes of a table replaced by others, when they exist
+        :param Engine engine: Database engine
+        :param Table table: Table
+        :param tuple(str) names: Index names
+        """
+        existing = set(index['name'] for index in inspect(engine).get_indexes(table.name))
+        for name in names:
+            if name not in existing:
+                continue
+            if engine.dialect.name == 'mysql':
+                engine.execute('DROP INDEX `{0}` ON `{1}`'.format(name, table.name))
+            else:
+                engine.execute('DROP INDEX "{0}"'.format(name))
+
+    @staticmethod
+    def get_server_url(url=None):
+        """
+        Get the server url
+        :param str url: Server url, TASKHUB_DATABASE_URL when None
+        :return str: Server url
+        """
+        url = url or os.environ.get('TASKHUB_DATABASE_URL')
+        if not url:
+            raise Exception('TASKHUB_DATABASE_URL is not set')
+
+        return url
 
     @staticmethod
-    def get_server_connection():
+    def get_server_connection(url=None, **pool_settings):
         """
-        Get server connection
+        Get server connection, to the TASKHUB_DATABASE_URL url by default.
+        SQLite (benchmarks, local runs) keeps its default pool, which rejects
+        QueuePool settings.
+        :param str url: Server url
+        :param dict pool_settings: Connection pool settings
         :return Engine: Server connection
         """
-        return create_engine(
-            # to implement
-        )
+        url = DBSessionManage.get_server_url(url)
+        if url.startswith('sqlite'):
+            return create_engine(url)
+
+        return create_engine(url, poolclass=CappedQueuePool, **pool_settings)
+
+
+connection_limiter.on_full = DBSessionManage.release_idle_connections
@@ -0,0 +1,496 @@
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from models.project import Project, ProjectComments, ProjectDesignated, ProjectLeader, ProjectStats
+from models.user import User
+from modules.bulk import get_error_message, get_insert_values
+from modules.db_session_manage import DBSessionManage
+from modules.project import ProjectModule
+from modules.serializer import dumps, iter_chunks
+from modules.user import UserModule
+
+IMPORT_SETTINGS = {
+    'chunk_size': int(os.environ.get('IMPORT_CHUNK_SIZE', 1000)),
+    'transaction_size': int(os.environ.get('IMPORT_TRANSACTION_SIZE', 10000)),
+    'workers': int(os.environ.get('IMPORT_WORKERS', os.cpu_count() or 1))
+}
+
+# Import passes, each kind only referencing the kinds before it
+KINDS = ('users', 'projects', 'comments')
+
+
+def open_text(path):
+    """
+    Open a file for reading text, decompressing it when it ends with .gz
+    :param str path: Path
+    :return file: Text file
+    """
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_records(path):
+    """
+    Read the records of an NDJSON file as raw lines, for the workers to
+    decode, or of a CSV file with a header line as dicts
+    :param str path: Path, .csv or .csv.gz for CSV
+    :return generator: Records
+    """
+    with open_text(path) as source:
+        if path.endswith(('.csv', '.csv.gz')):
+            for row in csv.DictReader(source):
+                yield row
+
+        else:
+            for line in source:
+                if line.strip():
+                    yield line
+
+
+def get_datetime(params, field):
+    """
+    Get an optional ISO 8601 datetime param
+    :param dict params: Record
+    :param str field: Field
+    :return datetime: Value or None
+    """
+    value = params.get(field)
+    if value is None or value == '':
+        return None
+
+    try:
+        return datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        raise Exception('Invalid {0}'.format(field), 400)
+
+
+def get_id(params, field='id'):
+    """
+    Get a required id param
+    :param dict params: Record
+    :param str field: Field
+    :return int: Id
+    """
+    try:
+        value = int(params.get(field))
+    except (TypeError, ValueError):
+        raise Exception('Invalid {0}'.format(field), 400)
+
+    if value <= 0:
+        raise Exception('Invalid {0}'.format(field), 400)
+
+    return value
+
+
+def get_user_ids(value):
+    """
+    Get assigned user ids given as a list or separated by commas or spaces,
+    as written by the CSV export
+    :param value: Ids
+    :return list(int): User ids
+    """
+    if isinstance(value, str):
+        value = value.replace(' ', ',')
+
+    return sorted(set(ProjectModule.get_user_ids(value)))
+
+
+def validate_user(params):
+    """
+    Get the insert values of a user record
+    :param dict params: Record
+    :return tuple: Values and no references
+    """
+    user = UserModule.set_user(User(), params)
+    user.id = get_id(params)
+    user.created_at = get_datetime(params, 'created_at')
+    user.updated_at = get_datetime(params, 'updated_at')
+
+    return get_insert_values(user), None
+
+
+def validate_project(params):
+    """
+    Get the insert values and assigned users of a project record
+    :param dict params: Record
+    :return tuple: Values and (designated ids, leader ids)
+    """
+    project = ProjectModule.set_project(Project(), params)
+    project.id = get_id(params)
+    project.created_at = get_datetime(params, 'created_at')
+    project.updated_at = get_datetime(params, 'updated_at')
+    project.deadline = get_datetime(params, 'deadline')
+
+    return get_insert_values(project), (get_user_ids(params.get('designated')), get_user_ids(params.get('leader')))
+
+
+def validate_comment(params):
+    """
+    Get the insert values of a comment record
+    :param dict params: Record
+    :return tuple: Values and no references
+    """
+    comment = ProjectComments()
+    comment.id = get_id(params)
+    comment.created_at = get_datetime(params, 'created_at')
+    comment.description = params.get('description')
+    comment.project_id = get_id(params, 'project_id')
+    comment.reporter = get_id(params, 'reporter')
+
+    return get_insert_values(comment), None
+
+
+VALIDATORS = {
+    'users': validate_user,
+    'projects': validate_project,
+    'comments': validate_comment
+}
+
+
+def validate_chunk(task):
+    """
+    Decode and validate a chunk of records, in a worker process
+    :param tuple task: Kind and (position, record) pairs
+    :return list(tuple): (position, values, references, error) per record
+    """
+    kind, records = task
+    results = []
+    for position, record in records:
+        try:
+            params = json.loads(record) if isinstance(record, str) else record
+            if not isinstance(params, dict):
+                raise Exception('Record must be an object', 400)
+            values, references = VALIDATORS[kind](params)
+            results.append((position, values, references, None))
+
+        except Exception as error:
+            results.append((position, None, None, get_error_message(error)))
+
+    return results
+
+
+def get_existing_ids(model, ids, db_session):
+    """
+    Get which ids exist in a table
+    :param MYSQL model: Model with an id column
+    :param iterable ids: Ids
+    :param session db_session: Database session
+    :return set(int): Existing ids
+    """
+    ids = set(ids)
+    if not ids:
+        return set()
+
+    return set(id for id, in db_session.query(model.id).filter(model.id.in_(ids)))
+
+
+class Checkpoint(object):
+    """
+    Import progress saved after each commit: the passes done and the
+    records of the current pass already committed
+    """
+
+    def __init__(self, path, files):
+        """
+        Checkpoint
+        :param str path: Checkpoint file, None to not save progress
+        :param dict files: Path of each kind imported
+        """
+        self.path = path
+        self.state = {'files': files, 'kind': None, 'position': 0, 'done': [], 'counts': {}}
+
+        if path and os.path.exists(path):
+            with open(path) as source:
+                state = json.load(source)
+            if state['files'] != files:
+                raise Exception('Checkpoint {0} is for other files'.format(path))
+            self.state = state
+
+    def get_position(self, kind):
+        """
+        Get the records of a pass already committed
+        :param str kind: Kind
+        :return int: Records to skip
+        """
+        return self.state['position'] if self.state['kind'] == kind else 0
+
+    def save(self, kind, position, counts, done=False):
+        """
+        Save progress, replacing the checkpoint file atomically
+        :param str kind: Kind of the current pass
+        :param int position: Records committed in the pass
+        :param dict counts: Imported, error and skipped counts of the pass
+        :param bool done: Whether the pass is finished
+        """
+        self.state.update(kind=kind, position=position)
+        self.state['counts'][kind] = counts
+        if done and kind not in self.state['done']:
+            self.state['done'].append(kind)
+
+        if self.path:
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as target:
+                json.dump(self.state, target, sort_keys=True)
+            os.replace(temporary, self.path)
+
+
+class Importer(object):
+    """
+    Offline import of users, projects and comments from NDJSON or CSV
+    files. Each kind is a pass over its file, in KINDS order so that
+    references point to rows already imported; records keep their ids.
+    The file is read as a stream: the workers validate one transaction of
+    records while the previous one is inserted, so at most two
+    transactions of records are in memory.
+    """
+
+    def __init__(self, database, files, checkpoint=None, workers=None, chunk_size=None,
+                 transaction_size=None, errors=sys.stderr, report=sys.stderr):
+        """
+        Importer
+        :param str database: Database
+        :param dict files: Path of the file of each kind to import
+        :param str checkpoint: Checkpoint file to resume from and save progress to
+        :param int workers: Validation processes, 0 to validate in this process
+        :param int chunk_size: Records per INSERT statement
+        :param int transaction_size: Records per transaction
+        :param file errors: Where rejected records are written, as JSON lines
+        :param file report: Where progress is written
+        """
+        self.database = database
+        self.files = dict((kind, path) for kind, path in files.items() if path)
+        self.checkpoint = Checkpoint(checkpoint, self.files)
+        self.workers = IMPORT_SETTINGS['workers'] if workers is None else workers
+        self.chunk_size = chunk_size or IMPORT_SETTINGS['chunk_size']
+        self.transaction_size = transaction_size or IMPORT_SETTINGS['transaction_size']
+        self.errors = errors
+        self.report = report
+        self._pool = None
+
+    def run(self):
+        """
+        Import every file not imported yet, then recompute the project
+        comment counters and stats
+        :return dict: Imported, error and skipped counts by kind
+        """
+        # Fork the workers before any database connection is open
+        self._pool = multiprocessing.Pool(self.workers) if self.workers > 0 else None
+        try:
+            for kind in KINDS:
+                if kind in self.files and kind not in self.checkpoint.state['done']:
+                    self.import_file(kind)
+
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+        self.finish()
+        return self.checkpoint.state['counts']
+
+    def import_file(self, kind):
+        """
+        Import the records of one kind, resuming after the checkpoint
+        :param str kind: Kind
+        """
+        position = self.checkpoint.get_position(kind)
+        counts = dict(self.checkpoint.state['counts'].get(kind) or {'imported': 0, 'errors': 0, 'skipped': 0})
+        started = time.monotonic()
+        imported_before = counts['imported']
+
+        records = itertools.islice(enumerate(read_records(self.files[kind]), 1), position, None)
+        pending = None
+        for batch in iter_chunks(records, self.transaction_size):
+            validating = self.validate(kind, batch)
+            if pending is not None:
+                position = self.insert(kind, pending(), counts)
+                self.progress(kind, counts, imported_before, started)
+            pending = validating
+
+        if pending is not None:
+            position = self.insert(kind, pending(), counts)
+
+        self.checkpoint.save(kind, position, counts, done=True)
+        self.progress(kind, counts, imported_before, started, done=True)
+
+    def validate(self, kind, batch):
+        """
+        Start validating a batch of records
+        :param str kind: Kind
+        :param list batch: (position, record) pairs
+        :return function: Return the validated records, in order
+        """
+        tasks = [(kind, chunk) for chunk in iter_chunks(batch, self.chunk_size)]
+        if self._pool is None:
+            results = [validate_chunk(task) for task in tasks]
+            return lambda: [item for chunk in results for item in chunk]
+
+        result = self._pool.map_async(validate_chunk, tasks)
+        return lambda: [item for chunk in result.get() for item in chunk]
+
+    def insert(self, kind, items, counts):
+        """
+        Insert a batch of validated records in one transaction and save the
+        checkpoint. Records failing validation or referencing missing rows
+        are written to errors once the transaction commits, so a failed
+        transaction retried after resuming doesn't report them twice;
+        records whose id exists are skipped, as after resuming from a
+        checkpoint saved before a crash.
+        :param str kind: Kind
+        :param list items: (position, values, references, error) per record
+        :param dict counts: Counts of the pass, updated when the transaction commits
+        :return int: Position of the last record of the batch
+        """
+        batch_counts = dict(counts)
+        rejected = []
+        db_session = DBSessionManage(self.database, read_only=False).get_db_session()
+        try:
+            for chunk in iter_chunks(items, self.chunk_size):
+                rows = []
+                for position, values, references, error in chunk:
+                    if error is None:
+                        rows.append((position, values, references))
+                    else:
+                        self.reject(rejected, kind, position, error, batch_counts)
+
+                rows = self.check_references(kind, rows, db_session, batch_counts, rejected)
+                if rows:
+                    self.insert_rows(kind, rows, db_session)
+                    batch_counts['imported'] += len(rows)
+
+            db_session.commit()
+
+        except Exception as error:
+            db_session.rollback()
+            raise Exception('{0}: transaction ending at record {1} failed: {2}'.format(
+                kind, items[-1][0], get_error_message(error)))
+
+        finally:
+            db_session.close()
+
+        self.errors.writelines(rejected)
+        self.errors.flush()
+        counts.update(batch_counts)
+        self.checkpoint.save(kind, items[-1][0], counts)
+        return items[-1][0]
+
+    def check_references(self, kind, rows, db_session, counts, rejected):
+        """
+        Drop rows whose id exists or that reference missing users or projects
+        :param str kind: Kind
+        :param list rows: (position, values, references) of valid records
+        :param session db_session: Database session
+        :param dict counts: Counts of the transaction, updated
+        :param list rejected: Error lines of the transaction, appended to
+        :return list: Rows to insert
+        """
+        model = {'users': User, 'projects': Project, 'comments': ProjectComments}[kind]
+        existing = get_existing_ids(model, [values['id'] for _, values, _ in rows], db_session)
+
+        if kind == 'projects':
+            users = get_existing_ids(
+                User, [user_id for _, _, references in rows for ids in references for user_id in ids], db_session)
+        elif kind == 'comments':
+            users = get_existing_ids(User, [values['reporter'] for _, values, _ in rows], db_session)
+            projects = get_existing_ids(Project, [values['project_id'] for _, values, _ in rows], db_session)
+
+        checked = []
+        for position, values, references in rows:
+            if values['id'] in existing:
+                counts['skipped'] += 1
+                continue
+            existing.add(values['id'])
+
+            if kind == 'projects':
+                missing = [user_id for ids in references for user_id in ids if user_id not in users]
+                if missing:
+                    self.reject(rejected, kind, position, 'Unknown user {0}'.format(missing[0]), counts)
+                    continue
+            elif kind == 'comments':
+                if values['reporter'] not in users:
+                    self.reject(rejected, kind, position, 'Unknown reporter {0}'.format(values['reporter']), counts)
+                    continue
+                if values['project_id'] not in projects:
+                    self.reject(rejected, kind, position, 'Unknown project {0}'.format(values['project_id']), counts)
+                    continue
+
+            checked.append((position, values, references))
+
+        return checked
+
+    @staticmethod
+    def insert_rows(kind, rows, db_session):
+        """
+        Insert a chunk of rows with their ids, and the assignments of projects
+        :param str kind: Kind
+        :param list rows: (position, values, references)
+        :param session db_session: Database session
+        """
+        model = {'users': User, 'projects': Project, 'comments': ProjectComments}[kind]
+        # Multi-row inserts need the same keys in every row
+        for _, group in itertools.groupby(
+                sorted(rows, key=lambda row: sorted(row[1])), key=lambda row: sorted(row[1])):
+            db_session.execute(model.__table__.insert().values([values for _, values, _ in group]))
+
+        if kind == 'projects':
+            for assignment, index in ((ProjectDesignated, 0), (ProjectLeader, 1)):
+                assignments = [
+                    {'project_id': values['id'], 'user_id': user_id}
+                    for _, values, references in rows for user_id in references[index]
+                ]
+                if assignments:
+                    db_session.execute(assignment.__table__.insert().values(assignments))
+
+    def finish(self):
+        """Recompute the counters the passes don't maintain: comments count and project stats"""
+        db_session = DBSessionManage(self.database, read_only=False).get_db_session()
+        try:
+            Project.reset_comments_count(db_session)
+            ProjectStats.lock_all(db_session)
+            ProjectStats.reconcile(db_session, int(time.time()))
+            db_session.commit()
+
+        except:
+            db_session.rollback()
+            raise
+
+        finally:
+            db_session.close()
+
+    @staticmethod
+    def reject(rejected, kind, position, error, counts):
+        """
+        Buffer a rejected record until its transaction commits
+        :param list rejected: Error lines of the transaction, appended to
+        :param str kind: Kind
+        :param int position: Record number in its file, from 1
+        :param str error: Error message
+        :param dict counts: Counts of the transaction, updated
+        """
+        counts['errors'] += 1
+        rejected.append(dumps({'kind': kind, 'record': position, 'error': error}) + '\n')
+
+    def progress(self, kind, counts, imported_before, started, done=False):
+        """
+        Write the progress of a pass with its rate
+        :param str kind: Kind
+        :param dict counts: Counts of the pass
+        :param int imported_before: Rows imported before this run
+        :param float started: Monotonic time the pass started in this run
+        :param bool done: Whether the pass is finished
+        """
+        elapsed = time.monotonic() - started
+        rate = (counts['imported'] - imported_before) / elapsed if elapsed else 0.0
+        self.report.write('{0}: {1} imported, {2} errors, {3} skipped, {4:.0f} rows/s{5}\n'.format(
+            kind, counts['imported'], counts['errors'], counts['skipped'], rate, ' (done)' if done else ''))
+        self.report.flush()
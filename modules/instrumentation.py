@@ -0,0 +1,150 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+INSTRUMENTATION_SETTINGS = {
+    'slow_query_ms': float(os.environ.get('DB_SLOW_QUERY_MS', 500)),
+    'slow_query_max_length': int(os.environ.get('DB_SLOW_QUERY_MAX_LENGTH', 2000))
+}
+
+slow_query_logger = logging.getLogger('taskhub.slow_query')
+
+_current = contextvars.ContextVar('taskhub_request_stats', default=None)
+
+NORMALIZE_PATTERNS = (
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%\([^)]+\)s|%s|:\w+'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?+)'),
+    (re.compile(r'\s+'), ' ')
+)
+
+
+class RequestStats(object):
+    """SQL counters of one request"""
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.pool_wait_seconds = 0.0
+        self.slow_queries = 0
+
+    def to_dict(self):
+        """
+        Return counters in dict format
+        :return dict: Counters, durations in milliseconds
+        """
+        return {
+            'db_statements': self.statements,
+            'db_ms': round(self.db_seconds * 1000, 3),
+            'db_rows': self.rows,
+            'db_pool_wait_ms': round(self.pool_wait_seconds * 1000, 3),
+            'db_slow_queries': self.slow_queries
+        }
+
+    def get_server_timing(self):
+        """
+        Get the Server-Timing header value of the counters
+        :return str: Server-Timing header
+        """
+        return 'db;desc="{0} statements, {1} rows";dur={2:.3f}, db-pool;dur={3:.3f}'.format(
+            self.statements, self.rows, self.db_seconds * 1000, self.pool_wait_seconds * 1000)
+
+
+def start_request():
+    """
+    Start collecting the SQL counters of the current request
+    :return RequestStats: Counters of the request
+    """
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def end_request():
+    """Stop collecting SQL counters in the current context"""
+    _current.set(None)
+
+
+def get_request_stats():
+    """
+    Get the SQL counters of the current request
+    :return RequestStats: Counters or None outside a request
+    """
+    return _current.get()
+
+
+def normalize_statement(statement):
+    """
+    Normalize a statement so equal queries group together: literals and
+    bind params become ?, IN lists collapse to (?+)
+    :param str statement: SQL statement
+    :return str: Normalized statement, truncated to slow_query_max_length
+    """
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+
+    return statement.strip()[:INSTRUMENTATION_SETTINGS['slow_query_max_length']]
+
+
+def instrument_engine(engine):
+    """
+    Time every statement of engine, add it to the counters of the current
+    request and log statements slower than slow_query_ms. Rows come from the
+    DBAPI rowcount, exact for buffered MySQL cursors and not available for
+    SQLite or server-side cursors. The start time is kept on the execution
+    context, which a failing statement discards with it; statements the
+    dialect runs without one, e.g. on first connect, are not timed.
+    :param Engine engine: Database engine
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'query_started', None)
+        if started is None:
+            return
+
+        elapsed = time.perf_counter() - started
+        slow = elapsed * 1000 >= INSTRUMENTATION_SETTINGS['slow_query_ms']
+
+        stats = _current.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_seconds += elapsed
+            if cursor.description is not None and cursor.rowcount > 0:
+                stats.rows += cursor.rowcount
+            if slow:
+                stats.slow_queries += 1
+
+        if slow:
+            slow_query_logger.warning(json.dumps({
+                'duration_ms': round(elapsed * 1000, 3),
+                'executemany': executemany,
+                'statement': normalize_statement(statement)
+            }))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool adding the time spent waiting for a connection, or opening
+    a new one, to the counters of the current request"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.pool_wait_seconds += time.perf_counter() - started
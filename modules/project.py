@@ -1,120 +1,487 @@
 import datetime
+import operator
 
-from models.project import Project
+from models.project import Project, ProjectDesignated, ProjectLeader, ProjectStats
+from models.user import User
+from modules.bulk import bulk_insert, get_error_message, get_insert_values
+from modules.cache import project_cache, user_cache
+from modules.conditional import get_etag
 from modules.db_session_manage import DBSessionManage
+from modules.project_comments import ProjectCommentsModule
+from modules.search_index import index_project, search_project_ids, unindex_project
+from modules.serializer import (
+    close_after, encode_list_response, get_row_encoder, gzip_stream, iter_chunks, stream_csv, stream_json_list,
+    stream_ndjson
+)
+from modules.unit_of_work import after_session_commit
 
 
 class ProjectModule(object):
     """Class for ProjectModule"""
 
-    def create(self, params, database):
+    BULK_CHUNK_SIZE = 500
+    BULK_TRANSACTION_SIZE = 5000
+    STREAM_CHUNK_SIZE = 500
+    EXPORT_CHUNK_SIZE = 2000
+
+    @classmethod
+    def create(cls, params, database, db_session=None):
         """
         Create project
         :params dict params: params to create project
         :params str database: Database
+        :param session db_session: Database session, a new one closed at the end when None
         :return Project
         """
-        db_session = DBSessionManage(database).get_db_session()
+        own_session = db_session is None
+        if own_session:
+            db_session = DBSessionManage(database).get_db_session()
         try:
-            project = Project(database)
-            project = self.set_project(project, params)
+            project = Project()
+            project = cls.set_project(project, params)
 
             db_session.add(project)
+            db_session.flush()
+            changed_user_ids = cls.set_assignments(project, params, db_session)
+            ProjectStats.move([], cls.get_stats_keys(project, params), db_session)
+            if own_session:
+                # Keep the flushed values readable once the session is closed
+                db_session.expunge(project)
+            project_id, title, description = project.id, project.title, project.description
+            after_session_commit(db_session, lambda: index_project(database, project_id, title, description))
             db_session.commit()
 
+            user_cache.invalidate(database, changed_user_ids)
+
             return project
 
         except:
             db_session.rollback()
-            db_session.close()
             raise
 
-    def update(self, project, params, db_session):
+        finally:
+            if own_session:
+                db_session.close()
+
+    @classmethod
+    def update(cls, project, params, db_session, database=None):
         """
         Update project
         :params dict params: params to update project
         :param session db_session: Database session
+        :param str database: Database, to invalidate cached dicts
         """
         if not project:
             raise Exception('ProjectModule: Project is required', 400)
 
         try:
-            project.deadline = params.get('deadline')
+            old_stats_keys = cls.get_stored_stats_keys(project, db_session)
+
+            project.deadline = cls.get_deadline(params.get('deadline'))
             project.description = params.get('description')
-            project.designated = params.get('designated')
-            project.leader = params.get('leader')
             project.status = params.get('status')
             project.title = params.get('title')
+            changed_user_ids = cls.set_assignments(project, params, db_session)
+            ProjectStats.move(old_stats_keys, cls.get_stats_keys(project, params), db_session)
 
-            project.updated_at = datetime.now()
+            project.mark_changed()
 
             db_session.add(project)
+            project_id, title, description = project.id, project.title, project.description
+            after_session_commit(db_session, lambda: index_project(database, project_id, title, description))
             db_session.commit()
 
+            project_cache.invalidate(database, [project.id])
+            user_cache.invalidate(database, changed_user_ids)
+
         except:
             db_session.rollback()
             db_session.close()
             raise
 
-    def delete(self, project, db_session):
+    @classmethod
+    def delete(cls, project, db_session, database=None):
         """
         Delete project
         :params dict project: Project to delete
         :param session db_session: Database session
+        :param str database: Database, to invalidate cached dicts
         """
         try:
+            project_id = project.id
+            user_ids = cls.get_assigned_user_ids([project_id], db_session)
+            ProjectStats.move(cls.get_stored_stats_keys(project, db_session), [], db_session)
+
             db_session.delete(project)
+            User.touch(user_ids, db_session)
             db_session.flush()
+            after_session_commit(db_session, lambda: unindex_project(database, project_id))
             db_session.commit()
 
+            project_cache.invalidate(database, [project_id])
+            user_cache.invalidate(database, user_ids)
+
         except:
             db_session.rollback()
             db_session.close()
             raise
 
     @classmethod
-    def search_by_filter_params(cls, params, database):
+    def bulk_create(cls, items, database, transaction_size=None):
+        """
+        Create many projects with chunked multi-row inserts
+        :param list(dict) items: Params of each project to create
+        :param str database: Database
+        :param int transaction_size: Projects committed per transaction
+        :return dict: Created count and the id or error of each item
+        """
+        errors = []
+        user_ids = set()
+
+        def get_rows():
+            for index, params in enumerate(items):
+                try:
+                    if not isinstance(params, dict):
+                        raise Exception('Item must be an object', 400)
+                    values = get_insert_values(cls.set_project(Project(), params))
+                    assignments = (
+                        cls.get_user_ids(params.get('designated')),
+                        cls.get_user_ids(params.get('leader'))
+                    )
+                    user_ids.update(assignments[0] + assignments[1])
+                    stats_keys = ProjectStats.get_keys(
+                        values['status'], values.get('deadline'), assignments[0], assignments[1])
+                    yield index, values, assignments + (stats_keys,)
+
+                except Exception as error:
+                    errors.append({'index': index, 'error': get_error_message(error)})
+
+        db_session = DBSessionManage(database).get_standalone_session()
+        try:
+            results = bulk_insert(
+                db_session, Project.__table__, get_rows(), cls.BULK_CHUNK_SIZE,
+                transaction_size or cls.BULK_TRANSACTION_SIZE, cls.after_insert_chunk)
+
+        finally:
+            db_session.close()
+            user_cache.invalidate(database, user_ids)
+
+        for result in results:
+            if 'id' in result:
+                params = items[result['index']]
+                index_project(database, result['id'], params.get('title'), params.get('description'))
+
+        return cls.get_bulk_response(results + errors)
+
+    @classmethod
+    def after_insert_chunk(cls, db_session, projects):
+        """
+        Insert the assignments of a chunk of new projects and count them in the stats
+        :param session db_session: Database session
+        :param list projects: (project id, (designated ids, leader ids, stats keys)) pairs
+        """
+        cls.insert_assignments(db_session, projects)
+        ProjectStats.move([], [key for _, extra in projects for key in extra[2]], db_session)
+
+    @staticmethod
+    def insert_assignments(db_session, projects):
+        """
+        Insert designated and leader rows of a chunk of new projects
+        :param session db_session: Database session
+        :param list projects: (project id, (designated ids, leader ids, ...)) pairs
+        """
+        user_ids = set()
+        for model, position in ((ProjectDesignated, 0), (ProjectLeader, 1)):
+            rows = [
+                {'project_id': project_id, 'user_id': user_id}
+                for project_id, assignments in projects
+                for user_id in sorted(set(assignments[position]))
+            ]
+            if rows:
+                db_session.execute(model.__table__.insert().values(rows))
+                user_ids.update(row['user_id'] for row in rows)
+
+        User.touch(user_ids, db_session)
+
+    @classmethod
+    def update_status_by_filter_params(cls, params, status, database):
+        """
+        Move all projects matching filter params to a new status
+        :param dict params: Filter params
+        :param str status: New status
+        :param str database: Database
+        :return dict: Number of updated projects
+        """
+        if not status or len(status) > Project.status.type.length:
+            raise Exception('ProjectModule: Invalid status', 400)
+
+        Project.check_filter_params(params)
+
+        db_session = DBSessionManage(database).get_db_session()
+        try:
+            old_stats_keys = ProjectStats.count_keys_by_filter_params(params, db_session)
+            count = Project.update_status_by_filter_params(params, status, db_session)
+            if count:
+                ProjectStats.move(old_stats_keys, ProjectStats.set_status(old_stats_keys, status), db_session)
+            db_session.commit()
+
+            # The updated ids are unknown without an extra SELECT
+            if count:
+                project_cache.invalidate_database(database)
+
+            return {'count': count}
+
+        except:
+            db_session.rollback()
+            raise
+
+        finally:
+            db_session.close()
+
+    @classmethod
+    def get_dict_by_id(cls, project_id, database, db_session, etag=None):
+        """
+        Get project in dict format, from cache when possible
+        :param int project_id: Project id
+        :param str database: Database
+        :param session db_session: Database session
+        :param str etag: Current ETag, from get_etag, a cached dict of another one is reloaded
+        :return dict: Project in dict format or None when not found
+        """
+        def load():
+            row = Project.get_row_by_id(project_id, db_session)
+            return cls.projects_to_dict([row], db_session)[0] if row else None
+
+        return project_cache.get_or_load(database, project_id, load, etag)
+
+    @staticmethod
+    def get_etag(project_id, db_session):
+        """
+        Get the ETag of a project from a lightweight query on its version
+        :param int project_id: Project id
+        :param session db_session: Database session
+        :return str: ETag or None when not found
+        """
+        version = Project.get_version(project_id, db_session)
+        if version is None:
+            return None
+
+        return get_etag('project', project_id, version)
+
+    @classmethod
+    def get_detail(cls, project_id, comments_limit, database, db_session, etag=None):
+        """
+        Get project in dict format with its latest comments
+        :param int project_id: Project id
+        :param str comments_limit: Number of comments to embed
+        :param str database: Database
+        :param session db_session: Database session
+        :param str etag: Current ETag, from get_etag
+        :return dict: Project detail
+        """
+        project_dict = cls.get_dict_by_id(project_id, database, db_session, etag)
+        if not project_dict:
+            raise Exception('Project not found', 404)
+
+        project_dict['comments'], project_dict['comments_next_cursor'] = \
+            ProjectCommentsModule.get_latest(project_id, comments_limit, db_session)
+
+        return project_dict
+
+    @classmethod
+    def search_by_filter_params(cls, params, database, db_session=None):
         """
         Search projects by filter params
-        :param dict params: Request params
+        :param dict params: Request params with optional limit, cursor and fields
         :param str database: Database
+        :param session db_session: Database session, a new one closed at the end when None
         :return dict: Search projects response
         """
+        own_session = db_session is None
+        if own_session:
+            db_session = DBSessionManage(database).get_db_session()
+
+        try:
+            projects, count, next_cursor = cls.get_page(params, database, db_session)
+
+            response = cls.get_default_response()
+            response['count'] = count
+            response['next_cursor'] = next_cursor
+            response['projects'] = cls.projects_to_dict(projects, db_session, Project.get_fields(params))
+
+            return response
+
+        finally:
+            if own_session:
+                db_session.close()
+
+    @classmethod
+    def search_json_by_filter_params(cls, params, database):
+        """
+        Search projects by filter params, encoding rows straight to JSON
+        :param dict params: Request params with optional limit, cursor and fields
+        :param str database: Database
+        :return str: Search projects response in JSON
+        """
         db_session = DBSessionManage(database).get_db_session()
+        try:
+            projects, count, next_cursor = cls.get_page(params, database, db_session)
 
-        projects, count = Project.get_by_filter_params(params, database)
+            return encode_list_response(
+                'projects', cls.encode_projects(projects, db_session, Project.get_fields(params)),
+                count=count, next_cursor=next_cursor)
 
-        response = cls.get_default_response()
-        response['count'] = count
-        response['projects'] = cls.projects_to_dict(projects)
+        finally:
+            db_session.close()
 
-        db_session.close()
+    @staticmethod
+    def get_page(params, database, db_session):
+        """
+        Get one page of projects: ranked by relevance among the full-text
+        matches of q when given, else in keyset order
+        :param dict params: Request params
+        :param str database: Database
+        :param session db_session: Database session
+        :return: Page of projects, total count and next cursor
+        """
+        if params.get('q'):
+            ids = search_project_ids(database, params['q'], db_session)
+            return Project.get_by_ranked_ids(ids, params, db_session)
 
-        return response
+        return Project.get_by_filter_params(params, db_session)
 
     @classmethod
-    def projects_to_dict(cls, projects):
+    def stream_by_filter_params(cls, params, database):
+        """
+        Stream projects by filter params as JSON, reading rows in chunks
+        through a server-side cursor so memory stays flat. Params are
+        validated and the query built before returning, so errors are sent
+        as such instead of a truncated 200.
+        :param dict params: Request params
+        :param str database: Database
+        :return generator(bytes): JSON response parts
+        """
+        db_manage = DBSessionManage(database)
+        # A MySQL connection can't run other statements while a server-side
+        # cursor is open, so relation lookups use a second session
+        stream_session = db_manage.get_standalone_session()
+        db_session = db_manage.get_standalone_session()
+
+        def close():
+            stream_session.close()
+            db_session.close()
+
+        try:
+            fields = Project.get_fields(params)
+            rows = Project.get_stream_by_filter_params(params, stream_session, cls.STREAM_CHUNK_SIZE)
+            parts = stream_json_list(
+                'projects', iter_chunks(rows, cls.STREAM_CHUNK_SIZE),
+                lambda chunk: cls.encode_projects(chunk, db_session, fields))
+
+        except:
+            close()
+            raise
+
+        return close_after(parts, close)
+
+    @classmethod
+    def export_by_filter_params(cls, params, database, export_format, gzip=False):
+        """
+        Export all projects by filter params as NDJSON or CSV, reading rows in
+        chunks through a server-side cursor in id order so memory stays flat
+        :param dict params: Request params with optional fields
+        :param str database: Database
+        :param str export_format: ndjson or csv
+        :param bool gzip: Compress the export
+        :return generator(bytes): Export parts
+        """
+        parts = cls._export_by_filter_params(params, database, export_format)
+
+        return gzip_stream(parts) if gzip else parts
+
+    @classmethod
+    def _export_by_filter_params(cls, params, database, export_format):
+        """
+        Export all projects by filter params, uncompressed. Params are validated
+        and the query built before returning.
+        :param dict params: Request params with optional fields
+        :param str database: Database
+        :param str export_format: ndjson or csv
+        :return generator(bytes): Export parts
+        """
+        db_manage = DBSessionManage(database)
+        # Relation lookups can't share the connection of the open cursor
+        stream_session = db_manage.get_standalone_session()
+        db_session = db_manage.get_standalone_session()
+
+        def close():
+            stream_session.close()
+            db_session.close()
+
+        try:
+            fields = Project.get_fields(params)
+            chunks = iter_chunks(
+                Project.get_export_by_filter_params(params, stream_session, cls.EXPORT_CHUNK_SIZE),
+                cls.EXPORT_CHUNK_SIZE)
+
+            if export_format == 'csv':
+                parts = stream_csv(fields, chunks, lambda chunk: cls.get_rows_values(chunk, db_session, fields))
+            else:
+                parts = stream_ndjson(chunks, lambda chunk: cls.encode_projects(chunk, db_session, fields))
+
+        except:
+            close()
+            raise
+
+        return close_after(parts, close)
+
+    @classmethod
+    def projects_to_dict(cls, projects, db_session, fields=Project.FIELDS):
         """
         Return projects in dict format
-        :param list of project: List with projects
+        :param list of project: List with projects rows
+        :param session db_session: Database session
+        :param tuple(str) fields: Fields to return
         :return list(dict): List with projects in dict format
         """
-        projects_dict = []
-        for project in projects:
-            project_dict = {
-                'id': project.id,
-                'created_at': project.created_at,
-                'deadline': project.deadline,
-                'description': project.description,
-                'designated': project.designated,
-                'leader': project.leader,
-                'status': project.status,
-                'title': project.title,
-                'updated_at': project.updated_at
-            }
-            projects_dict.append(project_dict)
+        return [dict(zip(fields, values)) for values in cls.get_rows_values(projects, db_session, fields)]
+
+    @classmethod
+    def encode_projects(cls, projects, db_session, fields=Project.FIELDS):
+        """
+        Return projects encoded as JSON objects, without intermediate dicts
+        :param list of project: List with projects rows
+        :param session db_session: Database session
+        :param tuple(str) fields: Fields to encode
+        :return list(str): List with projects in JSON
+        """
+        encode = get_row_encoder(fields)
+        return [encode(values) for values in cls.get_rows_values(projects, db_session, fields)]
+
+    @staticmethod
+    def get_rows_values(projects, db_session, fields):
+        """
+        Get the values of each row in fields order. Designated and leader
+        are loaded for the whole list with one query each, only when requested.
+        :param list of project: List with projects rows
+        :param session db_session: Database session
+        :param tuple(str) fields: Fields
+        :return list(tuple): Values of each row
+        """
+        ids = [project.id for project in projects]
+        relations = {}
+        if 'designated' in fields:
+            relations['designated'] = ProjectDesignated.get_user_ids_by_project_ids(ids, db_session)
+        if 'leader' in fields:
+            relations['leader'] = ProjectLeader.get_user_ids_by_project_ids(ids, db_session)
+
+        getters = [
+            (lambda row, ids_by_id=relations[field]: ids_by_id.get(row.id, []))
+            if field in relations else operator.attrgetter(field)
+            for field in fields
+        ]
 
-        return projects_dict
+        return [tuple(getter(project) for getter in getters) for project in projects]
 
     @classmethod
     def set_project(cls, project, params):
@@ -125,15 +492,122 @@ class ProjectModule(object):
         :param session db_session: Database session
         :return Project
         """
-        setattr(project, 'deadline', params.get('deadline'))
+        setattr(project, 'deadline', cls.get_deadline(params.get('deadline')))
         setattr(project, 'description', params.get('description'))
-        setattr(project, 'designated', params.get('designated'))
-        setattr(project, 'leader', params.get('leader'))
         setattr(project, 'status', params.get('status'))
         setattr(project, 'title', params.get('title'))
 
         return project
 
+    @classmethod
+    def set_assignments(cls, project, params, db_session):
+        """
+        Replace designated and leader users of Project
+        :param project project: Project model, already flushed
+        :param dict params: Project params with designated and leader user ids
+        :param session db_session: Database session
+        :return set(int): Ids of users whose assignments changed
+        """
+        changed = ProjectDesignated.set_user_ids(
+            project.id, cls.get_user_ids(params.get('designated')), db_session)
+        changed |= ProjectLeader.set_user_ids(
+            project.id, cls.get_user_ids(params.get('leader')), db_session)
+        User.touch(changed, db_session)
+
+        return changed
+
+    @staticmethod
+    def get_assigned_user_ids(project_ids, db_session):
+        """
+        Get ids of all users designated to or leading projects
+        :param list(int) project_ids: Project ids
+        :param session db_session: Database session
+        :return set(int): User ids
+        """
+        user_ids = set()
+        for model in (ProjectDesignated, ProjectLeader):
+            for ids in model.get_user_ids_by_project_ids(project_ids, db_session).values():
+                user_ids.update(ids)
+
+        return user_ids
+
+    @classmethod
+    def get_stats_keys(cls, project, params):
+        """
+        Get the stats counters of a project being saved with params
+        :param Project project: Project, flushed so defaults are set
+        :param dict params: Project params with designated and leader user ids
+        :return list(tuple): (kind, name) pairs
+        """
+        return ProjectStats.get_keys(
+            project.status, project.deadline,
+            cls.get_user_ids(params.get('designated')), cls.get_user_ids(params.get('leader')))
+
+    @staticmethod
+    def get_stored_stats_keys(project, db_session):
+        """
+        Get the stats counters of a project as stored
+        :param Project project: Project
+        :param session db_session: Database session
+        :return list(tuple): (kind, name) pairs
+        """
+        return ProjectStats.get_keys(
+            project.status, project.deadline,
+            ProjectDesignated.get_user_ids_by_project_ids([project.id], db_session).get(project.id, []),
+            ProjectLeader.get_user_ids_by_project_ids([project.id], db_session).get(project.id, []))
+
+    @staticmethod
+    def get_deadline(value):
+        """
+        Normalize a deadline param to a datetime
+        :param value: datetime, date or ISO 8601 string, e.g. 2024-05-31
+        :return datetime: Deadline or None
+        """
+        if value is None or value == '':
+            return None
+        if isinstance(value, datetime.datetime):
+            return value
+        if isinstance(value, datetime.date):
+            return datetime.datetime.combine(value, datetime.time())
+
+        try:
+            return datetime.datetime.fromisoformat(str(value))
+        except ValueError:
+            raise Exception('ProjectModule: Invalid deadline', 400)
+
+    @staticmethod
+    def get_user_ids(value):
+        """
+        Normalize a user id param to a list of ids
+        :param value: Id, list of ids or comma separated ids
+        :return list(int): User ids
+        """
+        if value is None or value == '':
+            return []
+        if isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = str(value).split(',')
+
+        try:
+            return [int(user_id) for user_id in values if str(user_id).strip()]
+        except ValueError:
+            raise Exception('ProjectModule: Invalid user id', 400)
+
+    @staticmethod
+    def get_bulk_response(results):
+        """
+        Get bulk create response
+        :param list(dict) results: Id or error of each item
+        :return dict: Bulk create response
+        """
+        results.sort(key=lambda item: item['index'])
+
+        return {
+            'count': sum(1 for item in results if 'id' in item),
+            'items': results
+        }
+
     @staticmethod
     def get_default_response():
         """
@@ -142,5 +616,6 @@ class ProjectModule(object):
         """
         return {
             'count': 0,
+            'next_cursor': None,
             'projects': []
         }
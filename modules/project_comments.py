@@ -1,28 +1,123 @@
-from models.project import ProjectComments
+from models.pagination import MAX_LIMIT
+from models.project import Project, ProjectComments
+from modules.cache import project_cache
+from modules.comment_writer import WRITE_BEHIND_SETTINGS, get_writer
+from modules.db_session_manage import DBSessionManage
+from modules.search_index import index_comment
+from modules.unit_of_work import after_commit, after_session_commit, get_unit_of_work
 
 
 class ProjectCommentsModule(object):
     """Class for ProjectCommentsModules"""
 
-    def __init__(self, db_session, project):
+    DEFAULT_DETAIL_LIMIT = 20
+
+    def __init__(self, db_session, project, database=None):
         """
         Project comments
         :param Session db_session: Database session
         :param Project project: Project
+        :param str database: Database, to invalidate the cached project
         """
         self.db_session = db_session
         self.project = project
+        self.database = database
         self._locale = 'pt-BR'
 
     def create(self, description, user_id):
         """
-        Create a new project comment
+        Create a new project comment, keeping the project comments counter
+        in the same transaction. The caller commits.
+        The search index gets the comment once the transaction commits.
+        With COMMENTS_WRITE_BEHIND=1 the comment is queued instead and
+        inserted in a batch outside the caller's transaction, see
+        CommentWriteBehind for the acknowledgement modes. Within a request
+        it is queued once the request transaction commits: the writer then
+        never waits on row locks the request holds, and a request rolled
+        back queues nothing.
         :param str description: Description
         :param int user_id: User id
         """
+        if WRITE_BEHIND_SETTINGS['enabled']:
+            writer = get_writer(self.database)
+            project_id = self.project.id
+            if get_unit_of_work() is None:
+                writer.enqueue(project_id, description, user_id)
+            else:
+                after_commit(lambda: writer.enqueue(project_id, description, user_id))
+            return
+
         comment = ProjectComments()
         comment.description = description
         comment.project_id = self.project.id
         comment.reporter = user_id
 
         self.db_session.add(comment)
+        Project.increment_comments_count(self.project.id, 1, self.db_session)
+
+        project_cache.invalidate(self.database, [self.project.id])
+        project_id = self.project.id
+        after_session_commit(
+            self.db_session, lambda: index_comment(self.database, project_id, description))
+
+    @classmethod
+    def search_by_project_id(cls, project_id, params, database):
+        """
+        Get one page of the comments of a project, newest first
+        :param int project_id: Project id
+        :param dict params: Request params with optional limit and cursor
+        :param str database: Database
+        :return dict: Project comments response
+        """
+        db_session = DBSessionManage(database).get_db_session()
+        try:
+            count = Project.get_comments_count(project_id, db_session)
+            if count is None:
+                raise Exception('Project not found', 404)
+
+            comments, next_cursor = ProjectComments.get_page_by_project_id(
+                project_id, params, db_session)
+
+            response = cls.get_default_response()
+            response['count'] = count
+            response['next_cursor'] = next_cursor
+            response['comments'] = [comment.to_dict() for comment in comments]
+
+            return response
+
+        finally:
+            db_session.close()
+
+    @classmethod
+    def get_latest(cls, project_id, comments_limit, db_session):
+        """
+        Get the latest comments embedded in the project detail
+        :param int project_id: Project id
+        :param str comments_limit: Number of comments, DEFAULT_DETAIL_LIMIT when empty
+        :param Session db_session: Database session
+        :return tuple: List with comments in dict format and next cursor
+        """
+        try:
+            limit = int(comments_limit or cls.DEFAULT_DETAIL_LIMIT)
+        except ValueError:
+            raise Exception('Invalid comments_limit', 400)
+
+        if limit < 1:
+            return [], None
+
+        comments, next_cursor = ProjectComments.get_page_by_project_id(
+            project_id, {'limit': min(limit, MAX_LIMIT)}, db_session)
+
+        return [comment.to_dict() for comment in comments], next_cursor
+
+    @staticmethod
+    def get_default_response():
+        """
+        Get project comments default response
+        :return dict: Project comments default response
+        """
+        return {
+            'comments': [],
+            'count': 0,
+            'next_cursor': None
+        }
@@ -0,0 +1,122 @@
+import datetime
+import time
+
+from models.project import ProjectStats
+from modules.db_session_manage import DBSessionManage
+
+
+class ProjectStatsModule(object):
+    """Class for ProjectStatsModule"""
+
+    @classmethod
+    def get_stats(cls, database):
+        """
+        Get project aggregates from the maintained counters; reconciliation
+        is left to the maintenance path, see reconcile
+        :param str database: Database
+        :return dict: Project stats response
+        """
+        db_session = DBSessionManage(database).get_db_session()
+        try:
+            rows = ProjectStats.get_all(db_session)
+
+        finally:
+            db_session.close()
+
+        return cls.get_stats_response(rows)
+
+    @classmethod
+    def reconcile(cls, database, max_age=0):
+        """
+        Recompute the counters of a database on the primary, e.g. from a
+        periodic bootstrap.py --reconcile-stats. Writers wait until it commits.
+        :param str database: Database
+        :param int max_age: Skip when another process reconciled less than
+            max_age seconds ago, 0 to always reconcile
+        :return list: Counter rows after the reconciliation
+        """
+        db_session = DBSessionManage(database, read_only=False).get_standalone_session()
+        try:
+            rows = ProjectStats.lock_all(db_session)
+            if not max_age or time.time() - cls.get_reconciled_at(rows) >= max_age:
+                ProjectStats.reconcile(db_session, int(time.time()))
+                rows = ProjectStats.get_all(db_session)
+
+            db_session.commit()
+            return rows
+
+        except:
+            db_session.rollback()
+            raise
+
+        finally:
+            db_session.close()
+
+    @staticmethod
+    def get_reconciled_at(rows):
+        """
+        Get when the counters were last reconciled
+        :param list rows: Counter rows
+        :return int: Epoch seconds, 0 when never reconciled
+        """
+        for kind, name, count in rows:
+            if kind == 'meta' and name == 'reconciled_at':
+                return count
+
+        return 0
+
+    @classmethod
+    def get_stats_response(cls, rows):
+        """
+        Build the stats response from counter rows
+        :param list rows: Counter rows
+        :return dict: Project stats response
+        """
+        response = cls.get_default_response()
+        today = datetime.date.today().isoformat()
+
+        for kind, name, count in rows:
+            if kind == 'meta':
+                if name == 'reconciled_at' and count:
+                    response['reconciled_at'] = datetime.datetime.utcfromtimestamp(count)
+                continue
+
+            if not count:
+                continue
+
+            if kind == 'status':
+                response['count'] += count
+                response['by_status'][name] = count
+
+            elif kind == 'overdue':
+                if name != 'finished':
+                    response['overdue'] += count
+
+            elif kind == 'deadline':
+                # Days passed since the last reconciliation
+                day, status = name.split('|', 1)
+                if day < today and status != 'finished':
+                    response['overdue'] += count
+
+            else:
+                user_id, status = name.split('|', 1)
+                workload = response[kind].setdefault(user_id, {'count': 0, 'by_status': {}})
+                workload['count'] += count
+                workload['by_status'][status] = count
+
+        return response
+
+    @staticmethod
+    def get_default_response():
+        """
+        Get project stats default response
+        :return dict: Project stats default response
+        """
+        return {
+            'count': 0,
+            'by_status': {},
+            'overdue': 0,
+            'designated': {},
+            'leader': {},
+            'reconciled_at': None
+        }
@@ -0,0 +1,179 @@
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+REPLICA_SETTINGS = {
+    'urls': [url.strip() for url in os.environ.get('TASKHUB_REPLICA_URLS', '').split(',') if url.strip()],
+    'balance': os.environ.get('TASKHUB_REPLICA_BALANCE', 'round_robin'),
+    'max_lag': int(os.environ.get('TASKHUB_REPLICA_MAX_LAG', 30)),
+    'lag_check_interval': int(os.environ.get('TASKHUB_REPLICA_LAG_CHECK_INTERVAL', 5)),
+    'read_your_writes': int(os.environ.get('TASKHUB_READ_YOUR_WRITES_SECONDS', 10)),
+    'cookie': 'taskhub_last_write'
+}
+
+_read_only = contextvars.ContextVar('taskhub_read_only', default=False)
+
+
+def set_read_only(read_only):
+    """
+    Mark the current request as read-only, so its sessions may use replicas
+    :param bool read_only: Whether the request is read-only
+    """
+    _read_only.set(read_only)
+
+
+def is_read_only():
+    """
+    Whether the current request is read-only
+    :return bool: Read-only
+    """
+    return _read_only.get()
+
+
+class ReplicaSelector(object):
+    """
+    Choose the replica serving a read-only session, among the replicas
+    whose replication lag is at most max_lag seconds. Lag is read with
+    SHOW REPLICA STATUS, or SHOW SLAVE STATUS before MySQL 8.0.22, at most
+    every lag_check_interval seconds per replica; a replica that can't
+    report it is skipped. A single request probes a replica, outside the
+    lock, while the others keep the last result. When no replica is fresh,
+    reads fall back to the primary.
+    """
+
+    BALANCE_MODES = ('least_busy', 'round_robin')
+    STATUS_STATEMENTS = (
+        ('SHOW REPLICA STATUS', 'Seconds_Behind_Source'),
+        ('SHOW SLAVE STATUS', 'Seconds_Behind_Master')
+    )
+
+    def __init__(self, count, balance, max_lag, lag_check_interval):
+        """
+        Replica selector
+        :param int count: Number of replicas
+        :param str balance: Balancing mode, round_robin or least_busy
+        :param int max_lag: Seconds of lag tolerated, 0 to skip the check
+        :param int lag_check_interval: Seconds between lag checks of a replica
+        """
+        if balance not in self.BALANCE_MODES:
+            raise Exception('Invalid replica balance mode {0}'.format(balance))
+
+        self.count = count
+        self.balance = balance
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+
+        self._counter = itertools.count()
+        self._freshness = {}
+        self._checking = set()
+        self._status_statements = {}
+        self._lock = threading.Lock()
+
+        self.reads = [0] * count
+        self.fallbacks = 0
+
+    def choose(self, get_engine, get_lag_engine=None):
+        """
+        Choose a replica
+        :param function get_engine: Return the engine of a replica index
+        :param function get_lag_engine: Return the engine checking the lag of
+            a replica index, get_engine when None
+        :return int: Replica index or None to use the primary
+        """
+        fresh = [index for index in range(self.count) if self.is_fresh(index, get_lag_engine or get_engine)]
+        if not fresh:
+            self.fallbacks += 1
+            return None
+
+        if self.balance == 'least_busy':
+            index = min(fresh, key=lambda index: getattr(get_engine(index).pool, 'checkedout', lambda: 0)())
+        else:
+            index = fresh[next(self._counter) % len(fresh)]
+
+        self.reads[index] += 1
+        return index
+
+    def is_fresh(self, index, get_engine):
+        """
+        Whether a replica lag is within max_lag, checking it when the last
+        check is older than lag_check_interval
+        :param int index: Replica index
+        :param function get_engine: Return the engine of a replica index
+        :return bool: Fresh
+        """
+        if self.max_lag <= 0:
+            return True
+
+        checked_at, fresh = self._freshness.get(index, (None, False))
+        if checked_at is not None and time.monotonic() - checked_at < self.lag_check_interval:
+            return fresh
+
+        with self._lock:
+            checked_at, fresh = self._freshness.get(index, (None, False))
+            if index in self._checking or (
+                    checked_at is not None and time.monotonic() - checked_at < self.lag_check_interval):
+                return fresh
+            self._checking.add(index)
+
+        try:
+            fresh = self.check_lag(index, get_engine(index))
+            with self._lock:
+                self._freshness[index] = (time.monotonic(), fresh)
+
+        finally:
+            with self._lock:
+                self._checking.discard(index)
+
+        return fresh
+
+    def check_lag(self, index, engine):
+        """
+        Read the replication lag of a replica, with the first status
+        statement of STATUS_STATEMENTS the server accepts
+        :param int index: Replica index
+        :param Engine engine: Replica engine
+        :return bool: Whether the lag is known and within max_lag
+        """
+        statements = self.STATUS_STATEMENTS[self._status_statements.get(index, 0):]
+        try:
+            with engine.connect() as connection:
+                for position, (statement, column) in enumerate(statements):
+                    try:
+                        row = connection.execute(text(statement)).first()
+                        break
+                    except Exception:
+                        if position == len(statements) - 1:
+                            raise
+
+                        logging.info('%s failed on replica %s, falling back', statement, index)
+
+        except Exception:
+            logging.exception('Replica lag check failed')
+            return False
+
+        self._status_statements[index] = self.STATUS_STATEMENTS.index((statement, column))
+        if row is None or row[column] is None:
+            return False
+
+        return row[column] <= self.max_lag
+
+    def get_stats(self):
+        """
+        Get replica metrics
+        :return dict: Reads by replica, primary fallbacks and freshness
+        """
+        return {
+            'replica_reads': list(self.reads),
+            'replica_fallbacks': self.fallbacks,
+            'replica_fresh': [self._freshness.get(index, (None, None))[1] for index in range(self.count)]
+        }
+
+
+replica_selector = ReplicaSelector(
+    len(REPLICA_SETTINGS['urls']), REPLICA_SETTINGS['balance'],
+    REPLICA_SETTINGS['max_lag'], REPLICA_SETTINGS['lag_check_interval'])
@@ -0,0 +1,456 @@
+import bisect
+import collections
+import datetime
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from models.project import Project, ProjectComments
+
+SEARCH_INDEX_SETTINGS = {
+    'max_results': int(os.environ.get('SEARCH_MAX_RESULTS', 1000)),
+    'refresh_interval': int(os.environ.get('SEARCH_REFRESH_INTERVAL', 30)),
+    'min_prefix_length': int(os.environ.get('SEARCH_MIN_PREFIX_LENGTH', 2)),
+    'max_indexes': int(os.environ.get('SEARCH_MAX_INDEXES', 100))
+}
+
+FIELD_WEIGHTS = {'title': 3.0, 'description': 1.0, 'comments': 0.5}
+PREFIX_FACTOR = 0.5
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """
+    Split a text in lowercase tokens without accents
+    :param str text: Text
+    :return list(str): Tokens
+    """
+    if not text:
+        return []
+
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchIndex(object):
+    """
+    Inverted index of project titles, descriptions and comments. Each
+    token keeps, by project, a weight summing 1 + log(tf) of each field
+    times the field weight. Queries match every token, by prefix too, and
+    rank by weight times the token idf, prefix matches counting less.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._documents = {}
+        self._tokens = []
+        self._local_comments = collections.Counter()
+        self._previous_local_comments = collections.Counter()
+        self._recent_comments = {}
+        self._lock = threading.RLock()
+
+        self.refreshed_at = None
+        self.checked_at = 0.0
+
+    def set_project(self, project_id, title, description):
+        """
+        Index the title and description of a project, keeping its comments
+        :param int project_id: Project id
+        :param str title: Title
+        :param str description: Description
+        """
+        with self._lock:
+            document = self._documents.get(project_id, {})
+            document = dict(document, title=collections.Counter(tokenize(title)),
+                            description=collections.Counter(tokenize(description)))
+            self._set_document(project_id, document)
+
+    def add_comment(self, project_id, description, local=False):
+        """
+        Index a comment of a project
+        :param int project_id: Project id
+        :param str description: Comment description
+        :param bool local: Written by this process, so the next refreshes skip it
+        """
+        with self._lock:
+            if local:
+                self._local_comments[(project_id, description)] += 1
+
+            document = dict(self._documents.get(project_id, {}))
+            document['comments'] = document.get('comments', collections.Counter()) + \
+                collections.Counter(tokenize(description))
+            self._set_document(project_id, document)
+
+    def add_stored_comment(self, project_id, description):
+        """
+        Index a comment read from the database, unless this process already
+        indexed it when it was written
+        :param int project_id: Project id
+        :param str description: Comment description
+        """
+        with self._lock:
+            key = (project_id, description)
+            for local_comments in (self._local_comments, self._previous_local_comments):
+                if local_comments[key]:
+                    local_comments[key] -= 1
+                    return
+
+            self.add_comment(project_id, description)
+
+    def add_recent_comment(self, comment_id, project_id, description, created_at):
+        """
+        Index a comment read by a refresh, unless an earlier refresh, whose
+        window overlaps, already read it
+        :param int comment_id: Comment id
+        :param int project_id: Project id
+        :param str description: Comment description
+        :param datetime created_at: Creation date
+        """
+        with self._lock:
+            if comment_id in self._recent_comments:
+                return
+
+            self._recent_comments[comment_id] = created_at
+            self.add_stored_comment(project_id, description)
+
+    def set_recent_comments(self, recent_comments):
+        """
+        Set the comments a build read in the window of the first refresh
+        :param dict recent_comments: Creation date by comment id
+        """
+        with self._lock:
+            self._recent_comments = dict(recent_comments)
+
+    def forget_recent_comments(self, before):
+        """
+        Forget the comments created before the window of the next refresh
+        :param datetime before: Start of the window
+        """
+        with self._lock:
+            self._recent_comments = dict((comment_id, created_at)
+                                         for comment_id, created_at in self._recent_comments.items()
+                                         if created_at is None or created_at >= before)
+
+    def claim_refresh(self):
+        """
+        Check whether a refresh is due, making it not due for other callers
+        :return bool: Refresh due
+        """
+        with self._lock:
+            if time.monotonic() - self.checked_at < SEARCH_INDEX_SETTINGS['refresh_interval']:
+                return False
+
+            self.checked_at = time.monotonic()
+            return True
+
+    def rotate_local_comments(self):
+        """Forget local comments not read back in two refreshes, e.g. rolled back"""
+        with self._lock:
+            self._previous_local_comments = +self._local_comments
+            self._local_comments = collections.Counter()
+
+    def set_documents(self, documents):
+        """
+        Index many projects at once
+        :param dict documents: Token counters by field, by project id
+        """
+        with self._lock:
+            for project_id, document in documents.items():
+                self._set_document(project_id, document)
+
+    def remove_project(self, project_id):
+        """
+        Remove a project from the index
+        :param int project_id: Project id
+        """
+        with self._lock:
+            self._set_document(project_id, None)
+
+    def search(self, q, limit):
+        """
+        Get the projects matching every token of q, best ranked first
+        :param str q: Query
+        :param int limit: Maximum number of ids
+        :return list(int): Project ids
+        """
+        tokens = tokenize(q)
+        if not tokens:
+            return []
+
+        with self._lock:
+            total = float(len(self._documents)) or 1.0
+            scores = None
+            for token in set(tokens):
+                token_scores = {}
+                for match in self._expand(token):
+                    postings = self._postings[match]
+                    factor = math.log(1 + total / len(postings)) * (1.0 if match == token else PREFIX_FACTOR)
+                    for project_id, weight in postings.items():
+                        token_scores[project_id] = max(token_scores.get(project_id, 0.0), weight * factor)
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = dict((project_id, score + token_scores[project_id])
+                                  for project_id, score in scores.items() if project_id in token_scores)
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [project_id for project_id, _ in ranked[:limit]]
+
+    def get_stats(self):
+        """
+        Get index size
+        :return dict: Number of projects and tokens
+        """
+        with self._lock:
+            return {'projects': len(self._documents), 'tokens': len(self._tokens)}
+
+    def _expand(self, token):
+        """
+        Get the indexed tokens matching a query token: itself and, when long
+        enough, the tokens it prefixes
+        :param str token: Query token
+        :return list(str): Indexed tokens
+        """
+        if len(token) < SEARCH_INDEX_SETTINGS['min_prefix_length']:
+            return [token] if token in self._postings else []
+
+        matches = []
+        position = bisect.bisect_left(self._tokens, token)
+        while position < len(self._tokens) and self._tokens[position].startswith(token):
+            matches.append(self._tokens[position])
+            position += 1
+
+        return matches
+
+    def _set_document(self, project_id, document):
+        """
+        Replace the postings of a project
+        :param int project_id: Project id
+        :param dict document: Token counters by field, None to remove
+        """
+        for token in self._get_weights(self._documents.pop(project_id, None)):
+            postings = self._postings[token]
+            postings.pop(project_id, None)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+        if document is None:
+            return
+
+        self._documents[project_id] = document
+        for token, weight in self._get_weights(document).items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                bisect.insort(self._tokens, token)
+            self._postings[token][project_id] = weight
+
+    @staticmethod
+    def _get_weights(document):
+        """
+        Get the weight of each token of a document
+        :param dict document: Token counters by field
+        :return dict: Weight by token
+        """
+        weights = {}
+        for field, counter in (document or {}).items():
+            for token, count in counter.items():
+                weights[token] = weights.get(token, 0.0) + FIELD_WEIGHTS[field] * (1 + math.log(count))
+
+        return weights
+
+
+_indexes = collections.OrderedDict()
+_indexes_lock = threading.Lock()
+_build_locks = {}
+
+
+def get_refresh_since(refreshed_at):
+    """
+    Get the start of the window a refresh reads: the previous refresh, less
+    refresh_interval for clock skew and transactions committed late
+    :param datetime refreshed_at: Start of the previous refresh
+    :return datetime: Start of the window
+    """
+    return refreshed_at - datetime.timedelta(seconds=SEARCH_INDEX_SETTINGS['refresh_interval'])
+
+
+def build(db_session):
+    """
+    Build an index from the database
+    :param session db_session: Database session
+    :return SearchIndex: Index
+    """
+    index = SearchIndex()
+    index.refreshed_at = datetime.datetime.now()
+    index.checked_at = time.monotonic()
+    since = get_refresh_since(index.refreshed_at)
+
+    documents = {}
+    for row in Project.get_search_rows(db_session):
+        documents[row.id] = {
+            'title': collections.Counter(tokenize(row.title)),
+            'description': collections.Counter(tokenize(row.description))
+        }
+    recent_comments = {}
+    for row in ProjectComments.get_search_rows(db_session):
+        document = documents.setdefault(row.project_id, {})
+        document.setdefault('comments', collections.Counter()).update(tokenize(row.description))
+        if row.created_at is None or row.created_at >= since:
+            recent_comments[row.id] = row.created_at
+
+    index.set_documents(documents)
+    index.set_recent_comments(recent_comments)
+    return index
+
+
+def get_index(database):
+    """
+    Get the index of a database, marking it as recently used
+    :param str database: Database
+    :return SearchIndex: Index or None when not built
+    """
+    with _indexes_lock:
+        index = _indexes.get(database)
+        if index is not None:
+            _indexes.move_to_end(database)
+
+        return index
+
+
+def set_index(database, index):
+    """
+    Set the index of a database, dropping the least recently used indexes
+    above max_indexes
+    :param str database: Database
+    :param SearchIndex index: Index
+    """
+    with _indexes_lock:
+        _indexes[database] = index
+        _indexes.move_to_end(database)
+
+        while len(_indexes) > max(SEARCH_INDEX_SETTINGS['max_indexes'], 1):
+            evicted, _ = _indexes.popitem(last=False)
+            _build_locks.pop(evicted, None)
+
+
+def get_build_lock(database):
+    """
+    Get the lock serializing the builds of a database index, so the first
+    searches of a database wait for one build without blocking other databases
+    :param str database: Database
+    :return Lock: Build lock
+    """
+    with _indexes_lock:
+        return _build_locks.setdefault(database, threading.Lock())
+
+
+def rebuild_index(database, db_session):
+    """
+    Build the index of a database and replace the current one, e.g. at startup
+    :param str database: Database
+    :param session db_session: Database session
+    """
+    with get_build_lock(database):
+        set_index(database, build(db_session))
+
+
+def refresh(index, db_session):
+    """
+    Catch up with writes made by other processes: projects updated and
+    comments created since the last refresh, less refresh_interval for clock
+    skew and transactions committed late. Comments read by the previous
+    refresh are skipped by id. Deleted projects are left in the index;
+    searches drop them when loading the matches.
+    :param SearchIndex index: Index
+    :param session db_session: Database session
+    """
+    started_at = datetime.datetime.now()
+    since = get_refresh_since(index.refreshed_at)
+
+    for row in Project.get_search_rows(db_session, since):
+        index.set_project(row.id, row.title, row.description)
+    for row in ProjectComments.get_search_rows(db_session, since):
+        index.add_recent_comment(row.id, row.project_id, row.description, row.created_at)
+
+    index.rotate_local_comments()
+    index.forget_recent_comments(get_refresh_since(started_at))
+    index.refreshed_at = started_at
+
+
+def search_project_ids(database, q, db_session):
+    """
+    Search projects of a database, building its index on first use and
+    refreshing it every refresh_interval seconds
+    :param str database: Database
+    :param str q: Query
+    :param session db_session: Database session
+    :return list(int): Project ids, best ranked first
+    """
+    index = get_index(database)
+    if index is None:
+        with get_build_lock(database):
+            index = get_index(database)
+            if index is None:
+                index = build(db_session)
+                set_index(database, index)
+
+    elif index.claim_refresh():
+        refresh(index, db_session)
+
+    return index.search(q, SEARCH_INDEX_SETTINGS['max_results'])
+
+
+def index_project(database, project_id, title, description):
+    """
+    Index a created or updated project, when its database index is built
+    :param str database: Database
+    :param int project_id: Project id
+    :param str title: Title
+    :param str description: Description
+    """
+    index = _indexes.get(database)
+    if index is not None:
+        index.set_project(project_id, title, description)
+
+
+def index_comment(database, project_id, description):
+    """
+    Index a new comment, when its database index is built
+    :param str database: Database
+    :param int project_id: Project id
+    :param str description: Comment description
+    """
+    index = _indexes.get(database)
+    if index is not None:
+        index.add_comment(project_id, description, local=True)
+
+
+def unindex_project(database, project_id):
+    """
+    Remove a deleted project, when its database index is built
+    :param str database: Database
+    :param int project_id: Project id
+    """
+    index = _indexes.get(database)
+    if index is not None:
+        index.remove_project(project_id)
+
+
+def get_stats():
+    """
+    Get the size of all indexes
+    :return dict: Index size by database
+    """
+    with _indexes_lock:
+        indexes = list(_indexes.items())
+
+    return dict((database or '', index.get_stats()) for database, index in indexes)
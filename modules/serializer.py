@@ -0,0 +1,273 @@
+import csv
+import datetime
+import functools
+import io
+import json
+import zlib
+
+from json.encoder import encode_basestring_ascii
+
+
+def json_default(value):
+    """
+    Encode values the json module does not know
+    :param value: Value
+    :return str: Encoded value
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+
+    raise TypeError('Object of type {0} is not JSON serializable'.format(type(value).__name__))
+
+
+def dumps(value):
+    """
+    Encode value as compact JSON
+    :param value: Value
+    :return str: JSON
+    """
+    return json.dumps(value, default=json_default, separators=(',', ':'))
+
+
+def encode_datetime(value):
+    """
+    Encode a datetime or date as a JSON ISO 8601 string
+    :param datetime value: Value
+    :return str: JSON
+    """
+    return '"' + value.isoformat() + '"'
+
+
+VALUE_ENCODERS = {
+    bool: lambda value: 'true' if value else 'false',
+    int: int.__repr__,
+    float: float.__repr__,
+    str: encode_basestring_ascii,
+    type(None): lambda value: 'null',
+    datetime.datetime: encode_datetime,
+    datetime.date: encode_datetime
+}
+
+
+def encode_value(value):
+    """
+    Encode a single value as JSON, dispatching on its exact type
+    :param value: Value
+    :return str: JSON
+    """
+    encoder = VALUE_ENCODERS.get(type(value))
+    return encoder(value) if encoder else dumps(value)
+
+
+@functools.lru_cache(maxsize=256)
+def get_row_encoder(fields):
+    """
+    Get an encoder of value tuples as JSON objects, with the keys of
+    fields encoded once
+    :param tuple(str) fields: Object keys, in the order of the values
+    :return function: Encode a tuple of values as a JSON object
+    """
+    prefixes = ['{0}:'.format(encode_basestring_ascii(field)) for field in fields]
+    prefixes = ['{' + prefixes[0]] + [',' + prefix for prefix in prefixes[1:]]
+
+    def encode(values):
+        return ''.join([prefix + encode_value(value) for prefix, value in zip(prefixes, values)]) + '}'
+
+    return encode
+
+
+def encode_list_response(key, encoded_rows, **fields):
+    """
+    Encode a list response from already encoded rows
+    :param str key: List key
+    :param list(str) encoded_rows: JSON objects
+    :param fields: Other response fields
+    :return str: JSON
+    """
+    parts = ['{0}:{1}'.format(encode_basestring_ascii(name), encode_value(value))
+             for name, value in sorted(fields.items())]
+    parts.append('{0}:[{1}]'.format(encode_basestring_ascii(key), ','.join(encoded_rows)))
+
+    return '{' + ','.join(parts) + '}'
+
+
+def iter_chunks(rows, size):
+    """
+    Group an iterable in lists of at most size items
+    :param iterable rows: Rows
+    :param int size: Chunk size
+    :return generator(list): Chunks
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def stream_json_list(key, chunks, encode_chunk):
+    """
+    Encode chunks of rows incrementally as {"<key>": [...], "count": n}
+    :param str key: List key
+    :param iterable chunks: Chunks of rows
+    :param function encode_chunk: Encode a chunk of rows as a list of JSON objects
+    :return generator(bytes): Encoded response parts
+    """
+    count = 0
+    yield '{{"{0}":['.format(key).encode('utf-8')
+
+    for chunk in chunks:
+        encoded = ','.join(encode_chunk(chunk))
+        yield ((',' if count else '') + encoded).encode('utf-8')
+        count += len(chunk)
+
+    yield '],"count":{0}}}'.format(count).encode('utf-8')
+
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8'
+}
+
+
+def get_export_format(params):
+    """
+    Get the export format requested with the format param
+    :param dict params: Request params
+    :return str: ndjson, the default, or csv
+    """
+    export_format = params.get('format') or 'ndjson'
+    if export_format not in EXPORT_CONTENT_TYPES:
+        raise Exception('Invalid format', 400)
+
+    return export_format
+
+
+def accepts_gzip(headers):
+    """
+    Whether a client accepts gzip encoded responses
+    :param headers: Request headers
+    :return bool: Whether Accept-Encoding lists gzip
+    """
+    for encoding in (headers.get('Accept-Encoding') or '').lower().split(','):
+        name, _, quality = encoding.partition(';')
+        if name.strip() == 'gzip':
+            return quality.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+
+    return False
+
+
+def stream_ndjson(chunks, encode_chunk):
+    """
+    Encode chunks of rows as NDJSON, one JSON object per line
+    :param iterable chunks: Chunks of rows
+    :param function encode_chunk: Encode a chunk of rows as a list of JSON objects
+    :return generator(bytes): Encoded response parts, one per chunk
+    """
+    for chunk in chunks:
+        yield ('\n'.join(encode_chunk(chunk)) + '\n').encode('utf-8')
+
+
+def encode_csv_value(value):
+    """
+    Encode a single value as a CSV cell: lists of ids joined by spaces,
+    datetimes in ISO 8601 and None as an empty cell
+    :param value: Value
+    :return: Cell value
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(item) for item in value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+
+    return value
+
+
+def stream_csv(fields, chunks, get_chunk_values):
+    """
+    Encode chunks of rows as CSV with a header line
+    :param tuple(str) fields: Column names
+    :param iterable chunks: Chunks of rows
+    :param function get_chunk_values: Get the values of a chunk of rows in fields order
+    :return generator(bytes): Encoded response parts, one per chunk
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    writer.writerow(fields)
+    yield buffer.getvalue().encode('utf-8')
+
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([encode_csv_value(value) for value in values]
+                         for values in get_chunk_values(chunk))
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_stream(parts, level=6):
+    """
+    Compress response parts incrementally in gzip format
+    :param iterable parts: Response parts
+    :param int level: Compression level
+    :return generator(bytes): Compressed parts, empty ones skipped
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for part in parts:
+            compressed = compressor.compress(part)
+            if compressed:
+                yield compressed
+
+        yield compressor.flush()
+
+    finally:
+        if hasattr(parts, 'close'):
+            parts.close()
+
+
+def close_after(parts, close):
+    """
+    Pass response parts through, calling close once they are all sent or
+    the response is closed early
+    :param iterable parts: Response parts
+    :param function close: Release what the parts are read from
+    :return generator(bytes): Response parts
+    """
+    try:
+        for part in parts:
+            yield part
+
+    finally:
+        close()
+
+
+def loads_items(body, content_type=None):
+    """
+    Decode a request body holding a JSON array or NDJSON lines
+    :param bytes body: Request body
+    :param str content_type: Request content type
+    :return list: Decoded items
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+
+    try:
+        if content_type and 'ndjson' in content_type:
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+        items = json.loads(body)
+
+    except ValueError:
+        raise Exception('Invalid JSON body', 400)
+
+    if not isinstance(items, list):
+        raise Exception('Body must be a JSON array', 400)
+
+    return items
@@ -0,0 +1,81 @@
+import ipaddress
+import os
+
+
+def get_tenants(value):
+    """
+    Parse the tenant registry, comma separated tenants each optionally
+    mapped to its database, e.g. acme,globex=globex_prod
+    :param str value: Registry
+    :return dict: Database by tenant
+    """
+    tenants = {}
+    for item in value.split(','):
+        tenant, _, database = item.strip().partition('=')
+        if tenant.strip():
+            tenants[tenant.strip().lower()] = database.strip() or tenant.strip()
+
+    return tenants
+
+
+def get_networks(value):
+    """
+    Parse comma separated addresses or networks, e.g. 10.0.0.0/8,127.0.0.1
+    :param str value: Addresses
+    :return list: Networks
+    """
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(',') if item.strip()]
+
+
+TENANT_SETTINGS = {
+    'header': os.environ.get('TASKHUB_TENANT_HEADER', 'X-Tenant'),
+    'host_suffix': os.environ.get('TASKHUB_TENANT_HOST_SUFFIX', ''),
+    'default': os.environ.get('TASKHUB_DATABASE') or None,
+    'tenants': get_tenants(os.environ.get('TASKHUB_TENANTS', '')),
+    'trusted_proxies': get_networks(os.environ.get('TASKHUB_TENANT_TRUSTED_PROXIES', ''))
+}
+
+
+def is_trusted_proxy(address):
+    """
+    Whether a peer address is a proxy allowed to choose the tenant by header
+    :param str address: Peer address
+    :return bool: Trusted
+    """
+    try:
+        address = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+
+    return any(address in network for network in TENANT_SETTINGS['trusted_proxies'])
+
+
+def get_database(request):
+    """
+    Get the tenant database of a request. The tenant comes from the tenant
+    header when the peer is a proxy of TASKHUB_TENANT_TRUSTED_PROXIES, or
+    else from the subdomain of the host when TASKHUB_TENANT_HOST_SUFFIX is
+    set, e.g. acme for acme.taskhub.example.com with suffix
+    .taskhub.example.com, and must be registered in TASKHUB_TENANTS, so
+    clients can't reach other schemas or create engines at will.
+    :param request: WSGI or ASGI request
+    :return str: Database or the default database when no tenant is given
+    """
+    tenant = None
+    if is_trusted_proxy(request.remote_addr):
+        tenant = request.headers.get(TENANT_SETTINGS['header'])
+
+    suffix = TENANT_SETTINGS['host_suffix']
+    if not tenant and suffix:
+        host = (request.headers.get('Host') or '').split(':', 1)[0].lower()
+        if host.endswith(suffix.lower()):
+            tenant = host[:-len(suffix)]
+
+    if not tenant:
+        return TENANT_SETTINGS['default']
+
+    database = TENANT_SETTINGS['tenants'].get(tenant.lower())
+    if database is None:
+        raise Exception('Tenant not found', 404)
+
+    return database
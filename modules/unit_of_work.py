@@ -0,0 +1,245 @@
+import contextvars
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+leak_logger = logging.getLogger('taskhub.session_leak')
+
+_unit_of_work = contextvars.ContextVar('taskhub_unit_of_work', default=None)
+
+
+class SessionCounters(object):
+    """Process-wide session metrics, to spot sessions left open"""
+
+    def __init__(self):
+        self.request_sessions = 0
+        self.standalone_opened = 0
+        self.standalone_closed = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.commit_failures = 0
+        self.leaked = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        """
+        Increment a counter
+        :param str name: Counter
+        :param int amount: Amount
+        """
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def get_stats(self):
+        """
+        Get session metrics
+        :return dict: Session counters, with standalone sessions still open
+        """
+        return {
+            'request_sessions': self.request_sessions,
+            'standalone_sessions_opened': self.standalone_opened,
+            'standalone_sessions_open': self.standalone_opened - self.standalone_closed,
+            'request_commits': self.commits,
+            'request_rollbacks': self.rollbacks,
+            'request_commit_failures': self.commit_failures,
+            'sessions_leaked': self.leaked
+        }
+
+
+session_counters = SessionCounters()
+
+
+class TrackedSession(Session):
+    """Session counted as open until its first close"""
+
+    def __init__(self, *args, **kwargs):
+        super(TrackedSession, self).__init__(*args, **kwargs)
+        self.released = False
+        session_counters.add('standalone_opened')
+
+    def close(self):
+        super(TrackedSession, self).close()
+        if not self.released:
+            self.released = True
+            session_counters.add('standalone_closed')
+
+
+class RequestSession(Session):
+    """
+    Session shared by every module call of a request. Modules keep calling
+    commit and close as with their own sessions: commit only flushes and
+    close does nothing, UnitOfWork commits or rolls back once at the end of
+    the request and closes it. A rollback is real and fails the request
+    transaction.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RequestSession, self).__init__(*args, **kwargs)
+        self.failed = False
+
+    def commit(self):
+        self.flush()
+
+    def rollback(self):
+        self.failed = True
+        super(RequestSession, self).rollback()
+
+    def close(self):
+        pass
+
+    def finish(self, commit):
+        """
+        End the request transaction and return the connection to the pool
+        :param bool commit: Commit, else roll back
+        """
+        try:
+            if commit and not self.failed:
+                Session.commit(self)
+            else:
+                Session.rollback(self)
+
+        finally:
+            Session.close(self)
+
+
+class UnitOfWork(object):
+    """
+    Sessions of one request: one RequestSession per database and replica,
+    opened on first use, and the standalone sessions opened meanwhile,
+    checked for leaks when the request ends. A request writes to one
+    database only, so its transaction commits or rolls back as a whole;
+    replica sessions only read and are rolled back.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.replicas = {}
+        self.standalone = []
+        self.callbacks = []
+
+    def get_session(self, key, engine):
+        """
+        Get the request session of an engine, opening it on first use
+        :param tuple key: Engine key, database and replica, None for the primary
+        :param Engine engine: Engine
+        :return RequestSession: Session
+        """
+        session = self.sessions.get(key)
+        if session is None:
+            if key[1] is None and any(other[1] is None for other in self.sessions):
+                raise Exception('A request can only write to one database', 500)
+
+            session = self.sessions[key] = RequestSession(bind=engine)
+            session_counters.add('request_sessions')
+
+        return session
+
+    def finish(self, commit):
+        """
+        Commit or roll back the primary session, roll back the replica
+        sessions and close them all; after a commit, run the after_commit
+        callbacks, raising the first error once all of them ran
+        :param bool commit: Commit, else roll back
+        """
+        sessions, self.sessions = self.sessions, {}
+        callbacks, self.callbacks = self.callbacks, []
+        commit = commit and not any(session.failed for session in sessions.values())
+
+        try:
+            for key, session in sorted(sessions.items(), key=lambda item: item[0][1] is None):
+                session.finish(commit and key[1] is None)
+
+        except Exception:
+            session_counters.add('commit_failures')
+            for session in sessions.values():
+                Session.close(session)
+            raise
+
+        session_counters.add('commits' if commit else 'rollbacks', len(sessions))
+        if not commit:
+            return
+
+        error = None
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as callback_error:
+                error = error or callback_error
+
+        if error is not None:
+            raise error
+
+    def release(self, path=None):
+        """
+        Close the standalone sessions the request left open, counting them as leaks
+        :param str path: Request path, for the log
+        """
+        for session in self.standalone:
+            if not session.released:
+                session_counters.add('leaked')
+                leak_logger.warning('Session left open by %s', path)
+                session.close()
+
+        self.standalone = []
+
+
+def start_unit_of_work():
+    """
+    Start the unit of work of a request
+    :return UnitOfWork: Unit of work
+    """
+    unit = UnitOfWork()
+    _unit_of_work.set(unit)
+    return unit
+
+
+def end_unit_of_work():
+    """Detach the unit of work from the current context"""
+    _unit_of_work.set(None)
+
+
+def get_unit_of_work():
+    """
+    Get the unit of work of the current request
+    :return UnitOfWork: Unit of work, None outside requests
+    """
+    return _unit_of_work.get()
+
+
+def after_commit(callback):
+    """
+    Run a function after the request transaction commits, e.g. to drop
+    cache entries a concurrent request may have filled with the old rows
+    :param function callback: Function without arguments, skipped outside requests
+    """
+    unit = get_unit_of_work()
+    if unit is not None:
+        unit.callbacks.append(callback)
+
+
+def after_session_commit(db_session, callback):
+    """
+    Run a function once the transaction of a session commits: the request
+    transaction within requests, else the next commit of the session; a
+    rollback drops it. Register it before calling commit.
+    :param Session db_session: Database session
+    :param function callback: Function without arguments
+    """
+    if get_unit_of_work() is not None:
+        after_commit(callback)
+        return
+
+    state = {'done': False}
+
+    def on_commit(session):
+        if not state['done']:
+            state['done'] = True
+            callback()
+
+    def on_rollback(session, previous_transaction):
+        state['done'] = True
+
+    event.listen(db_session, 'after_commit', on_commit, once=True)
+    event.listen(db_session, 'after_soft_rollback', on_rollback, once=True)
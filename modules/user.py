@@ -1,39 +1,65 @@
-import datetime
+import operator
 
+from models.project import Project, ProjectDesignated, ProjectLeader, ProjectStats
 from models.user import User
+from modules.bulk import bulk_insert, get_error_message, get_insert_values
+from modules.cache import project_cache, user_cache
+from modules.conditional import get_etag
 from modules.db_session_manage import DBSessionManage
+from modules.serializer import (
+    close_after, encode_list_response, get_row_encoder, gzip_stream, iter_chunks, stream_csv, stream_json_list,
+    stream_ndjson
+)
 
 
 class UserModule(object):
     """Class for UserModule"""
 
-    def create(self, params, database):
+    BULK_CHUNK_SIZE = 500
+    BULK_TRANSACTION_SIZE = 5000
+    STREAM_CHUNK_SIZE = 500
+    EXPORT_CHUNK_SIZE = 2000
+
+    @classmethod
+    def create(cls, params, database, db_session=None):
         """
         Create user
         :params dict params: params to create user
         :params str database: Database
+        :param session db_session: Database session, a new one closed at the end when None
         :return User
         """
-        db_session = DBSessionManage(database).get_db_session()
+        own_session = db_session is None
+        if own_session:
+            db_session = DBSessionManage(database).get_db_session()
         try:
-            user = User(database)
-            user = self.set_user(user, params)
+            user = User()
+            user = cls.set_user(user, params)
 
             db_session.add(user)
+            db_session.flush()
+            if own_session:
+                # Keep the flushed values readable once the session is closed
+                db_session.expunge(user)
             db_session.commit()
 
             return user
 
         except:
             db_session.rollback()
-            db_session.close()
             raise
 
-    def update(self, user, params, db_session):
+        finally:
+            if own_session:
+                db_session.close()
+
+    @classmethod
+    def update(cls, user, params, db_session, database=None):
         """
         Update user
         :params dict params: params to update user
         :param session db_session: Database session
+        :param str database: Database, to invalidate cached dicts
         """
         if not user:
             raise Exception('UserModule: User is required', 400)
@@ -41,51 +67,189 @@ class UserModule(object):
         try:
             user.fullname = params.get('fullname')
 
-            user.updated_at = datetime.now()
+            user.mark_changed()
 
             db_session.add(user)
             db_session.commit()
 
+            user_cache.invalidate(database, [user.id])
+
         except:
             db_session.rollback()
             db_session.close()
             raise
 
-    def delete(self, user, db_session):
+    @classmethod
+    def delete(cls, user, db_session, database=None):
         """
         Delete user
         :params dict user: User to delete
         :param session db_session: Database session
+        :param str database: Database, to invalidate cached dicts
         """
         try:
+            user_id = user.id
+            project_ids = set()
+            for model in (ProjectDesignated, ProjectLeader):
+                project_ids.update(
+                    model.get_project_ids_by_user_ids([user_id], db_session).get(user_id, []))
+
+            ProjectStats.move(ProjectStats.get_user_keys(user_id, db_session), [], db_session)
+
             db_session.delete(user)
+            Project.touch(project_ids, db_session)
             db_session.flush()
             db_session.commit()
 
+            user_cache.invalidate(database, [user_id])
+            project_cache.invalidate(database, project_ids)
+
         except:
             db_session.rollback()
             db_session.close()
             raise
 
     @classmethod
-    def search_by_filter_params(cls, params, database):
+    def bulk_create(cls, items, database, transaction_size=None):
+        """
+        Create many users with chunked multi-row inserts
+        :param list(dict) items: Params of each user to create
+        :param str database: Database
+        :param int transaction_size: Users committed per transaction
+        :return dict: Created count and the id or error of each item
+        """
+        errors = []
+
+        def get_rows():
+            for index, params in enumerate(items):
+                try:
+                    if not isinstance(params, dict):
+                        raise Exception('Item must be an object', 400)
+                    yield index, get_insert_values(cls.set_user(User(), params)), None
+
+                except Exception as error:
+                    errors.append({'index': index, 'error': get_error_message(error)})
+
+        db_session = DBSessionManage(database).get_standalone_session()
+        try:
+            results = bulk_insert(
+                db_session, User.__table__, get_rows(), cls.BULK_CHUNK_SIZE,
+                transaction_size or cls.BULK_TRANSACTION_SIZE)
+
+        finally:
+            db_session.close()
+
+        return cls.get_bulk_response(results + errors)
+
+    @classmethod
+    def get_dict_by_id(cls, user_id, database, db_session, etag=None):
+        """
+        Get user in dict format, from cache when possible
+        :param int user_id: User id
+        :param str database: Database
+        :param session db_session: Database session
+        :param str etag: Current ETag, from get_etag, a cached dict of another one is reloaded
+        :return dict: User in dict format or None when not found
+        """
+        def load():
+            row = User.get_row_by_id(user_id, db_session)
+            return cls.users_to_dict([row], db_session)[0] if row else None
+
+        return user_cache.get_or_load(database, user_id, load, etag)
+
+    @staticmethod
+    def get_etag(user_id, db_session):
+        """
+        Get the ETag of a user from a lightweight query on its version
+        :param int user_id: User id
+        :param session db_session: Database session
+        :return str: ETag or None when not found
+        """
+        version = User.get_version(user_id, db_session)
+        if version is None:
+            return None
+
+        return get_etag('user', user_id, version)
+
+    @classmethod
+    def search_by_filter_params(cls, params, database, db_session=None):
         """
         Search users by filter params
-        :param dict params: Request params
+        :param dict params: Request params with optional limit, cursor and fields
         :param str database: Database
+        :param session db_session: Database session, a new one closed at the end when None
         :return dict: Search users response
         """
+        own_session = db_session is None
+        if own_session:
+            db_session = DBSessionManage(database).get_db_session()
+
+        try:
+            users, count, next_cursor = User.get_by_filter_params(params, db_session)
+
+            response = cls.get_default_response()
+            response['count'] = count
+            response['next_cursor'] = next_cursor
+            response['users'] = cls.users_to_dict(users, db_session, User.get_fields(params))
+
+            return response
+
+        finally:
+            if own_session:
+                db_session.close()
+
+    @classmethod
+    def search_json_by_filter_params(cls, params, database):
+        """
+        Search users by filter params, encoding rows straight to JSON
+        :param dict params: Request params with optional limit, cursor and fields
+        :param str database: Database
+        :return str: Search users response in JSON
+        """
         db_session = DBSessionManage(database).get_db_session()
+        try:
+            users, count, next_cursor = User.get_by_filter_params(params, db_session)
 
-        users, count = User.get_by_filter_params(params, database)
+            return encode_list_response(
+                'users', cls.encode_users(users, db_session, User.get_fields(params)),
+                count=count, next_cursor=next_cursor)
 
-        response = cls.get_default_response()
-        response['count'] = count
-        response['users'] = cls.users_to_dict(users, db_session)
+        finally:
+            db_session.close()
 
-        db_session.close()
+    @classmethod
+    def stream_by_filter_params(cls, params, database):
+        """
+        Stream users by filter params as JSON, reading rows in chunks
+        through a server-side cursor so memory stays flat. Params are
+        validated and the query built before returning, so errors are sent
+        as such instead of a truncated 200.
+        :param dict params: Request params
+        :param str database: Database
+        :return generator(bytes): JSON response parts
+        """
+        db_manage = DBSessionManage(database)
+        # A MySQL connection can't run other statements while a server-side
+        # cursor is open, so relation lookups use a second session
+        stream_session = db_manage.get_standalone_session()
+        db_session = db_manage.get_standalone_session()
+
+        def close():
+            stream_session.close()
+            db_session.close()
+
+        try:
+            fields = User.get_fields(params)
+            rows = User.get_stream_by_filter_params(params, stream_session, cls.STREAM_CHUNK_SIZE)
+            parts = stream_json_list(
+                'users', iter_chunks(rows, cls.STREAM_CHUNK_SIZE),
+                lambda chunk: cls.encode_users(chunk, db_session, fields))
+
+        except:
+            close()
+            raise
 
-        return response
+        return close_after(parts, close)
 
     @classmethod
     def set_user(cls, user, params):
@@ -101,71 +265,126 @@ class UserModule(object):
         return user
 
     @classmethod
-    def users_to_dict(cls, users, db_session):
+    def export_by_filter_params(cls, params, database, export_format, gzip=False):
+        """
+        Export all users by filter params as NDJSON or CSV, reading rows in
+        chunks through a server-side cursor in id order so memory stays flat
+        :param dict params: Request params with optional fields
+        :param str database: Database
+        :param str export_format: ndjson or csv
+        :param bool gzip: Compress the export
+        :return generator(bytes): Export parts
+        """
+        parts = cls._export_by_filter_params(params, database, export_format)
+
+        return gzip_stream(parts) if gzip else parts
+
+    @classmethod
+    def _export_by_filter_params(cls, params, database, export_format):
+        """
+        Export all users by filter params, uncompressed. Params are validated
+        and the query built before returning.
+        :param dict params: Request params with optional fields
+        :param str database: Database
+        :param str export_format: ndjson or csv
+        :return generator(bytes): Export parts
+        """
+        db_manage = DBSessionManage(database)
+        # Relation lookups can't share the connection of the open cursor
+        stream_session = db_manage.get_standalone_session()
+        db_session = db_manage.get_standalone_session()
+
+        def close():
+            stream_session.close()
+            db_session.close()
+
+        try:
+            fields = User.get_fields(params)
+            chunks = iter_chunks(
+                User.get_export_by_filter_params(params, stream_session, cls.EXPORT_CHUNK_SIZE),
+                cls.EXPORT_CHUNK_SIZE)
+
+            if export_format == 'csv':
+                parts = stream_csv(fields, chunks, lambda chunk: cls.get_rows_values(chunk, db_session, fields))
+            else:
+                parts = stream_ndjson(chunks, lambda chunk: cls.encode_users(chunk, db_session, fields))
+
+        except:
+            close()
+            raise
+
+        return close_after(parts, close)
+
+    @classmethod
+    def users_to_dict(cls, users, db_session, fields=User.FIELDS):
         """
         Return users in dict format
-        :param list of user: List with users
+        :param list of user: List with users rows
         :param session db_session: Database session
+        :param tuple(str) fields: Fields to return
         :return list(dict): List with users in dict format
         """
-        users_dict = []
-        for user in users:
-            user_dict = {
-                'id': user.id,
-                'created_at': user.created_at,
-                'fullname': user.fullname,
-                'projects_designated': None,
-                'projects_leader': None,
-                'updated_at': user.updated_at
-            }
-            cls.set_projects_designated(user.id, user_dict, db_session)
-            cls.set_projects_leader(user.id, user_dict, db_session)
+        return [dict(zip(fields, values)) for values in cls.get_rows_values(users, db_session, fields)]
 
-            users_dict.append(user_dict)
-
-        return users_dict
-
-    @staticmethod
-    def get_default_response():
+    @classmethod
+    def encode_users(cls, users, db_session, fields=User.FIELDS):
         """
-        Get users default response
-        :return dict: Users default response
+        Return users encoded as JSON objects, without intermediate dicts
+        :param list of user: List with users rows
+        :param session db_session: Database session
+        :param tuple(str) fields: Fields to encode
+        :return list(str): List with users in JSON
         """
-        return {
-            'count': 0,
-            'users': []
-        }
+        encode = get_row_encoder(fields)
+        return [encode(values) for values in cls.get_rows_values(users, db_session, fields)]
 
     @staticmethod
-    def set_projects_designated(user_id, user_dict, db_session):
+    def get_rows_values(users, db_session, fields):
         """
-        Set projects in user dict
-        :param int user_id: User id
-        :param dict user_dict: User dict
+        Get the values of each row in fields order. Projects_designated and projects_leader
+        are loaded for the whole list with one query each, only when requested.
+        :param list of user: List with users rows
         :param session db_session: Database session
+        :param tuple(str) fields: Fields
+        :return list(tuple): Values of each row
         """
-        projects_id = []
-        projects = User.get_designated_by_project_id(user_id, db_session)
+        ids = [user.id for user in users]
+        relations = {}
+        if 'projects_designated' in fields:
+            relations['projects_designated'] = ProjectDesignated.get_project_ids_by_user_ids(ids, db_session)
+        if 'projects_leader' in fields:
+            relations['projects_leader'] = ProjectLeader.get_project_ids_by_user_ids(ids, db_session)
 
-        if projects:
-            for project in projects:
-                projects_id.append(project.id)
+        getters = [
+            (lambda row, ids_by_id=relations[field]: ids_by_id.get(row.id, []))
+            if field in relations else operator.attrgetter(field)
+            for field in fields
+        ]
 
-        user_dict['projects_designated'] = projects_id
+        return [tuple(getter(user) for getter in getters) for user in users]
 
     @staticmethod
-    def set_projects_leader(user_id, user_dict, db_session):
+    def get_bulk_response(results):
         """
-        Set projects in user dict
-        :param int user_id: User id
-        :param dict user_dict: User dict
-        :param session db_session: Database session
+        Get bulk create response
+        :param list(dict) results: Id or error of each item
+        :return dict: Bulk create response
         """
-        projects_id = []
-        projects = User.get_leader_by_project_id(user_id, db_session)
+        results.sort(key=lambda item: item['index'])
 
-        if projects:
-            for project in projects:
-                projects_id.append(project.id)
+        return {
+            'count': sum(1 for item in results if 'id' in item),
+            'items': results
+        }
 
-        user_dict['projects_leader'] = projects_id
+    @staticmethod
+    def get_default_response():
+        """
+        Get users default response
+        :return dict: Users default response
+        """
+        return {
+            'count': 0,
+            'next_cursor': None,
+            'users': []
+        }
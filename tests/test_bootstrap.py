@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from models.project import Project, ProjectDesignated, ProjectLeader, ProjectStats
+from modules.db_session_manage import DBSessionManage
+from modules.project_stats import ProjectStatsModule
+
+# Tables as created before schema versions were recorded
+BASELINE_SCHEMA = (
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, created_at DATETIME, fullname VARCHAR(100) NOT NULL, '
+    'projects_designated BIGINT, projects_leader BIGINT, updated_at DATETIME)',
+    'CREATE TABLE project (id INTEGER PRIMARY KEY, created_at DATETIME, deadline DATETIME, '
+    'description VARCHAR(500) NOT NULL, designateds BIGINT, leaders BIGINT, status VARCHAR(30) NOT NULL, '
+    'title VARCHAR(100) NOT NULL, updated_at DATETIME)',
+    'CREATE TABLE project_comments (id INTEGER PRIMARY KEY, created_at DATETIME, '
+    'description VARCHAR(500) NOT NULL, project_id BIGINT NOT NULL, reporter BIGINT NOT NULL)',
+    "INSERT INTO user (id, fullname, projects_designated) VALUES (1, 'Ada', 2), (2, 'Grace', NULL)",
+    "INSERT INTO project (id, description, designateds, leaders, status, title) VALUES "
+    "(1, 'Billing', 1, 2, 'development', 'Billing'), (2, 'Export', NULL, NULL, 'analysis', 'Export')",
+    "INSERT INTO project_comments (id, description, project_id, reporter) VALUES "
+    "(1, 'First', 1, 1), (2, 'Second', 1, 2)",
+)
+
+
+class BootstrapTest(unittest.TestCase):
+    """Bootstrapping a database created before schema versions were
+    recorded backfills the data every later version derives"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='taskhub-test-')
+        self.previous_url = os.environ.get('TASKHUB_DATABASE_URL')
+        os.environ['TASKHUB_DATABASE_URL'] = 'sqlite:///{0}'.format(os.path.join(self.directory, 'taskhub.db'))
+        DBSessionManage.dispose_engines()
+
+        engine = create_engine(os.environ['TASKHUB_DATABASE_URL'])
+        with engine.begin() as connection:
+            for statement in BASELINE_SCHEMA:
+                connection.execute(statement)
+        engine.dispose()
+
+        DBSessionManage.bootstrap_schema(None)
+        self.db_session = DBSessionManage(None).get_db_session()
+
+    def tearDown(self):
+        self.db_session.close()
+        DBSessionManage.dispose_engines()
+        shutil.rmtree(self.directory)
+        if self.previous_url is None:
+            os.environ.pop('TASKHUB_DATABASE_URL', None)
+        else:
+            os.environ['TASKHUB_DATABASE_URL'] = self.previous_url
+
+    def test_comments_count(self):
+        counts = dict(self.db_session.query(Project.id, Project.comments_count))
+        self.assertEqual(counts, {1: 2, 2: 0})
+
+    def test_assignments(self):
+        designated = set(self.db_session.query(ProjectDesignated.project_id, ProjectDesignated.user_id))
+        leader = set(self.db_session.query(ProjectLeader.project_id, ProjectLeader.user_id))
+        self.assertEqual(designated, {(1, 1), (2, 1)})
+        self.assertEqual(leader, {(1, 2)})
+
+    def test_stats(self):
+        stats = ProjectStatsModule.get_stats_response(ProjectStats.get_all(self.db_session))
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['by_status'], {'analysis': 1, 'development': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
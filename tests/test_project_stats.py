@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from webob import Request
+
+from benchmarks.seed import Seeder
+from main import app
+from modules.db_session_manage import DBSessionManage
+from modules.project_stats import ProjectStatsModule
+
+USERS = 20
+PROJECTS = 200
+
+
+class ProjectStatsTest(unittest.TestCase):
+    """Bulk status changes keep the project stats counters equal to a
+    recomputation from the projects"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix='taskhub-test-')
+        cls.previous_url = os.environ.get('TASKHUB_DATABASE_URL')
+        os.environ['TASKHUB_DATABASE_URL'] = 'sqlite:///{0}'.format(os.path.join(cls.directory, 'taskhub.db'))
+        DBSessionManage.dispose_engines()
+        DBSessionManage.bootstrap_schema(None)
+
+        db_session = DBSessionManage(None).get_db_session()
+        try:
+            Seeder(db_session, USERS, PROJECTS, 0).run()
+        finally:
+            db_session.close()
+
+        # The seeder inserts without maintaining the counters
+        ProjectStatsModule.reconcile(None)
+
+    @classmethod
+    def tearDownClass(cls):
+        DBSessionManage.dispose_engines()
+        shutil.rmtree(cls.directory)
+        if cls.previous_url is None:
+            os.environ.pop('TASKHUB_DATABASE_URL', None)
+        else:
+            os.environ['TASKHUB_DATABASE_URL'] = cls.previous_url
+
+    def put_status(self, query, status):
+        """
+        Move the projects matching query to status
+        :param str query: Filter query string
+        :param str status: New status
+        :return int: Number of moved projects
+        """
+        request = Request.blank('/projects/status?' + query, method='PUT')
+        request.content_type = 'application/json'
+        request.body = json.dumps({'status': status}).encode('utf-8')
+        response = request.get_response(app)
+        self.assertEqual(response.status_int, 200, response.body)
+
+        return response.json['count']
+
+    def get_stats(self):
+        """
+        Get the stats response without its reconciliation date
+        :return dict: Project stats
+        """
+        stats = ProjectStatsModule.get_stats(None)
+        stats.pop('reconciled_at')
+        return stats
+
+    def test_bulk_status_change(self):
+        self.assertTrue(self.put_status('status=overdue', 'finished'))
+        self.assertTrue(self.put_status('status=analysis', 'development'))
+        self.assertTrue(self.put_status('designated=1', 'review'))
+
+        maintained = self.get_stats()
+        ProjectStatsModule.reconcile(None)
+        self.assertEqual(maintained, self.get_stats())
+        self.assertEqual(maintained['count'], PROJECTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
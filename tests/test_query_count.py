@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import event
+from webob import Request
+
+from benchmarks.seed import Seeder
+from main import app
+from modules.db_session_manage import DBSessionManage
+
+USERS = 20
+PROJECTS = 50
+
+
+class QueryCountTest(unittest.TestCase):
+    """The list endpoints run the same number of statements for a page of
+    one project or user as for a page of many, relations included"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix='taskhub-test-')
+        cls.previous_url = os.environ.get('TASKHUB_DATABASE_URL')
+        os.environ['TASKHUB_DATABASE_URL'] = 'sqlite:///{0}'.format(os.path.join(cls.directory, 'taskhub.db'))
+        DBSessionManage.dispose_engines()
+        DBSessionManage.bootstrap_schema(None)
+
+        db_session = DBSessionManage(None).get_db_session()
+        try:
+            Seeder(db_session, USERS, PROJECTS, 2).run()
+        finally:
+            db_session.close()
+
+        cls.statements = 0
+        event.listen(DBSessionManage.get_engine(None), 'before_cursor_execute', cls.count_statement)
+
+    @classmethod
+    def tearDownClass(cls):
+        event.remove(DBSessionManage.get_engine(None), 'before_cursor_execute', cls.count_statement)
+        DBSessionManage.dispose_engines()
+        shutil.rmtree(cls.directory)
+        if cls.previous_url is None:
+            os.environ.pop('TASKHUB_DATABASE_URL', None)
+        else:
+            os.environ['TASKHUB_DATABASE_URL'] = cls.previous_url
+
+    @classmethod
+    def count_statement(cls, conn, cursor, statement, parameters, context, executemany):
+        cls.statements += 1
+
+    def get(self, path):
+        """
+        Call a route and count its statements
+        :param str path: Path
+        :return tuple: Response JSON and number of statements
+        """
+        before = self.statements
+        response = Request.blank(path).get_response(app)
+        self.assertEqual(response.status_int, 200, response.body)
+
+        return response.json, self.statements - before
+
+    def test_projects_list(self):
+        one, one_statements = self.get('/projects?limit=1&count=exact')
+        many, many_statements = self.get('/projects?limit={0}&count=exact'.format(PROJECTS))
+
+        self.assertEqual(len(one['projects']), 1)
+        self.assertEqual(len(many['projects']), PROJECTS)
+        self.assertTrue(all(project['designated'] and project['leader'] for project in many['projects']))
+        self.assertEqual(one_statements, many_statements)
+
+    def test_users_list(self):
+        one, one_statements = self.get('/users?limit=1')
+        many, many_statements = self.get('/users?limit={0}'.format(USERS))
+
+        self.assertEqual(len(one['users']), 1)
+        self.assertEqual(len(many['users']), USERS)
+        self.assertTrue(any(user['projects_designated'] for user in many['users']))
+        self.assertEqual(one_statements, many_statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
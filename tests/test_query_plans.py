@@ -0,0 +1,158 @@
+import datetime
+import itertools
+import os
+import unittest
+
+from sqlalchemy import desc, text
+
+from benchmarks.seed import Seeder
+from models.pagination import DEFAULT_LIMIT, keyset_filter
+from models.project import Project, ProjectComments
+from modules.db_session_manage import DBSessionManage
+
+# EXPLAIN needs MySQL with a realistic volume of rows: on near-empty tables
+# MySQL prefers full scans regardless of indexes
+MYSQL_URL = os.environ.get('TASKHUB_TEST_MYSQL_URL')
+SEED_USERS = 2000
+SEED_PROJECTS = 50000
+
+TODAY = datetime.date.today()
+START_AT = (TODAY - datetime.timedelta(days=90)).isoformat()
+END_AT = (TODAY - datetime.timedelta(days=30)).isoformat()
+
+FILTER_COMBINATIONS = [
+    {},
+    {'start_at': START_AT},
+    {'end_at': END_AT},
+    {'start_at': START_AT, 'end_at': END_AT},
+    {'status': 'analysis'},
+    {'status': ['analysis', 'development']},
+    {'status': 'analysis', 'start_at': START_AT, 'end_at': END_AT},
+    {'status': 'overdue'},
+    {'designated': 1},
+    {'leader': 1},
+]
+
+SCAN_TYPES = ('ALL', 'index')
+
+
+def get_combinations():
+    """
+    Get every filter combination with every order_by and sort_by
+    :return generator(dict): Search params
+    """
+    for params, order_by, sort_by in itertools.product(
+            FILTER_COMBINATIONS, Project.ORDER_BY_FIELDS, ('asc', 'desc')):
+        params = dict(params)
+        params['order_by'] = order_by
+        params['sort_by'] = sort_by
+        yield params
+
+
+def is_served_in_order(params):
+    """
+    Whether the indexes return the matches of a search in keyset order. A
+    range or IN list on another column than order_by, or a filter through
+    the assignment tables, needs a sort of the (filtered) matches; so does
+    a status, unless ordering by status, title or id, as project writes
+    don't maintain a (status, order_by column) index per order.
+    :param dict params: Search params
+    :return bool: Served in order
+    """
+    if params.get('designated') or params.get('leader'):
+        return False
+    if isinstance(params.get('status'), list) or params.get('status') == 'overdue':
+        return False
+    if params.get('status') and params['order_by'] not in ('status', 'title', 'id'):
+        return False
+    if (params.get('start_at') or params.get('end_at')) and params['order_by'] != 'created_at':
+        return False
+
+    return True
+
+
+def get_search_query(params, db_session):
+    """
+    Query issued by the second page of a project search with count=none;
+    the first page of an unfiltered search is an ordered index scan stopped
+    by LIMIT, which EXPLAIN reports as a full index scan
+    :param dict params: Search params
+    :param session db_session: Database session
+    :return Query: Search query
+    """
+    query = Project._query_add_filter(Project.set_default_fields(db_session), params)
+    keyset = Project.get_keyset(params)
+    order_by = [direction(column) for column, direction in keyset]
+
+    first = query.order_by(*order_by).first()
+    if first is not None:
+        query = query.filter(keyset_filter(keyset, [getattr(first, column.key) for column, _ in keyset]))
+
+    return query.order_by(*order_by).limit(DEFAULT_LIMIT + 1)
+
+
+def explain(query, db_session):
+    """
+    Run EXPLAIN on a query
+    :param Query query: Query
+    :param session db_session: Database session
+    :return list(dict): EXPLAIN rows
+    """
+    statement = query.statement.compile(
+        dialect=db_session.get_bind().dialect, compile_kwargs={'literal_binds': True})
+
+    rows = db_session.execute(text('EXPLAIN {0}'.format(statement))).fetchall()
+    return [dict(row._mapping) if hasattr(row, '_mapping') else dict(row) for row in rows]
+
+
+@unittest.skipUnless(MYSQL_URL, 'TASKHUB_TEST_MYSQL_URL is not set')
+class QueryPlanTest(unittest.TestCase):
+    """Project searches and comment pages use indexes: no full table or
+    index scan, and no filesort where the indexes give the keyset order"""
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['TASKHUB_DATABASE_URL'] = MYSQL_URL
+        DBSessionManage.dispose_engines()
+        DBSessionManage.bootstrap_schema(None)
+
+        cls.db_session = DBSessionManage(None).get_db_session()
+        if not cls.db_session.query(Project.id).first():
+            Seeder(cls.db_session, SEED_USERS, SEED_PROJECTS, 3).run()
+
+        for table in ('project', 'project_designated', 'project_leader', 'project_comments'):
+            cls.db_session.execute(text('ANALYZE TABLE `{0}`'.format(table))).fetchall()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_session.close()
+        DBSessionManage.dispose_engines()
+
+    def assert_indexed(self, name, rows, served_in_order=True):
+        """
+        Check the EXPLAIN rows of a query
+        :param str name: Query name
+        :param list(dict) rows: EXPLAIN rows
+        :param bool served_in_order: Whether a filesort fails the check
+        """
+        for row in rows:
+            self.assertNotIn(row.get('type'), SCAN_TYPES, '{0}: {1}'.format(name, row))
+            if served_in_order:
+                self.assertNotIn('Using filesort', row.get('Extra') or '', '{0}: {1}'.format(name, row))
+
+    def test_searches(self):
+        for params in get_combinations():
+            with self.subTest(params=params):
+                rows = explain(get_search_query(params, self.db_session), self.db_session)
+                self.assert_indexed('search {0}'.format(params), rows, is_served_in_order(params))
+
+    def test_comments_page(self):
+        query = self.db_session.query(ProjectComments).filter(
+            ProjectComments.project_id == 1
+        ).order_by(desc(ProjectComments.id)).limit(DEFAULT_LIMIT + 1)
+
+        self.assert_indexed('comments by project', explain(query, self.db_session))
+
+
+if __name__ == '__main__':
+    unittest.main()
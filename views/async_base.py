@@ -0,0 +1,81 @@
+from urllib.parse import parse_qsl
+
+from modules.serializer import dumps
+
+
+class AsyncRequest(object):
+    """ASGI request with the attributes the handlers read"""
+
+    def __init__(self, scope, body):
+        """
+        Request
+        :param dict scope: ASGI connection scope
+        :param bytes body: Request body
+        """
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = AsyncHeaders(
+            (name.decode('latin-1'), value.decode('latin-1'))
+            for name, value in scope.get('headers', []))
+        self.GET = dict(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+        self.body = body
+        self.remote_addr = (scope.get('client') or (None, None))[0]
+
+
+class AsyncHeaders(dict):
+    """Headers with case-insensitive names"""
+
+    def __init__(self, items=()):
+        super(AsyncHeaders, self).__init__()
+        for name, value in items:
+            self[name] = value
+
+    def __setitem__(self, name, value):
+        super(AsyncHeaders, self).__setitem__(name.lower(), value)
+
+    def __getitem__(self, name):
+        return super(AsyncHeaders, self).__getitem__(name.lower())
+
+    def get(self, name, default=None):
+        return super(AsyncHeaders, self).get(name.lower(), default)
+
+
+class AsyncResponse(object):
+    """ASGI response"""
+
+    def __init__(self):
+        self.status_code = 200
+        self.headers = AsyncHeaders([('Content-Type', 'application/json')])
+        self.body = b''
+
+
+class AsyncBaseHandler(object):
+    """Base class of the ASGI handlers, mirroring the WSGI handlers API"""
+
+    def __init__(self, request):
+        """
+        Handler
+        :param AsyncRequest request: Request
+        """
+        self.request = request
+        self.response = AsyncResponse()
+
+    def response_send(self, response=None, status_code=200):
+        """
+        Send a JSON response
+        :param dict response: Response content
+        :param int status_code: Status code
+        """
+        self.response.status_code = status_code
+        self.response.body = dumps(response).encode('utf-8') if response is not None else b''
+
+    def response_error(self, error):
+        """
+        Send an error raised as Exception(message, status_code)
+        :param Exception error: Error
+        """
+        status_code = 500
+        if len(error.args) > 1 and isinstance(error.args[1], int):
+            status_code = error.args[1]
+
+        self.response_send({'error': str(error.args[0]) if error.args else str(error)}, status_code)
@@ -0,0 +1,104 @@
+import json
+
+from modules.async_db_session_manage import AsyncDBSessionManage
+from modules.async_project import AsyncProjectModule
+from modules.conditional import is_not_modified, set_validator_headers
+from modules.tenant import get_database
+from views.async_base import AsyncBaseHandler
+
+
+class AsyncProjectsHandler(AsyncBaseHandler):
+    """Class for AsyncProjectsHandler"""
+
+    async def get(self):
+        """Get projects"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                response = await AsyncProjectModule.search_by_filter_params(
+                    self.request.GET, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+    async def post(self):
+        """Create project"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                response = await AsyncProjectModule.create(self.request.GET, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+
+class AsyncProjectHandler(AsyncBaseHandler):
+    """Class for AsyncProjectHandler"""
+
+    async def get(self, project_id):
+        """Get project"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                etag = await AsyncProjectModule.get_etag(project_id, db_session)
+                if not etag:
+                    raise Exception('Project not found', 404)
+
+                set_validator_headers(self.response, etag)
+                if is_not_modified(self.request, etag):
+                    self.response_send(status_code=304)
+                    return
+
+                project_dict = await AsyncProjectModule.get_detail(
+                    project_id, self.request.GET.get('comments_limit'), database, db_session, etag)
+            finally:
+                await db_session.close()
+
+            self.response_send(project_dict)
+
+        except Exception as error:
+            self.response_error(error)
+
+    async def put(self, project_id):
+        """Update project"""
+        try:
+            database = get_database(self.request)
+            params = json.loads(self.request.body)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                await AsyncProjectModule.update(project_id, params, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send({
+                'project_id': int(project_id)
+            })
+
+        except Exception as error:
+            self.response_error(error)
+
+    async def delete(self, project_id):
+        """Delete project"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                await AsyncProjectModule.delete(project_id, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send(status_code=204)
+
+        except Exception as error:
+            self.response_error(error)
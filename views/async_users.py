@@ -0,0 +1,105 @@
+import json
+
+from modules.async_db_session_manage import AsyncDBSessionManage
+from modules.async_user import AsyncUserModule
+from modules.conditional import is_not_modified, set_validator_headers
+from modules.tenant import get_database
+from views.async_base import AsyncBaseHandler
+
+
+class AsyncUsersHandler(AsyncBaseHandler):
+    """Class for AsyncUsersHandler"""
+
+    async def get(self):
+        """Get users"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                response = await AsyncUserModule.search_by_filter_params(
+                    self.request.GET, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+    async def post(self):
+        """Create user"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                response = await AsyncUserModule.create(self.request.GET, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+
+class AsyncUserHandler(AsyncBaseHandler):
+    """Class for AsyncUserHandler"""
+
+    async def get(self, user_id):
+        """Get user"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                etag = await AsyncUserModule.get_etag(user_id, db_session)
+                if not etag:
+                    raise Exception('User not found', 404)
+
+                set_validator_headers(self.response, etag)
+                if is_not_modified(self.request, etag):
+                    self.response_send(status_code=304)
+                    return
+
+                user_dict = await AsyncUserModule.get_dict_by_id(user_id, database, db_session, etag)
+                if not user_dict:
+                    raise Exception('User not found', 404)
+            finally:
+                await db_session.close()
+
+            self.response_send(user_dict)
+
+        except Exception as error:
+            self.response_error(error)
+
+    async def put(self, user_id):
+        """Update user"""
+        try:
+            database = get_database(self.request)
+            params = json.loads(self.request.body)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                await AsyncUserModule.update(user_id, params, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send({
+                'user_id': int(user_id)
+            })
+
+        except Exception as error:
+            self.response_error(error)
+
+    async def delete(self, user_id):
+        """Delete user"""
+        try:
+            database = get_database(self.request)
+            db_session = AsyncDBSessionManage(database).get_db_session()
+            try:
+                await AsyncUserModule.delete(user_id, database, db_session)
+            finally:
+                await db_session.close()
+
+            self.response_send(status_code=204)
+
+        except Exception as error:
+            self.response_error(error)
@@ -0,0 +1,28 @@
+import webapp2
+
+from modules.serializer import dumps
+
+
+class BaseHandler(webapp2.RequestHandler):
+    """Base class of the WSGI handlers"""
+
+    def response_send(self, response=None, status_code=200):
+        """
+        Send a JSON response
+        :param dict response: Response content
+        :param int status_code: Status code
+        """
+        self.response.set_status(status_code)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.body = dumps(response).encode('utf-8') if response is not None else b''
+
+    def response_error(self, error):
+        """
+        Send an error raised as Exception(message, status_code)
+        :param Exception error: Error
+        """
+        status_code = 500
+        if len(error.args) > 1 and isinstance(error.args[1], int):
+            status_code = error.args[1]
+
+        self.response_send({'error': str(error.args[0]) if error.args else str(error)}, status_code)
@@ -0,0 +1,221 @@
+import json
+import logging
+import time
+
+from http.client import responses as HTTP_REASONS
+from http.cookies import SimpleCookie
+
+from modules.instrumentation import end_request, start_request
+from modules.replica import REPLICA_SETTINGS, set_read_only
+from modules.serializer import dumps
+from modules.unit_of_work import end_unit_of_work, start_unit_of_work
+
+request_logger = logging.getLogger('taskhub.request')
+
+
+class SQLInstrumentationMiddleware(object):
+    """
+    WSGI middleware collecting the SQL counters of each request. The
+    counters up to the start of the response go in a Server-Timing header;
+    the log line is written when the response is closed, so streamed
+    bodies are included.
+    """
+
+    def __init__(self, app):
+        """
+        SQL instrumentation middleware
+        :param app: WSGI application
+        """
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        stats = start_request()
+        status = []
+
+        def instrumented_start_response(response_status, headers, exc_info=None):
+            status.append(response_status)
+            headers.append(('Server-Timing', stats.get_server_timing()))
+            return start_response(response_status, headers, exc_info)
+
+        def log_request():
+            end_request()
+            line = {
+                'method': environ.get('REQUEST_METHOD'),
+                'path': environ.get('PATH_INFO'),
+                'status': int(status[0].split(' ', 1)[0]) if status else None,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3)
+            }
+            line.update(stats.to_dict())
+            request_logger.info(json.dumps(line, sort_keys=True))
+
+        try:
+            body = self.app(environ, instrumented_start_response)
+        except:
+            log_request()
+            raise
+
+        return ClosingBody(body, log_request)
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    WSGI middleware marking GET and HEAD requests read-only, so their
+    sessions go to a replica. Successful writes set a cookie for
+    read_your_writes seconds; while the client sends it back, or sends
+    X-Read-Consistency: primary, its reads stay on the primary.
+    """
+
+    READ_METHODS = ('GET', 'HEAD')
+
+    def __init__(self, app):
+        """
+        Replica routing middleware
+        :param app: WSGI application
+        """
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        set_read_only(method in self.READ_METHODS and not self.is_primary_required(environ))
+
+        def routing_start_response(status, headers, exc_info=None):
+            if method not in self.READ_METHODS and status[:1] in ('2', '3'):
+                headers.append(('Set-Cookie', '{0}={1}; Max-Age={2}; Path=/; HttpOnly'.format(
+                    REPLICA_SETTINGS['cookie'], int(time.time()), REPLICA_SETTINGS['read_your_writes'])))
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.app(environ, routing_start_response)
+        except:
+            set_read_only(False)
+            raise
+
+        return ClosingBody(body, lambda: set_read_only(False))
+
+    @staticmethod
+    def is_primary_required(environ):
+        """
+        Whether a read must see the client's own recent writes
+        :param dict environ: WSGI environ
+        :return bool: Whether to read from the primary
+        """
+        if environ.get('HTTP_X_READ_CONSISTENCY', '').lower() == 'primary':
+            return True
+
+        cookie = SimpleCookie()
+        try:
+            cookie.load(environ.get('HTTP_COOKIE', ''))
+        except Exception:
+            return False
+
+        return REPLICA_SETTINGS['cookie'] in cookie
+
+
+class UnitOfWorkMiddleware(object):
+    """
+    WSGI middleware giving each request one unit of work: the module calls
+    share one session per database, opened on first use, committed once
+    when the status is below 400 and rolled back otherwise. The commit
+    happens before the response starts, so a failed commit becomes a 500
+    and the connection is back in the pool before a streamed body is sent.
+    Standalone sessions still open when the response is closed are closed
+    and counted as leaked.
+    """
+
+    def __init__(self, app):
+        """
+        Unit of work middleware
+        :param app: WSGI application
+        """
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        unit = start_unit_of_work()
+        response = {}
+
+        def finish():
+            if 'write' in response:
+                return
+
+            status, headers, exc_info = response['start']
+            try:
+                unit.finish(status[:1] in ('1', '2', '3'))
+            except Exception as error:
+                logging.exception('Request transaction failed')
+                status, response['failed'] = self.get_failure(error)
+                headers, exc_info = [
+                    ('Content-Type', 'application/json'),
+                    ('Content-Length', str(len(response['failed'])))], None
+
+            response['write'] = start_response(status, headers, exc_info)
+
+        def deferred_start_response(status, headers, exc_info=None):
+            response['start'] = (status, headers, exc_info)
+
+            def write(data):
+                finish()
+                if 'failed' not in response:
+                    response['write'](data)
+
+            return write
+
+        def release():
+            unit.release(environ.get('PATH_INFO'))
+            end_unit_of_work()
+
+        try:
+            body = self.app(environ, deferred_start_response)
+            finish()
+        except:
+            try:
+                unit.finish(False)
+            finally:
+                release()
+            raise
+
+        if 'failed' in response:
+            if hasattr(body, 'close'):
+                body.close()
+            body = [response['failed']]
+
+        return ClosingBody(body, release)
+
+    @staticmethod
+    def get_failure(error):
+        """
+        Get the response replacing one whose transaction or after-commit
+        step failed: the status and message of an Exception(message,
+        status), else a 500 not exposing database errors
+        :param Exception error: Error
+        :return tuple: Status line and JSON body
+        """
+        if len(error.args) > 1 and isinstance(error.args[1], int):
+            status = '{0} {1}'.format(error.args[1], HTTP_REASONS.get(error.args[1], 'Error'))
+            return status, dumps({'error': str(error.args[0])}).encode('utf-8')
+
+        return '500 Internal Server Error', b'{"error":"Transaction failed"}'
+
+
+class ClosingBody(object):
+    """WSGI response body calling a function once it is closed"""
+
+    def __init__(self, body, on_close):
+        """
+        Closing body
+        :param iterable body: WSGI response body
+        :param function on_close: Called after the body is closed
+        """
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+
+        finally:
+            self.on_close()
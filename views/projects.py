@@ -1,10 +1,15 @@
 import json
 
-from urllib.request import BaseHandler
-
-from models.project import Project, ProjectComments
+from models.project import Project
 from modules.project import ProjectModule
+from modules.project_comments import ProjectCommentsModule
+from modules.project_stats import ProjectStatsModule
+from modules.bulk import get_transaction_size
+from modules.conditional import is_not_modified, set_validator_headers
 from modules.db_session_manage import DBSessionManage
+from modules.serializer import EXPORT_CONTENT_TYPES, accepts_gzip, get_export_format, loads_items
+from modules.tenant import get_database
+from views.base import BaseHandler
 
 
 class ProjectsHandler(BaseHandler):
@@ -13,11 +18,19 @@ class ProjectsHandler(BaseHandler):
     def get(self):
         """Get projects"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             params = self.request.GET
-            response = ProjectModule.search_by_filter_params(params, database)
+            if params.get('stream') in ('1', 'true'):
+                if params.get('q'):
+                    raise Exception('q is not supported with stream', 400)
 
-            self.response_send(response)
+                parts = ProjectModule.stream_by_filter_params(params, database)
+                self.response.headers['Content-Type'] = 'application/json'
+                self.response.app_iter = parts
+                return
+
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(ProjectModule.search_json_by_filter_params(params, database))
 
         except Exception as error:
             self.response_error(error)
@@ -25,7 +38,7 @@ class ProjectsHandler(BaseHandler):
     def post(self):
         """Create project"""
         try:
-            database = None # to implement]
+            database = get_database(self.request)
             params = self.request.GET
             project = ProjectModule.create(params, database)
 
@@ -38,18 +51,106 @@ class ProjectsHandler(BaseHandler):
             self.response_error(error)
 
 
+class ProjectsBulkHandler(BaseHandler):
+    """Class for ProjectsBulkHandler"""
+
+    def post(self):
+        """Create projects from a JSON array or NDJSON body"""
+        try:
+            database = get_database(self.request)
+            items = loads_items(self.request.body, self.request.content_type)
+            transaction_size = get_transaction_size(self.request.GET)
+
+            response = ProjectModule.bulk_create(items, database, transaction_size)
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+
+class ProjectsStatusHandler(BaseHandler):
+    """Class for ProjectsStatusHandler"""
+
+    def put(self):
+        """Set the status of all projects matching the filters"""
+        try:
+            database = get_database(self.request)
+            params = self.request.GET
+            body = json.loads(self.request.body)
+
+            response = ProjectModule.update_status_by_filter_params(
+                params, body.get('status'), database)
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+
+class ProjectsExportHandler(BaseHandler):
+    """Class for ProjectsExportHandler"""
+
+    def get(self):
+        """Export projects as NDJSON or CSV"""
+        try:
+            database = get_database(self.request)
+            params = self.request.GET
+            if params.get('q'):
+                raise Exception('q is not supported with export', 400)
+            export_format = get_export_format(params)
+            gzip = accepts_gzip(self.request.headers)
+            parts = ProjectModule.export_by_filter_params(params, database, export_format, gzip)
+
+            self.response.headers['Content-Type'] = EXPORT_CONTENT_TYPES[export_format]
+            self.response.headers['Content-Disposition'] = \
+                'attachment; filename="projects.{0}"'.format(export_format)
+            self.response.headers['Vary'] = 'Accept-Encoding'
+            if gzip:
+                self.response.headers['Content-Encoding'] = 'gzip'
+            self.response.app_iter = parts
+
+        except Exception as error:
+            self.response_error(error)
+
+
+class ProjectsStatsHandler(BaseHandler):
+    """Class for ProjectsStatsHandler"""
+
+    def get(self):
+        """Get project counts by status, overdue and by assigned user"""
+        try:
+            database = get_database(self.request)
+            response = ProjectStatsModule.get_stats(database)
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+
 class ProjectHandler(BaseHandler):
     """Class for ProjectHandlerProjectHandler"""
 
     def get(self, project_id):
         """Get project"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             db_session = DBSessionManage(database).get_db_session()
 
-            project = Project.get_by_id(project_id, db_session)
-            project_dict = project.to_dict()
-            project_dict['comments'] = ProjectComments.get_all_by_project_id(project_id, db_session)
+            etag = ProjectModule.get_etag(project_id, db_session)
+            if not etag:
+                db_session.close()
+                raise Exception('Project not found', 404)
+
+            set_validator_headers(self.response, etag)
+            if is_not_modified(self.request, etag):
+                db_session.close()
+                self.response_send(status_code=304)
+                return
+
+            project_dict = ProjectModule.get_detail(
+                project_id, self.request.GET.get('comments_limit'), database, db_session, etag)
 
             db_session.close()
 
@@ -61,13 +162,13 @@ class ProjectHandler(BaseHandler):
     def put(self, project_id):
         """Update project"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             db_session = DBSessionManage(database).get_db_session()
             params = json.loads(self.request.body)
 
             project = Project.get_by_id(project_id, db_session)
 
-            ProjectModule.update(project, params, db_session)
+            ProjectModule.update(project, params, db_session, database)
 
             db_session.close()
 
@@ -81,16 +182,35 @@ class ProjectHandler(BaseHandler):
     def delete(self, project_id):
         """Delete project"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             db_session = DBSessionManage(database).get_db_session()
 
             project = Project.get_by_id(project_id, db_session)
             if not project:
+                db_session.close()
                 raise Exception('Project not found', 404)
 
-            ProjectModule.delete(project, db_session)
+            ProjectModule.delete(project, db_session, database)
+
+            db_session.close()
 
             self.response_send(status_code=204)
 
         except Exception as error:
             self.response_error(error)
+
+
+class ProjectCommentsHandler(BaseHandler):
+    """Class for ProjectCommentsHandler"""
+
+    def get(self, project_id):
+        """Get a page of project comments"""
+        try:
+            database = get_database(self.request)
+            params = self.request.GET
+            response = ProjectCommentsModule.search_by_project_id(project_id, params, database)
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
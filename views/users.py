@@ -1,10 +1,13 @@
 import json
 
-from urllib.request import BaseHandler
-
 from models.user import User
 from modules.user import UserModule
+from modules.bulk import get_transaction_size
+from modules.conditional import is_not_modified, set_validator_headers
 from modules.db_session_manage import DBSessionManage
+from modules.serializer import EXPORT_CONTENT_TYPES, accepts_gzip, get_export_format, loads_items
+from modules.tenant import get_database
+from views.base import BaseHandler
 
 
 class UsersHandler(BaseHandler):
@@ -13,11 +16,16 @@ class UsersHandler(BaseHandler):
     def get(self):
         """Get users"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             params = self.request.GET
-            response = UserModule.search_by_filter_params(params, database)
+            if params.get('stream') in ('1', 'true'):
+                parts = UserModule.stream_by_filter_params(params, database)
+                self.response.headers['Content-Type'] = 'application/json'
+                self.response.app_iter = parts
+                return
 
-            self.response_send(response)
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(UserModule.search_json_by_filter_params(params, database))
 
         except Exception as error:
             self.response_error(error)
@@ -25,7 +33,7 @@ class UsersHandler(BaseHandler):
     def post(self):
         """Create user"""
         try:
-            database = None # to implement]
+            database = get_database(self.request)
             params = self.request.GET
             user = UserModule.create(params, database)
 
@@ -38,17 +46,71 @@ class UsersHandler(BaseHandler):
             self.response_error(error)
 
 
+class UsersBulkHandler(BaseHandler):
+    """Class for UsersBulkHandler"""
+
+    def post(self):
+        """Create users from a JSON array or NDJSON body"""
+        try:
+            database = get_database(self.request)
+            items = loads_items(self.request.body, self.request.content_type)
+            transaction_size = get_transaction_size(self.request.GET)
+
+            response = UserModule.bulk_create(items, database, transaction_size)
+
+            self.response_send(response)
+
+        except Exception as error:
+            self.response_error(error)
+
+
+class UsersExportHandler(BaseHandler):
+    """Class for UsersExportHandler"""
+
+    def get(self):
+        """Export users as NDJSON or CSV"""
+        try:
+            database = get_database(self.request)
+            params = self.request.GET
+            export_format = get_export_format(params)
+            gzip = accepts_gzip(self.request.headers)
+            parts = UserModule.export_by_filter_params(params, database, export_format, gzip)
+
+            self.response.headers['Content-Type'] = EXPORT_CONTENT_TYPES[export_format]
+            self.response.headers['Content-Disposition'] = \
+                'attachment; filename="users.{0}"'.format(export_format)
+            self.response.headers['Vary'] = 'Accept-Encoding'
+            if gzip:
+                self.response.headers['Content-Encoding'] = 'gzip'
+            self.response.app_iter = parts
+
+        except Exception as error:
+            self.response_error(error)
+
+
 class UserHandler(BaseHandler):
     """Class for UserHandler"""
 
     def get(self, user_id):
         """Get user"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             db_session = DBSessionManage(database).get_db_session()
 
-            user = User.get_by_id(user_id, db_session)
-            user_dict = user.to_dict()
+            etag = UserModule.get_etag(user_id, db_session)
+            if not etag:
+                db_session.close()
+                raise Exception('User not found', 404)
+
+            set_validator_headers(self.response, etag)
+            if is_not_modified(self.request, etag):
+                db_session.close()
+                self.response_send(status_code=304)
+                return
+
+            user_dict = UserModule.get_dict_by_id(user_id, database, db_session, etag)
+            if not user_dict:
+                raise Exception('User not found', 404)
 
             db_session.close()
 
@@ -60,13 +122,13 @@ class UserHandler(BaseHandler):
     def put(self, user_id):
         """Update user"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             db_session = DBSessionManage(database).get_db_session()
             params = json.loads(self.request.body)
 
             user = User.get_by_id(user_id, db_session)
 
-            UserModule.update(user, params, db_session)
+            UserModule.update(user, params, db_session, database)
 
             db_session.close()
 
@@ -80,14 +142,17 @@ class UserHandler(BaseHandler):
     def delete(self, user_id):
         """Delete user"""
         try:
-            database = None # to implement
+            database = get_database(self.request)
             db_session = DBSessionManage(database).get_db_session()
 
             user = User.get_by_id(user_id, db_session)
             if not user:
+                db_session.close()
                 raise Exception('User not found', 404)
 
-            UserModule.delete(user, db_session)
+            UserModule.delete(user, db_session, database)
+
+            db_session.close()
 
             self.response_send(status_code=204)
 